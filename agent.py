@@ -1,12 +1,69 @@
 import json
 import os
-from generate_json import classify_input, generate_json
+import sys
+import threading
+import generate_json
+from records import ClassOutput, ClassRef, Clazz, Course, HeaderTeacher, TeacherAssignment, plain
+from roster import Roster
+from roster_snapshot import load_or_compile
+from roster_stream import iter_class_records, iter_teacher_records
+from pipeline import iter_each_segment_json, iter_input_json
+from coalesce import OutputIndex, coalesce_output
+from compact_output import compact_items
+from incremental import RunManifest, roster_version, segment_key
+from occupancy import OccupancyModel, format_conflict
+from output_sink import load_output_array, open_output_sink, write_json_atomic
+from rule_classifier import split_segments
 from itertools import zip_longest
+from metrics import record_payload, span, traced
 
 
+class_info_filename = 'class_info.json'
+teacher_info_filename = 'teacher_info.json'
 output_filename = 'output_data.json'
+# 增量处理（python agent.py constraints.txt）记录每个分段的分类和输出，下次运行时复用没有变化的分段
+manifest_filename = 'output_data.manifest.json'
+# 'jsonl'：逐条追加到 output_data.jsonl，结束时合并进 output_filename；
+# 'batch'：结果缓存在内存中，结束时一次性写入 output_filename
+# 'compact'：同 'batch'，但重复的 classes / courses / teachers 数组只写一次并按 id 引用，
+# 用 python compact_output.py expand 还原为原来的格式
+output_mode = 'jsonl'
+output_indent = 4
+# 'two_stage'：先分类再逐段提取（规则和本地提取优先）；'combined'：分类和提取合并为一次 LLM 请求
+extraction_mode = 'two_stage'
+# 加载 roster 时使用 class_info 旁边的二进制快照（如 class_info.snapshot），源文件变化后自动重建
+roster_snapshot_enabled = True
+# 超过这个大小（字节）的 roster 文件用流式解析，避免一次性 json.load 整个文档
+roster_stream_threshold = 32 * 1024 * 1024
+# 处理函数的输出先经过 coalesce：合并 classes / courses 相同的约束的 periodDays，去掉重复的约束
+coalesce_enabled = True
+
+
+
+def course_entry(course):
+    return Course(course["name"], course["uid"], course["courseDcode"])
+
+def class_row(clazz):
+    return Clazz(clazz["gradeName"], clazz["name"], clazz["uid"], clazz["type"])
+
+def teacher_row(teacher_class):
+    return TeacherAssignment(
+        teacher_class["teacher"]["name"],
+        teacher_class["teacher"]["uid"],
+        teacher_class["clazz"]["name"],
+        teacher_class["clazz"]["uid"],
+        teacher_class["course"]["name"],
+        teacher_class["course"]["uid"],
+        teacher_class["course"]["courseDcode"]
+    )
 
-
+def header_teacher_row(header_teacher):
+    return HeaderTeacher(
+        header_teacher["teacherId"],
+        header_teacher["teacherName"],
+        header_teacher["gradeDcode"],
+        header_teacher["projectSchoolClassId"]
+    )
 
 def extract_all_info(course_class_json, teacher_class_json):
     course_info = {}
@@ -14,48 +71,83 @@ def extract_all_info(course_class_json, teacher_class_json):
 
     for grade_data in course_class_json["data"]:
         for course in grade_data["courses"]:
-            course_info[course["name"]] = {
-                "uid": course["uid"],
-                "courseDcode": course["courseDcode"]
-            }
+            course_info[course["name"]] = course_entry(course)
 
         for clazz in grade_data["classes"]:
-            class_info.append({
-                "gradeName": clazz["gradeName"],
-                "name": clazz["name"],
-                "uid": clazz["uid"],
-                "type": clazz["type"]
-            })
+            class_info.append(class_row(clazz))
 
     teacher_info = []
     header_teachers = []
+    class_grade_dcodes = {}
 
     for grade_data in teacher_class_json["data"]["gradeTeacherClassList"]:
         for teacher_class in grade_data["teacherClasses"]:
-            teacher_info.append({
-                "teacherName": teacher_class["teacher"]["name"],
-                "teacherUid": teacher_class["teacher"]["uid"],
-                "className": teacher_class["clazz"]["name"],
-                "classUid": teacher_class["clazz"]["uid"],
-                "courseName": teacher_class["course"]["name"],
-                "courseUid": teacher_class["course"]["uid"],
-                "courseDcode": teacher_class["course"]["courseDcode"]
-            })
+            class_grade_dcodes[teacher_class["clazz"]["name"]] = grade_data.get("gradeDecode")
+            teacher_info.append(teacher_row(teacher_class))
 
         for header_teacher in grade_data.get("headerTeachers", []):
-            header_teachers.append({
-                "teacherId": header_teacher["teacherId"],
-                "teacherName": header_teacher["teacherName"],
-                "gradeDcode": header_teacher["gradeDcode"],
-                "classId": header_teacher["projectSchoolClassId"]
-            })
+            header_teachers.append(header_teacher_row(header_teacher))
 
-    return {
-        "course_info": course_info,
-        "class_info": class_info,
-        "teacher_info": teacher_info,
-        "header_teachers": header_teachers
-    }
+    return Roster(course_info, class_info, teacher_info, header_teachers, class_grade_dcodes)
+
+# 与 extract_all_info 结果相同，但逐条读取记录，不在内存中保留整个 JSON 文档
+def stream_all_info(class_file, teacher_file):
+    course_info = {}
+    class_info = []
+    for kind, record in iter_class_records(class_file):
+        if kind == "course":
+            course_info[record["name"]] = course_entry(record)
+        else:
+            class_info.append(class_row(record))
+
+    teacher_info = []
+    header_teachers = []
+    class_grade_dcodes = {}
+    grade_class_names = []
+    for kind, record in iter_teacher_records(teacher_file):
+        if kind == "teacher_class":
+            teacher_info.append(teacher_row(record))
+            grade_class_names.append(record["clazz"]["name"])
+        elif kind == "header_teacher":
+            header_teachers.append(header_teacher_row(record))
+        else:
+            for class_name in grade_class_names:
+                class_grade_dcodes[class_name] = record
+            grade_class_names = []
+
+    return Roster(course_info, class_info, teacher_info, header_teachers, class_grade_dcodes)
+
+def parse_roster(class_path, teacher_path):
+    with open(class_path, 'r', encoding='utf-8') as f1, open(teacher_path, 'r', encoding='utf-8') as f2:
+        if max(os.path.getsize(class_path), os.path.getsize(teacher_path)) >= roster_stream_threshold:
+            return stream_all_info(f1, f2)
+        course_class_json = json.load(f1)
+        teacher_class_json = json.load(f2)
+    return extract_all_info(course_class_json, teacher_class_json)
+
+def load_roster(class_path=None, teacher_path=None):
+    class_path = class_path or class_info_filename
+    teacher_path = teacher_path or teacher_info_filename
+    if roster_snapshot_enabled:
+        return load_or_compile(class_path, teacher_path, parse_roster)
+    return parse_roster(class_path, teacher_path)
+
+_rosters = {}
+_roster_lock = threading.Lock()
+
+# 第一次使用时才读取并解析 roster，之后同一对文件共用同一个 Roster
+def get_roster(class_path=None, teacher_path=None):
+    key = (class_path or class_info_filename, teacher_path or teacher_info_filename)
+    with _roster_lock:
+        roster = _rosters.get(key)
+        if roster is None:
+            roster = load_roster(*key)
+            _rosters[key] = roster
+        return roster
+
+def clear_roster_cache():
+    with _roster_lock:
+        _rosters.clear()
 
 def get_period_of_time(time_period):
     time_str = str(time_period).strip()
@@ -105,27 +197,34 @@ def preprocess_input(json_input):
     return json_input
     
 
+# 按年级 / 课程缓存在 roster.derived 中，各处理函数共用同一个不可变的结果；
+# 重新加载 roster 时会生成新的 Roster 对象，缓存随之失效。
+# 班级的完整名称（如 "初一01班"）在输出时才拼接，见 records.ClassOutput
+# 年级 / 课程名来自 LLM 输出的 JSON，可能是数字或嵌套列表，先统一成字符串再作为缓存键
+def memo_key(value):
+    return value if isinstance(value, str) else str(value)
+
+def memo_keys(values):
+    return tuple(memo_key(value) for value in values)
+
 def extract_class_data(course_class_data, grade_name):
-    return [
-        {
-            "gradeName": clazz["gradeName"],
-            "name": f"{clazz['gradeName']}{clazz['name']}",
-            "alias": "",
-            "uid": clazz["uid"],
-            "type": clazz["type"]
-        }
-        for clazz in course_class_data["class_info"]
-        if clazz["gradeName"] == grade_name
-    ]
+    grade_name = memo_key(grade_name)
+    return course_class_data.memoize("class_data", grade_name, lambda: tuple(
+        ClassOutput(clazz) for clazz in course_class_data.classes_in_grade(grade_name)
+    ))
+
+def extract_grades_class_data(course_class_data, grades):
+    grades = memo_keys(grades)
+    return course_class_data.memoize("grades_class_data", grades, lambda: tuple(
+        clazz for grade in grades for clazz in extract_class_data(course_class_data, grade)
+    ))
 
 def extract_course_info(course_class_data, subjects):
-    courses = []
-    for subject in subjects:
-        course_info = course_class_data["course_info"].get(subject)
-        if not course_info:
-            course_info = {"name": subject, "uid": "", "courseDcode": ""}
-        courses.append({"name": subject, "uid": course_info["uid"], "courseDcode": course_info["courseDcode"]})
-    return courses
+    subjects = memo_keys(subjects)
+    return course_class_data.memoize("course_data", subjects, lambda: tuple(
+        course_class_data["course_info"].get(subject) or Course(subject, "", "")
+        for subject in subjects
+    ))
 
 def create_constraint_json(classes, courses, period_days, constraint_type, limits=1, maxlimits=-1):
     return {
@@ -147,25 +246,15 @@ def find_relevant_classes(course_class_data, grades, formatted_classes=None):
     if formatted_classes is None:
         formatted_classes = [f"{int(c):02d}班" for c in grades]
     
-    return [
-        {
-            "uid": clazz["uid"],
-            "name": f"{clazz['gradeName']}{clazz['name']}"
-        }
-        for clazz in course_class_data["class_info"]
-        if clazz["gradeName"] in grades and clazz["name"] in formatted_classes
-    ]
+    return [ClassRef(clazz) for clazz in course_class_data.find_classes(grades, formatted_classes)]
 
 def find_relevant_class(course_class_data, grade, clazz):
     relevant_classes = find_relevant_classes(course_class_data, [grade], [clazz])
     return relevant_classes[0] if relevant_classes else None
 
 def find_teacher_info(course_class_data, teacher_name):
-    return next(
-        (teacher for teacher in course_class_data["teacher_info"]
-         if teacher["teacherName"].strip() == teacher_name),
-        None
-    )
+    teachers = course_class_data.teachers_named(teacher_name)
+    return teachers[0] if teachers else None
 
 def find_course_info(course_class_data, subject):
     course_info = course_class_data["course_info"].get(subject)
@@ -175,10 +264,7 @@ def find_course_info(course_class_data, subject):
 
 def find_relevant_teachers(teacher_class_data, grade_name, course_name):
     course_name = course_name.replace("老师", "")  
-    return [
-        teacher for teacher in teacher_class_data["teacher_info"]
-        if grade_name in teacher["className"] and course_name in teacher["courseName"]
-    ]
+    return teacher_class_data.find_teachers(grade_name, course_name)
 
 def create_teacher_constraint(teachers, period, day, constraint_type="MUST_ASSIGN"):
     period_days = [{"period": int(period), "dayOfWeek": day}]
@@ -198,9 +284,9 @@ def get_teacher_courses(teacher_name, all_info):
             "name": course["courseName"],
             "uid": course["courseUid"],
             "courseDcode": course["courseDcode"],
-            "grade": next((grade["gradeName"] for grade in all_info["class_info"] if grade["uid"] == course["classUid"]), "")
+            "grade": all_info.grade_of_class(course["classUid"])
         }
-        for course in all_info['teacher_info']
+        for course in all_info.teachers_named(teacher_name.strip())
         if course['teacherName'] == teacher_name
     ]
 
@@ -284,8 +370,8 @@ def map_grade_names(courses):
 # 课程课时条件
 def firstScene(json_input, course_class_data):
     output_data = {
-        "projectId": 458,
-        "projectScenarioId": 984,
+        "projectId": course_class_data.project_id,
+        "projectScenarioId": course_class_data.course_scenario_id,
         "type": "COURSETIME",
         "constraintJsons": []
     }
@@ -322,8 +408,8 @@ def firstScene(json_input, course_class_data):
 # 初一 语文 周一到周五每天最少排一节
 def secondScene(json_input, course_class_data):
     output_data = {
-        "projectId": 458,
-        "projectScenarioId": 984,
+        "projectId": course_class_data.project_id,
+        "projectScenarioId": course_class_data.course_scenario_id,
         "type": "COURSEDAYLIMIT",
         "constraintJsons": []
     }
@@ -347,8 +433,8 @@ def secondScene(json_input, course_class_data):
 # 课程时段条件
 def thirdScene(json_input, course_class_data):
     output_data = {
-        "projectId": 458,
-        "projectScenarioId": 984,
+        "projectId": course_class_data.project_id,
+        "projectScenarioId": course_class_data.course_scenario_id,
         "type": "COURSEPERIODLIMIT",
         "constraintJsons": []
     }
@@ -380,8 +466,8 @@ def thirdScene(json_input, course_class_data):
 # 课程连堂条件
 def fourthScene(json_input, course_class_data):
     output_data = {
-        "projectId": 458,
-        "projectScenarioId": 984,
+        "projectId": course_class_data.project_id,
+        "projectScenarioId": course_class_data.course_scenario_id,
         "type": "CONSECUTIVECOURSE",
         "constraintJsons": []
     }
@@ -433,8 +519,8 @@ def fourthScene(json_input, course_class_data):
 # 课程不排同一天条件
 def fifthScene(json_input, course_class_data):
     output_data = {
-        "projectId": 458,
-        "projectScenarioId": 984,
+        "projectId": course_class_data.project_id,
+        "projectScenarioId": course_class_data.course_scenario_id,
         "type": "COURSE2COURSE",
         "constraintJsons": []
     }
@@ -490,8 +576,8 @@ def fifthScene(json_input, course_class_data):
 # 课程同一节课最多条件
 def sixthScene(json_input, course_class_data):
     output_data = {
-        "projectId": 458,
-        "projectScenarioId": 984,
+        "projectId": course_class_data.project_id,
+        "projectScenarioId": course_class_data.course_scenario_id,
         "type": "COURSE2COURSE",
         "constraintJsons": {}  
     }
@@ -500,9 +586,7 @@ def sixthScene(json_input, course_class_data):
     subjects = json_input["details"][0]["subject"]
     limits = int(json_input["details"][0]["max_classes"])
 
-    classes = []
-    for grade in grades:
-        classes.extend(extract_class_data(course_class_data, grade))
+    classes = extract_grades_class_data(course_class_data, grades)
 
     all_course_infos = []
     for subject in subjects:
@@ -528,8 +612,8 @@ def sixthScene(json_input, course_class_data):
 # 课程合班条件
 def seventhScene(json_input, course_class_data):
     output_data = {
-        "projectId": 458,
-        "projectScenarioId": 984,
+        "projectId": course_class_data.project_id,
+        "projectScenarioId": course_class_data.course_scenario_id,
         "type": "COURSESAMETIMELIMIT",
         "constraintJson": {}
     }
@@ -581,8 +665,8 @@ def seventhScene(json_input, course_class_data):
 # 课程走班关联条件
 def eighthScene(json_input, course_class_data):
     output_data = {
-        "projectId": 458,
-        "projectScenarioId": 984,
+        "projectId": course_class_data.project_id,
+        "projectScenarioId": course_class_data.course_scenario_id,
         "type": "MOVECOURSE",
         "constraintJson": {}
     }
@@ -620,8 +704,9 @@ def eighthScene(json_input, course_class_data):
 # 初二 美术(单)与音乐(双) 单双周
 def ninthScene(json_input, course_class_data):
     output_data = {
-        "projectId": 458,
-        "projectScenarioId": 985,
+        "projectId": course_class_data.project_id,
+        # 单双周条件一直写在教师条件的场景下（默认 985）
+        "projectScenarioId": course_class_data.teacher_scenario_id,
         "type": "EVENODDLINK",
         "constraintJson": ""
     }
@@ -629,9 +714,7 @@ def ninthScene(json_input, course_class_data):
     grades = json_input["details"][0]["grade"]
     subjects = json_input["details"][0]["subject"]
 
-    classes = []
-    for grade in grades:
-        classes.extend(extract_class_data(course_class_data, grade))
+    classes = extract_grades_class_data(course_class_data, grades)
 
     if len(subjects) < 2:
         raise ValueError("Error: Need at least two subjects for this constraint.")
@@ -676,8 +759,8 @@ def teacherFirst(json_input, teacher_class_data):
     constraint_json = create_teacher_constraint(relevant_teachers, period, day)
 
     output_data = {
-        "projectId": 458,
-        "projectScenarioId": 985,
+        "projectId": teacher_class_data.project_id,
+        "projectScenarioId": teacher_class_data.teacher_scenario_id,
         "type": "TEACHERTIME",
         "constraintJson": constraint_json
     }
@@ -695,8 +778,8 @@ def teacherFirst(json_input, teacher_class_data):
 # 教师各天条件
 def teacherSecond(json_input, teacher_class_data):
     output_data = {
-        "projectId": 458,
-        "projectScenarioId": 985,
+        "projectId": teacher_class_data.project_id,
+        "projectScenarioId": teacher_class_data.teacher_scenario_id,
         "type": "TEACHERDAYLIMIT",
         "constraintJson": {}
     }
@@ -747,8 +830,8 @@ def teacherSecond(json_input, teacher_class_data):
 # 教师时段条件
 def teacherThird(json_input, teacher_class_data):
     output_data = {
-        "projectId": 458,
-        "projectScenarioId": 985,
+        "projectId": teacher_class_data.project_id,
+        "projectScenarioId": teacher_class_data.teacher_scenario_id,
         "type": "TEACHERPERIODLIMIT",
         "constraintJson": {}
     }
@@ -806,8 +889,8 @@ def teacherForth(json_input, all_info):
     }
 
     return {
-        "projectId": 458,
-        "projectScenarioId": 985,
+        "projectId": all_info.project_id,
+        "projectScenarioId": all_info.teacher_scenario_id,
         "type": "TEACHERTIMEMUTEX",
         "constraintJsons": [constraint_json]
     }
@@ -819,117 +902,202 @@ def teacherFifth(json_input, all_info):
     teacher_clusters = []
     details = json_input.get("details", [])
 
-    class_to_gradeDcode = {}
-
-    for grade_data in teacher_class_json["data"]["gradeTeacherClassList"]:
-        grade_dcode = grade_data["gradeDecode"]
-        for teacher_class in grade_data["teacherClasses"]:
-            class_name = teacher_class["clazz"]["name"]
-            class_to_gradeDcode[class_name] = grade_dcode
+    class_to_gradeDcode = all_info["class_grade_dcodes"]
 
     for detail in details:
         grades = detail.get("grade", [])
         teacher_subjects = [subject.replace("老师", "") for subject in detail.get("teacher", [])]
 
-        for teacher in all_info["teacher_info"]:
+        for teacher in all_info.teachers_for_grades_courses(grades, teacher_subjects):
             course_name = teacher["courseName"]
-            grade_name = teacher["className"][:2]  
-            if grade_name in grades and course_name in teacher_subjects:
-                class_name = teacher["className"]
-                grade_dcode = class_to_gradeDcode.get(class_name)
-
-                if grade_dcode is None:
-                    raise ValueError(f"No matching gradeDcode found for class {class_name}")
-
-                teacher_clusters.append({
-                    "courses": [{
-                        "name": course_name,
-                        "uid": teacher["courseUid"],
-                        "courseDcode": teacher["courseDcode"],
-                        "gradeDcode": grade_dcode, 
-                        "checked": True
-                    }],
-                    "teacher": {
-                        "uid": teacher["teacherUid"],
-                        "name": teacher["teacherName"]
-                    },
-                    "minConsecutive": 2,
-                    "maxConsecutive": 2,
-                    "minClusterSize": 2,
-                    "maxClusterSize": 2
-                })
+            class_name = teacher["className"]
+            grade_dcode = class_to_gradeDcode.get(class_name)
+
+            if grade_dcode is None:
+                raise ValueError(f"No matching gradeDcode found for class {class_name}")
+
+            teacher_clusters.append({
+                "courses": [{
+                    "name": course_name,
+                    "uid": teacher["courseUid"],
+                    "courseDcode": teacher["courseDcode"],
+                    "gradeDcode": grade_dcode, 
+                    "checked": True
+                }],
+                "teacher": {
+                    "uid": teacher["teacherUid"],
+                    "name": teacher["teacherName"]
+                },
+                "minConsecutive": 2,
+                "maxConsecutive": 2,
+                "minClusterSize": 2,
+                "maxClusterSize": 2
+            })
 
     constraint_json = {
         "teacherTimeClusters": teacher_clusters
     }
 
     return {
-        "projectId": 458,  
-        "projectScenarioId": 985,  
+        "projectId": all_info.project_id,  
+        "projectScenarioId": all_info.teacher_scenario_id,  
         "type": "TEACHERTIMECLUSTER",
         "constraintJson": constraint_json
     }
 
-with open('class_info.json', 'r', encoding='utf-8') as f1, open('teacher_info.json', 'r', encoding='utf-8') as f2:
-    course_class_json = json.load(f1)
-    teacher_class_json = json.load(f2)
-
-all_info = extract_all_info(course_class_json, teacher_class_json)
-
-user_input = input("Please enter your input: ")
-
-
-scenario = classify_input(user_input)
-scenario = json.loads(scenario)
-# print(scenario)
-if "results" in scenario:
-    for result in scenario.get("results"):
-        print(f"Segment: {result['segment']}")
-        print(f"Classification: {result['classification']}")
-
-        json_input = json.loads(generate_json(result['segment'],result['classification']))
-        # print(json_input)
+classification_handler = {
+    "课程课时条件": firstScene,
+    "课程各天条件": secondScene,
+    "课程时段条件": thirdScene,
+    "课程连堂条件": fourthScene,
+    "课程不排同一天条件": fifthScene,
+    "课程同一节课最多条件": sixthScene,
+    "课程合班条件": seventhScene,
+    "课程走班关联条件": eighthScene,
+    "课程单双周条件": ninthScene,
+    "教师课时条件": teacherFirst,
+    "教师各天条件": teacherSecond,
+    "教师时段条件": teacherThird,
+    "教师不排同时上课条件": teacherForth,
+    "教师多班连上条件": teacherFifth
+}
+
+def handle_segment(result, segment_json, roster):
+    print(f"Segment: {result['segment']}")
+    print(f"Classification: {result['classification']}")
+
+    json_input = json.loads(segment_json)
+    # print(json_input)
+    with span("preprocess_input", classification=result['classification']):
+        record_payload("in", segment_json)
         json_input = preprocess_input(json_input)
-        print(json_input)
-        classification_handler = {
-            "课程课时条件": firstScene,
-            "课程各天条件": secondScene,
-            "课程时段条件": thirdScene,
-            "课程连堂条件": fourthScene,
-            "课程不排同一天条件": fifthScene,
-            "课程同一节课最多条件": sixthScene,
-            "课程合班条件": seventhScene,
-            "课程走班关联条件": eighthScene,
-            "课程单双周条件": ninthScene,
-            "教师课时条件": teacherFirst,
-            "教师各天条件": teacherSecond,
-            "教师时段条件": teacherThird,
-            "教师不排同时上课条件": teacherForth,
-            "教师多班连上条件": teacherFifth
-        }
-
-        # classification = json_input.get("classification")
-        handler = classification_handler.get(result['classification'])
-        if handler:
-            output = handler(json_input, all_info)
-            if os.path.exists(output_filename):
-                with open(output_filename, 'r', encoding='utf-8') as file:
-                    try:
-                        data = json.load(file)
-                    except json.JSONDecodeError:  # In case the file is empty
-                        data = []
-            else:
-                data = []
-
-            data.append(output)
-
-            with open(output_filename, 'w', encoding='utf-8') as file:
-                json.dump(data, file, ensure_ascii=False, indent=4)
-
+    print(json_input)
 
+    handler = classification_handler.get(result['classification'])
+    if not handler:
+        return None
+    with span("handler", classification=result['classification'], handler=handler.__name__):
+        output = handler(json_input, roster)
+    if coalesce_enabled:
+        with span("coalesce", classification=result['classification']):
+            output = coalesce_output(output)
+    output = plain(output)
+    print(json.dumps(output, ensure_ascii=False, indent=4))
+    return output
+
+# 处理一条用户输入，返回各分段的输出；传入 sink 时同时写入 sink，
+# 传入 occupancy（OccupancyModel）时把生成的约束折叠进去，并打印与之前约束矛盾的地方；
+# 传入 index（coalesce.OutputIndex）时跳过已经写出过的相同输出
+@traced("process_input")
+def process_input(user_input, roster=None, sink=None, mode=None, occupancy=None, index=None):
+    roster = roster if roster is not None else get_roster()
+    outputs = []
+    for result, segment_json in iter_input_json(user_input, mode or extraction_mode, roster=roster):
+        output = handle_segment(result, segment_json, roster)
+        if output is None:
+            continue
+        if index is not None and not index.add(output):
+            print("Skipping duplicate output.")
+            continue
+        outputs.append(output)
+        if occupancy is not None:
+            for conflict in occupancy.add_output(output, result['segment']):
+                print(format_conflict(conflict))
+        if sink is not None:
+            with span("output_write", classification=result['classification']):
+                sink.write(output)
+    return outputs
+
+# 增量处理：user_input 是完整的约束列表（如排课人员改了一行后重新提交整个列表）。
+# 与上次运行相比没有变化的分段直接复用 manifest 中的输出，只有新的或修改过的分段经过分类、提取和处理函数；
+# 输出文件中上次运行产生的输出换成本次列表的全部输出，列表中已删除的分段的输出随之撤回，
+# 不是由增量运行产生的输出（如交互运行写入的）保留不变。roster 变化后所有分段都重新处理。
+# 分类、提取或处理函数失败的分段不写入 manifest，下次运行时重新处理，其他分段照常保存
+@traced("process_incremental")
+def process_incremental(user_input, roster=None, mode=None, output_path=None, manifest_path=None):
+    roster = roster if roster is not None else get_roster()
+    mode = mode or extraction_mode
+    manifest = RunManifest(manifest_path or manifest_filename)
+    context = {
+        "roster": roster_version(roster),
+        "project": [roster.project_id, roster.course_scenario_id, roster.teacher_scenario_id],
+        "mode": mode,
+        "model": generate_json.cache_model(),
+        "prompt": generate_json.cache_prompt_version()
+    }
 
-        # output = sixthScene(json_input, all_info)
-        print(json.dumps(output, ensure_ascii=False, indent=4))
+    segments = split_segments(user_input)
+    keys = [segment_key(segment, context) for segment in segments]
+    pending = {}
+    for segment, key in zip(segments, keys):
+        if key in manifest.current or key in pending:
+            continue
+        if manifest.lookup(key) is None:
+            pending[key] = segment
+
+    key_of_segment = {segment: key for key, segment in pending.items()}
+    results = {key: [] for key in pending}
+    failed = set()
+
+    def segment_failed(segment, error):
+        print(f"Failed to process segment '{segment}': {type(error).__name__}: {error}")
+        failed.add(key_of_segment[segment])
+
+    for segment, result, segment_json in iter_each_segment_json(list(pending.values()), mode, roster=roster, on_error=segment_failed):
+        key = key_of_segment[segment]
+        try:
+            output = handle_segment(result, segment_json, roster)
+        except (ValueError, KeyError, TypeError, IndexError) as error:
+            segment_failed(segment, error)
+            continue
+        results[key].append({"classification": result['classification'], "output": output})
+    for key, segment in pending.items():
+        if key not in failed:
+            manifest.record(key, segment, results[key])
+
+    output_path = output_path or output_filename
+    produced = OutputIndex(manifest.previous_outputs())
+    kept = [output for output in load_output_array(output_path) if produced.add(output)]
+    outputs = []
+    occupancy = OccupancyModel()
+    occupancy.add_outputs(kept)
+    for key in dict.fromkeys(keys):
+        entry = manifest.current.get(key)
+        if entry is None:
+            continue
+        for item in entry["results"]:
+            if item["output"] is None:
+                continue
+            outputs.append(item["output"])
+            for conflict in occupancy.add_output(item["output"], entry["segment"]):
+                print(format_conflict(conflict))
+
+    written = kept + outputs
+    with span("output_write"):
+        write_json_atomic(output_path, compact_items(written) if output_mode == 'compact' else written, indent=output_indent)
+    stats = manifest.stats()
+    manifest.save()
+    print(f"Incremental run: {stats['processed']} segment(s) processed, {stats['reused']} reused, {stats['retracted']} retracted.")
+    return outputs
+
+def main():
+    roster = get_roster()
+    # python agent.py constraints.txt：增量处理整个约束列表
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'r', encoding='utf-8') as file:
+            process_incremental(file.read(), roster)
+        return
+    user_input = input("Please enter your input: ")
+    # 之前运行写入的约束也参与矛盾检查和去重
+    previous_outputs = load_output_array(output_filename)
+    occupancy = OccupancyModel()
+    occupancy.add_outputs(previous_outputs)
+    with open_output_sink(output_filename, output_mode, output_indent) as sink:
+        process_input(user_input, roster, sink, occupancy=occupancy, index=OutputIndex(previous_outputs))
+
+
+if __name__ == "__main__":
+    main()
 
 
 # json_input = json.loads(generate_json(user_input))
@@ -0,0 +1,288 @@
+import argparse
+import contextlib
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import agent
+from llm_cache import normalize_input
+from metrics import start_metrics_server
+from occupancy import OccupancyModel
+from output_schema import repair_stats
+from project_registry import ProjectRegistry
+from pipeline import extract_segment_json, iter_input_json
+from rule_classifier import classify_input_fast
+
+
+# 同时处理的输入行数
+batch_workers = 8
+# 每隔多少秒在 stderr 输出一次进度
+progress_interval = 2.0
+# 边读边处理：已经提交但还没写出结果的行数上限（相对于 workers 的倍数）
+pending_per_worker = 4
+
+
+# 逐行返回 (行号, 输入)；无法解析的行返回 (行号, InputError)，由调用方写入错误文件
+class InputError(ValueError):
+    pass
+
+def read_jsonl_input(line, column):
+    try:
+        record = json.loads(line)
+    except json.JSONDecodeError as error:
+        return InputError(f"invalid JSON: {error}")
+    if isinstance(record, str):
+        return record
+    if not isinstance(record, dict) or not isinstance(record.get(column), str):
+        return InputError(f"missing text field '{column}'")
+    return record[column]
+
+def read_inputs(path, column="input"):
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, 'r', encoding='utf-8-sig', newline='') as file:
+        if extension == '.csv':
+            reader = csv.reader(file)
+            header = next(reader, None)
+            if header is None:
+                return
+            index = header.index(column) if column in header else 0
+            if column not in header and len(header) > index and header[index].strip():
+                # 没有表头时第一行也是输入
+                yield 1, header[index]
+            for line_number, row in enumerate(reader, 2):
+                if len(row) > index and row[index].strip():
+                    yield line_number, row[index]
+        elif extension in ('.jsonl', '.ndjson'):
+            for line_number, line in enumerate(file, 1):
+                line = line.strip()
+                if line:
+                    yield line_number, read_jsonl_input(line, column)
+        else:
+            for line_number, line in enumerate(file, 1):
+                if line.strip():
+                    yield line_number, line.rstrip('\r\n')
+
+
+# 相同的 key 只计算一次，其他线程等待并共用结果（包括异常）
+class Deduplicator:
+    def __init__(self):
+        self.futures = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, function, *args):
+        with self._lock:
+            future = self.futures.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.futures[key] = future
+                self.misses += 1
+            else:
+                self.hits += 1
+        if owner:
+            try:
+                future.set_result(function(*args))
+            except Exception as error:
+                future.set_exception(error)
+        return future.result()
+
+
+class StageTimings:
+    def __init__(self):
+        self.totals = {}
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.totals[name] = self.totals.get(name, 0.0) + elapsed
+                self.counts[name] = self.counts.get(name, 0) + 1
+
+    def report(self):
+        return {
+            name: {
+                "calls": self.counts[name],
+                "total_s": round(total, 4),
+                "mean_ms": round(total / self.counts[name] * 1000, 3)
+            }
+            for name, total in self.totals.items()
+        }
+
+
+class BatchProcessor:
+    def __init__(self, roster, mode=None):
+        self.roster = roster
+        self.mode = mode or agent.extraction_mode
+        self.classifications = Deduplicator()
+        self.segments = Deduplicator()
+        self.timings = StageTimings()
+
+    # 返回 [(result, segment_json)]；两步处理时 segment_json 为 None，在 process_segment 中再提取，
+    # 合并处理时分类和提取在同一次请求中完成
+    def classify(self, user_input):
+        if self.mode == "two_stage":
+            with self.timings.stage("classify"):
+                return [(result, None) for result in json.loads(classify_input_fast(user_input)).get("results", [])]
+        with self.timings.stage("classify_extract"):
+            return list(iter_input_json(user_input, self.mode, workers=1, roster=self.roster))
+
+    def process_segment(self, result, segment_json=None):
+        if segment_json is None:
+            with self.timings.stage("extract"):
+                segment_json = extract_segment_json(result["segment"], result["classification"], self.roster)
+        with self.timings.stage("handle"):
+            return agent.handle_segment(result, segment_json, self.roster)
+
+    # 返回 (结果列表, 错误列表)，某一分段失败不影响同一行的其他分段
+    def process_line(self, line_number, user_input):
+        results, errors = [], []
+        if isinstance(user_input, InputError):
+            errors.append({"line": line_number, "input": None, "stage": "read", "error": str(user_input)})
+            return results, errors
+        try:
+            segments = self.classifications.get_or_compute(normalize_input(user_input), self.classify, user_input)
+        except Exception as error:
+            errors.append({"line": line_number, "input": user_input, "stage": "classify", "error": f"{type(error).__name__}: {error}"})
+            return results, errors
+
+        for result, segment_json in segments:
+            key = (normalize_input(result["segment"]), result["classification"])
+            try:
+                output = self.segments.get_or_compute(key, self.process_segment, result, segment_json)
+            except Exception as error:
+                errors.append({
+                    "line": line_number,
+                    "input": user_input,
+                    "segment": result["segment"],
+                    "classification": result["classification"],
+                    "stage": "extract/handle",
+                    "error": f"{type(error).__name__}: {error}"
+                })
+                continue
+            results.append({
+                "line": line_number,
+                "input": user_input,
+                "segment": result["segment"],
+                "classification": result["classification"],
+                "output": output
+            })
+        return results, errors
+
+    def stats(self):
+        return {
+            "stages": self.timings.report(),
+            "dedupe": {
+                "inputs": {"unique": self.classifications.misses, "duplicates": self.classifications.hits},
+                "segments": {"unique": self.segments.misses, "duplicates": self.segments.hits}
+            },
+            "llm_json": repair_stats()
+        }
+
+
+def write_line(file, record):
+    file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+# 结果和错误分别写入 results_path / errors_path（JSON Lines），按输入顺序输出
+def run_batch(input_path, results_path, errors_path, roster=None, workers=batch_workers, column="input", mode=None, progress=sys.stderr):
+    roster = roster if roster is not None else agent.get_roster()
+    processor = BatchProcessor(roster, mode)
+    counts = {"lines": 0, "processed": 0, "results": 0, "errors": 0, "failed_lines": 0, "conflicts": 0}
+    # 按输入顺序折叠所有结果，与前面行的约束矛盾时在结果记录中加上 conflicts
+    occupancy = OccupancyModel()
+    start = time.perf_counter()
+    last_report = start
+
+    with ThreadPoolExecutor(max_workers=workers) as executor, \
+            open(results_path, 'w', encoding='utf-8') as results_file, \
+            open(errors_path, 'w', encoding='utf-8') as errors_file:
+        inputs = read_inputs(input_path, column)
+        pending = deque()
+        while True:
+            # 保持一定数量的行在处理中，其余的行还没有读入
+            for line_number, user_input in inputs:
+                pending.append(executor.submit(processor.process_line, line_number, user_input))
+                counts["lines"] += 1
+                if len(pending) >= workers * pending_per_worker:
+                    break
+            if not pending:
+                break
+            results, errors = pending.popleft().result()
+            with processor.timings.stage("occupancy"):
+                for record in results:
+                    conflicts = occupancy.add_output(record["output"], record["segment"])
+                    if conflicts:
+                        record["conflicts"] = conflicts
+                        counts["conflicts"] += len(conflicts)
+            with processor.timings.stage("write"):
+                for record in results:
+                    write_line(results_file, record)
+                for record in errors:
+                    write_line(errors_file, record)
+            counts["processed"] += 1
+            counts["results"] += len(results)
+            counts["errors"] += len(errors)
+            counts["failed_lines"] += 1 if errors else 0
+
+            now = time.perf_counter()
+            if progress is not None and (now - last_report >= progress_interval or not pending):
+                last_report = now
+                rate = counts["processed"] / max(now - start, 1e-9)
+                progress.write(
+                    f"[{counts['processed']}/{counts['lines']}] results={counts['results']} "
+                    f"errors={counts['errors']} {rate:.1f} lines/s\n"
+                )
+                progress.flush()
+
+    summary = dict(counts)
+    summary["elapsed_s"] = round(time.perf_counter() - start, 3)
+    summary.update(processor.stats())
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run many constraint sentences through the pipeline in one process.")
+    parser.add_argument("input", help="text (one input per line), CSV or JSONL file")
+    parser.add_argument("--results", default="batch_results.jsonl")
+    parser.add_argument("--errors", default="batch_errors.jsonl")
+    parser.add_argument("--column", default="input", help="CSV column / JSONL field holding the input text")
+    parser.add_argument("--workers", type=int, default=batch_workers)
+    parser.add_argument("--mode", choices=["two_stage", "combined"], default=None)
+    parser.add_argument("--class-info", default=agent.class_info_filename)
+    parser.add_argument("--teacher-info", default=agent.teacher_info_filename)
+    parser.add_argument("--verbose", action="store_true", help="keep the handlers' console output")
+    parser.add_argument("--metrics-port", type=int, default=None, help="serve Prometheus metrics on this port while running")
+    parser.add_argument("--projects", default=None, help="projects.json; with --project-id, use that project's roster")
+    parser.add_argument("--project-id", type=int, default=None)
+    parser.add_argument("--scenario-id", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.metrics_port is not None:
+        start_metrics_server(port=args.metrics_port)
+
+    if args.projects and args.project_id is not None:
+        roster = ProjectRegistry.from_file(args.projects).get(args.project_id, args.scenario_id)
+    else:
+        roster = agent.load_roster(args.class_info, args.teacher_info)
+    with contextlib.ExitStack() as stack:
+        if not args.verbose:
+            devnull = stack.enter_context(open(os.devnull, 'w', encoding='utf-8'))
+            stack.enter_context(contextlib.redirect_stdout(devnull))
+        summary = run_batch(args.input, args.results, args.errors, roster, args.workers, args.column, args.mode)
+    sys.stderr.write(json.dumps(summary, ensure_ascii=False, indent=4) + '\n')
+
+
+if __name__ == "__main__":
+    main()
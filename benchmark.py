@@ -0,0 +1,482 @@
+import argparse
+import contextlib
+import copy
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import agent
+import generate_json
+import llm_transport
+from coalesce import coalesce_outputs, constraint_count
+from compact_output import compact_items
+from llm_backends import RecordingBackend, ReplayBackend, make_response
+from llm_cache import LLMCache
+from occupancy import OccupancyModel
+from output_schema import check_segment_json
+from output_sink import JsonLinesSink, write_json_atomic
+from records import plain
+from roster_snapshot import RosterSnapshot, compile_snapshot, source_fingerprint
+from rule_classifier import classify_input_fast
+
+
+benchmark_version = 1
+
+# 规模预设：(年级数, 每个年级的班级数, 教师数)
+scales = {
+    "small": (3, 10, 60),
+    "school": (3, 40, 200),
+    "large": (6, 60, 1200),
+    "district": (6, 400, 8000),
+}
+
+# 流式加载 roster 时峰值 RSS 比子进程启动后（已导入 agent）的基线最多高出多少 MB，超出时 benchmark 以状态 1 退出。
+# 不论 --scale 是什么，都在 rss_check_scale 规模的 roster 上检查：该规模下 json.load 整个文档约增长 76 MB，
+# 流式解析约 12 MB，上限在两者之间，流式加载退化成整体读入时检查会失败（较小的规模两者都低于上限，区分不出来）
+rss_check_scale = "district"
+rss_ceiling_mb = 32
+
+grade_names = ["初一", "初二", "初三", "高一", "高二", "高三"]
+grade_dcodes = {"初一": "J1", "初二": "J2", "初三": "J3", "高一": "S1", "高二": "S2", "高三": "S3"}
+subject_names = ["语文", "数学", "英语", "物理", "化学", "生物", "地理", "历史", "道德与法治",
+                 "体育", "音乐", "美术", "信息技术", "劳动", "综合实践1", "综合实践2", "体活"]
+surnames = "王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾肖田董袁潘于蒋蔡余杜叶程苏魏吕丁任沈姚卢姜崔钟谭陆汪范金石廖贾夏韦傅方白邹孟熊秦邱江尹薛闫段雷侯龙史陶黎贺顾毛郝龚邵万钱严覃武戴莫孔向汤"
+given_names = "伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂英华玉萍红鹏辉建林慧佳宇浩凯婷雪琳晨欣怡博文斌峰"
+day_names = ["周一", "周二", "周三", "周四", "周五"]
+
+
+def teacher_names(count, rng):
+    names = set()
+    while len(names) < count:
+        length = rng.choice((1, 2))
+        names.add(rng.choice(surnames) + "".join(rng.choice(given_names) for _ in range(length)))
+    return sorted(names)
+
+# 生成与 class_info.json / teacher_info.json 相同结构的合成数据：
+# 每个教师只教一门课，在本年级内连续带若干个班
+def generate_roster(grade_count=3, classes_per_grade=40, teacher_count=200, seed=0):
+    rng = random.Random(seed)
+    grades = grade_names[:grade_count]
+    courses = [
+        {"name": name, "uid": f"course-{index}", "courseDcode": f"C{index:03d}"}
+        for index, name in enumerate(subject_names)
+    ]
+    names = teacher_names(teacher_count, rng)
+    teachers_per_grade = max(len(courses), teacher_count // grade_count)
+
+    course_class_data = []
+    grade_teacher_classes = []
+    teacher_index = 0
+    for grade_name in grades:
+        classes = [
+            {"gradeName": grade_name, "name": f"{number:02d}班", "uid": f"class-{grade_name}-{number}", "type": "NORMAL"}
+            for number in range(1, classes_per_grade + 1)
+        ]
+        course_class_data.append({"courses": courses, "classes": classes})
+
+        # 本年级教师平均分配到各门课程
+        grade_teachers = [names[(teacher_index + offset) % len(names)] for offset in range(teachers_per_grade)]
+        teacher_index += teachers_per_grade
+        per_course = max(1, len(grade_teachers) // len(courses))
+        teacher_classes = []
+        for course_position, course in enumerate(courses):
+            pool = grade_teachers[course_position * per_course:(course_position + 1) * per_course] or grade_teachers[:1]
+            for class_position, clazz in enumerate(classes):
+                teacher_name = pool[class_position * len(pool) // len(classes)]
+                teacher_classes.append({
+                    "teacher": {"name": teacher_name, "uid": f"teacher-{names.index(teacher_name)}"},
+                    "clazz": {"name": f"{grade_name}{clazz['name']}", "uid": clazz["uid"]},
+                    "course": course
+                })
+        header_teachers = [
+            {
+                "teacherId": f"teacher-{names.index(grade_teachers[position % len(grade_teachers)])}",
+                "teacherName": grade_teachers[position % len(grade_teachers)],
+                "gradeDcode": grade_dcodes[grade_name],
+                "projectSchoolClassId": clazz["uid"]
+            }
+            for position, clazz in enumerate(classes)
+        ]
+        grade_teacher_classes.append({
+            "gradeDecode": grade_dcodes[grade_name],
+            "teacherClasses": teacher_classes,
+            "headerTeachers": header_teachers
+        })
+
+    return {"data": course_class_data}, {"data": {"gradeTeacherClassList": grade_teacher_classes}}
+
+def write_roster(directory, course_class_json, teacher_class_json):
+    os.makedirs(directory, exist_ok=True)
+    class_path = os.path.join(directory, 'class_info.json')
+    teacher_path = os.path.join(directory, 'teacher_info.json')
+    with open(class_path, 'w', encoding='utf-8') as file:
+        json.dump(course_class_json, file, ensure_ascii=False)
+    with open(teacher_path, 'w', encoding='utf-8') as file:
+        json.dump(teacher_class_json, file, ensure_ascii=False)
+    return class_path, teacher_path
+
+
+# 在单独的子进程中加载 roster 并返回峰值 RSS（MB），分别测量 json.load 整个文档和流式解析两种方式。
+# Linux 上 ru_maxrss 会继承 fork 前父进程的峰值，所以优先读取 /proc/self/status 中的 VmHWM（KB）
+rss_probe = """
+import resource, sys
+import agent
+
+def peak_kb():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // (1024 if sys.platform == 'darwin' else 1)
+
+baseline = peak_kb()
+with open(sys.argv[1], 'r', encoding='utf-8') as f1, open(sys.argv[2], 'r', encoding='utf-8') as f2:
+    if sys.argv[3] == 'stream':
+        roster = agent.stream_all_info(f1, f2)
+    else:
+        roster = agent.extract_all_info(agent.json.load(f1), agent.json.load(f2))
+print(baseline, peak_kb(), len(roster["teacher_info"]))
+"""
+
+def measure_load_rss(class_path, teacher_path):
+    report = {}
+    for method in ("json_load", "stream"):
+        completed = subprocess.run(
+            [sys.executable, "-c", rss_probe, class_path, teacher_path, method],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True
+        )
+        baseline, peak, _ = completed.stdout.split()[-3:]
+        report["baseline_mb"] = round(int(baseline) / 1024, 1)
+        report[f"{method}_peak_mb"] = round(int(peak) / 1024, 1)
+    return report
+
+# 在 rss_check_scale 规模的 roster 上测量两种加载方式比基线增长的 RSS；paths 为已经写好的该规模 roster 文件
+def check_load_rss(workdir, seed=0, ceiling=rss_ceiling_mb, paths=None):
+    if paths is None:
+        course_class_json, teacher_class_json = generate_roster(*scales[rss_check_scale], seed)
+        paths = write_roster(os.path.join(workdir, 'rss_check'), course_class_json, teacher_class_json)
+    memory = measure_load_rss(*paths)
+    return {
+        "scale": rss_check_scale,
+        "ceiling_mb": ceiling,
+        "json_load_growth_mb": round(memory["json_load_peak_mb"] - memory["baseline_mb"], 1),
+        "stream_growth_mb": round(memory["stream_peak_mb"] - memory["baseline_mb"], 1)
+    }
+
+
+# 为 14 种情境各生成 per_handler 条 (segment, classification, generate_json 输出)
+def generate_corpus(course_class_json, teacher_class_json, per_handler=20, seed=0):
+    rng = random.Random(seed)
+    grades = [grade_data["classes"][0]["gradeName"] for grade_data in course_class_json["data"]]
+    subjects = [course["name"] for course in course_class_json["data"][0]["courses"]]
+    class_count = len(course_class_json["data"][0]["classes"])
+    teachers = sorted({
+        teacher_class["teacher"]["name"]
+        for grade_data in teacher_class_json["data"]["gradeTeacherClassList"]
+        for teacher_class in grade_data["teacherClasses"]
+    })
+
+    def grade():
+        return rng.choice(grades)
+
+    def two(items):
+        return rng.sample(items, 2)
+
+    def sample(classification):
+        if classification == "课程课时条件":
+            g, (s, d1, d2), p = grade(), (rng.choice(subjects), *two(day_names)), rng.randint(1, 9)
+            return f"{g} {s} {d1}第{p}节;{d2}第{p}节不排", {"grade": [g], "day": [d1, d2], "period": [p, p], "subject": [s, "不排"]}
+        if classification == "课程各天条件":
+            g, s = grade(), rng.choice(subjects)
+            return f"{g} {s} 周一到周五每天最少排一节", {"grade": [g], "day": day_names, "subject": [s], "max_classes": 1}
+        if classification == "课程时段条件":
+            g, s, d, p = grade(), rng.choice(subjects), rng.choice(day_names), rng.randint(1, 9)
+            return f"{g} {s} {d}第{p}节必排一节", {"grade": [g], "day": [d], "period": [p], "subject": [s], "min_classes": 1}
+        if classification == "课程连堂条件":
+            g, s, d = grade(), rng.choice(subjects), rng.choice(day_names)
+            return f"{g} {s} {d}下午连堂一次", {"grade": [g], "day": [d], "time_period": ["下午"], "subject": [s]}
+        if classification == "课程不排同一天条件":
+            g, (a, b) = grade(), two(subjects)
+            return f"{g} {a}与{b}不排同一天", {"grade": [g], "subject": [a, b]}
+        if classification == "课程同一节课最多条件":
+            gs, s, n = sorted(rng.sample(grades, min(2, len(grades)))), rng.choice(subjects), rng.randint(1, 4)
+            return f"{''.join(gs)} {s} 同一节课最多{n}个班", {"grade": gs, "subject": [s], "max_classes": n}
+        if classification == "课程合班条件":
+            g, s, t = grade(), rng.choice(subjects), rng.choice(teachers)
+            a, b = sorted(rng.sample(range(1, class_count + 1), 2))
+            return f"{s} {t} {g}{a:02d}班;{g}{b:02d}班合班上课", {"grade": [g, g], "class": [a, b], "subject": [s], "teacher": [t]}
+        if classification == "课程走班关联条件":
+            g, (s1, s2) = grade(), two(subjects)
+            a, b = sorted(rng.sample(range(1, class_count + 1), 2))
+            return f"{g}{a:02d}班{s1}与{g}{b:02d}班{s2}走班关联", {"grade": [g, g], "class": [a, b], "subject": [s1, s2]}
+        if classification == "课程单双周条件":
+            g, (a, b) = grade(), two(subjects)
+            return f"{g} {a}(单)与{b}(双) 单双周", {"grade": [g], "subject": [a, b]}
+        if classification == "教师课时条件":
+            g, s, d, p = grade(), rng.choice(subjects), rng.choice(day_names), rng.randint(1, 9)
+            return f"{g} {s}老师 {d}第{p}节 必排", {"grade": [g], "teacher": [f"{s}老师"], "day": [d], "period": [p], "max_classes": 1}
+        if classification == "教师各天条件":
+            g, s, d = grade(), rng.choice(subjects), rng.choice(day_names)
+            return f"{g} {s}老师 {d}下午 不排", {"grade": [g], "teacher": [f"{s}老师"], "day": [d], "time_period": ["下午"], "min_classes": 0}
+        if classification == "教师时段条件":
+            p, n = rng.randint(1, 9), rng.randint(1, 4)
+            return f"所有老师 整个周第{p}节 最多排{n}节", {"teacher": ["所有老师"], "day": day_names, "period": [p] * 5, "max_classes": n}
+        if classification == "教师不排同时上课条件":
+            a, b = two(teachers)
+            return f"{a} {b} 不排同一节", {"teacher": [a, b]}
+        if classification == "教师多班连上条件":
+            g, s = grade(), rng.choice(subjects)
+            return f"{g}{s}老师 不同班级的{s}课连着上", {"grade": [g], "teacher": [f"{s}老师"]}
+        raise ValueError(f"Unknown classification '{classification}'.")
+
+    corpus = []
+    for classification in agent.classification_handler:
+        for _ in range(per_handler):
+            segment, detail = sample(classification)
+            corpus.append({
+                "segment": segment,
+                "classification": classification,
+                "json_input": {"classification": classification, "details": [detail]}
+            })
+    return corpus
+
+# 模拟 LLM 常见的格式错误：节次、班级写成字符串，逗号写成句点，漏掉第一个数组后面的逗号
+def damage_segment_json(json_input):
+    details = [
+        {key: [str(item) for item in value] if key in ("period", "class") else value for key, value in detail.items()}
+        for detail in json_input["details"]
+    ]
+    text = json.dumps(dict(json_input, details=details), ensure_ascii=False, indent=4)
+    return text.replace('",\n', '".\n').replace('],\n', ']\n', 1)
+
+# 录制阶段使用：根据 prompt 中的用户输入，从语料中找到对应的 generate_json 输出
+class CorpusBackend:
+    name = "corpus"
+
+    def __init__(self, corpus):
+        self.responses = {
+            f'用户输入："{sample["segment"]}"': json.dumps(sample["json_input"], ensure_ascii=False)
+            for sample in corpus
+        }
+
+    def complete(self, messages, model, timeout, **kwargs):
+        prompt = messages[-1]["content"]
+        for marker, content in self.responses.items():
+            if marker in prompt:
+                return make_response(content, model, {"prompt_tokens": len(prompt), "completion_tokens": len(content)})
+        raise KeyError("Segment not found in benchmark corpus.")
+
+    async def acomplete(self, messages, model, timeout, **kwargs):
+        return self.complete(messages, model, timeout, **kwargs)
+
+    def is_retryable(self, error):
+        return False
+
+    def is_rate_limited(self, error):
+        return False
+
+    def close(self):
+        pass
+
+    async def aclose(self):
+        pass
+
+
+class StageTimer:
+    def __init__(self):
+        self.samples = {}
+
+    def time(self, stage, function, *args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        self.samples.setdefault(stage, []).append(time.perf_counter() - start)
+        return result
+
+    def report(self):
+        report = {}
+        for stage, samples in self.samples.items():
+            ordered = sorted(samples)
+            report[stage] = {
+                "calls": len(samples),
+                "total_s": round(sum(samples), 6),
+                "mean_ms": round(statistics.fmean(samples) * 1000, 4),
+                "p50_ms": round(ordered[len(ordered) // 2] * 1000, 4),
+                "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 4),
+                "max_ms": round(ordered[-1] * 1000, 4)
+            }
+        return report
+
+
+def run_benchmark(scale="school", per_handler=20, repeat=3, seed=0, workdir=None, rss_ceiling=rss_ceiling_mb):
+    grade_count, classes_per_grade, teacher_count = scales[scale]
+    timer = StageTimer()
+    workdir = workdir or tempfile.mkdtemp(prefix="scheduling-bench-")
+
+    course_class_json, teacher_class_json = generate_roster(grade_count, classes_per_grade, teacher_count, seed)
+    class_path, teacher_path = write_roster(workdir, course_class_json, teacher_class_json)
+    corpus = generate_corpus(course_class_json, teacher_class_json, per_handler, seed)
+
+    for _ in range(repeat):
+        def load():
+            with open(class_path, 'r', encoding='utf-8') as f1, open(teacher_path, 'r', encoding='utf-8') as f2:
+                return json.load(f1), json.load(f2)
+        loaded_class_json, loaded_teacher_json = timer.time("load_json", load)
+        all_info = timer.time("extract_all_info", agent.extract_all_info, loaded_class_json, loaded_teacher_json)
+
+    snapshot_path = os.path.join(workdir, 'roster.snapshot')
+    sources = [source_fingerprint(class_path), source_fingerprint(teacher_path)]
+    for _ in range(repeat):
+        timer.time("compile_snapshot", compile_snapshot, all_info, sources, snapshot_path)
+        timer.time("load_snapshot", lambda: RosterSnapshot(snapshot_path).to_roster())
+
+    # 用回放后端替换 LLM：先通过 CorpusBackend 录制一遍，再从录制文件回放
+    recordings = os.path.join(workdir, 'llm_recordings.jsonl')
+    if os.path.exists(recordings):
+        os.remove(recordings)
+    previous_cache = generate_json.llm_cache
+    generate_json.llm_cache = LLMCache(os.path.join(workdir, 'llm_cache.sqlite3'))
+    try:
+        generate_json.llm_cache.clear()
+        llm_transport.set_backend(RecordingBackend(CorpusBackend(corpus), recordings))
+        for sample in corpus:
+            generate_json.generate_json(sample["segment"], sample["classification"])
+        generate_json.llm_cache.clear()
+
+        llm_transport.set_backend(ReplayBackend(recordings))
+        for sample in corpus:
+            timer.time("classify_input_fast", classify_input_fast, sample["segment"])
+            timer.time("generate_json_replay", generate_json.generate_json, sample["segment"], sample["classification"])
+        for sample in corpus:
+            timer.time("generate_json_cached", generate_json.generate_json, sample["segment"], sample["classification"])
+    finally:
+        generate_json.llm_cache.close()
+        generate_json.llm_cache = previous_cache
+        llm_transport.close_backend()
+
+    # 语料中的结果原样通过校验；损坏后的结果在本地修复，不需要重新请求
+    repair_statuses = {}
+    for _ in range(repeat):
+        repair_statuses = {}
+        for sample in corpus:
+            timer.time("validate_segment_json", check_segment_json, json.dumps(sample["json_input"], ensure_ascii=False), sample["classification"])
+            damaged = damage_segment_json(sample["json_input"])
+            status = timer.time("repair_segment_json", check_segment_json, damaged, sample["classification"])[0]
+            repair_statuses[status] = repair_statuses.get(status, 0) + 1
+
+    handlers = agent.classification_handler
+    handler_names = {classification: handler.__name__ for classification, handler in handlers.items()}
+    outputs = []
+    for _ in range(repeat):
+        outputs = []
+        for sample in corpus:
+            json_input = timer.time("preprocess_input", agent.preprocess_input, copy.deepcopy(sample["json_input"]))
+            handler = handlers[sample["classification"]]
+            output = timer.time(handler_names[sample["classification"]], handler, json_input, all_info)
+            outputs.append(output)
+
+    # 把每个输出折叠进占用位图并检查冲突
+    for _ in range(repeat):
+        occupancy = OccupancyModel()
+        for output in outputs:
+            timer.time("occupancy_fold", occupancy.add_output, output)
+
+    coalesced = outputs
+    for _ in range(repeat):
+        coalesced = timer.time("coalesce_outputs", coalesce_outputs, outputs)
+
+    # 与 agent.handle_segment 一致：写出前把处理函数的输出视图转成普通的 dict / list
+    for _ in range(repeat):
+        plain_outputs = [timer.time("output_plain", plain, output) for output in outputs]
+    outputs = plain_outputs
+
+    output_path = os.path.join(workdir, 'output_data.json')
+    compact_path = os.path.join(workdir, 'output_data.compact.json')
+    for _ in range(repeat):
+        timer.time("output_json_array", write_json_atomic, output_path, outputs, 4)
+        timer.time("output_json_array_compact", write_json_atomic, output_path, outputs, None)
+        timer.time("output_json_refs", lambda: write_json_atomic(compact_path, compact_items(outputs), None))
+
+        def write_lines():
+            jsonl_path = os.path.join(workdir, 'output_data.jsonl')
+            if os.path.exists(jsonl_path):
+                os.remove(jsonl_path)
+            with JsonLinesSink(jsonl_path) as sink:
+                for output in outputs:
+                    sink.write(output)
+        timer.time("output_jsonl", write_lines)
+
+    return {
+        "benchmark_version": benchmark_version,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scale": {
+            "name": scale,
+            "grades": grade_count,
+            "classes_per_grade": classes_per_grade,
+            "teachers": teacher_count,
+            "class_rows": len(all_info["class_info"]),
+            "teacher_rows": len(all_info["teacher_info"]),
+            "class_info_bytes": os.path.getsize(class_path),
+            "teacher_info_bytes": os.path.getsize(teacher_path)
+        },
+        "corpus": {"per_handler": per_handler, "samples": len(corpus), "repeat": repeat, "seed": seed},
+        "output_bytes": os.path.getsize(output_path),
+        "output_refs_bytes": os.path.getsize(compact_path),
+        "output_constraints": sum(constraint_count(output) for output in outputs),
+        "coalesced_constraints": sum(constraint_count(output) for output in coalesced),
+        "json_repair": repair_statuses,
+        "roster_memory": measure_load_rss(class_path, teacher_path),
+        "rss_check": check_load_rss(workdir, seed, rss_ceiling, (class_path, teacher_path) if scale == rss_check_scale else None),
+        "prompts": generate_json.prompt_compiler.report(corpus, generate_json.generate_prompt, generate_json.classify_prompt),
+        "stages": timer.report()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the constraint pipeline with a replayed LLM.")
+    parser.add_argument("--scale", choices=sorted(scales), default="school")
+    parser.add_argument("--per-handler", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=None, help="directory for the generated roster, recordings and output")
+    parser.add_argument("--output", default=None, help="write the JSON report here instead of stdout")
+    parser.add_argument("--rss-ceiling", type=float, default=rss_ceiling_mb,
+                        help=f"MB of RSS the streaming load of a {rss_check_scale}-scale roster may add over the baseline")
+    args = parser.parse_args()
+
+    # 处理函数中的 print 输出不混入 JSON 报告
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+        report = run_benchmark(args.scale, args.per_handler, args.repeat, args.seed, args.workdir, args.rss_ceiling)
+    text = json.dumps(report, ensure_ascii=False, indent=4)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(text)
+    else:
+        sys.stdout.write(text + '\n')
+
+    check = report["rss_check"]
+    ceiling, growth = check["ceiling_mb"], check["stream_growth_mb"]
+    if growth > ceiling:
+        sys.stderr.write(f"Streaming roster load added {growth} MB RSS over the baseline, above the {ceiling} MB ceiling.\n")
+        sys.exit(1)
+    # json.load 也在上限以内时，这个检查区分不出流式加载是否退化
+    if check["json_load_growth_mb"] <= ceiling:
+        sys.stderr.write(f"json.load of the {check['scale']} roster added only {check['json_load_growth_mb']} MB, "
+                         f"not above the {ceiling} MB ceiling; the RSS check cannot detect a regression.\n")
+        sys.exit(1)
+    sys.stderr.write(f"Streaming roster load added {growth} MB RSS over the baseline "
+                     f"(json.load {check['json_load_growth_mb']} MB, ceiling {ceiling} MB).\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import hashlib
+import json
+import sys
+
+from records import json_default
+
+
+# 这些类型的 periodDays 是一组固定时间，classes / courses / constraintType / limits 相同的约束可以合并成一条
+mergeable_types = ("COURSETIME", "COURSEPERIODLIMIT")
+
+
+# 元组按数组输出，Record 视图经 json_default 转成 dict，都在 json 的 C 实现中完成
+def canonical_json(value):
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(',', ':'), default=json_default)
+
+# 按星期、节次排序；值不是整数（上游没有转换）时排在最后
+def period_day_key(period_day):
+    day, period = period_day.get("dayOfWeek"), period_day.get("period")
+    return (
+        day if isinstance(day, int) else float("inf"),
+        period if isinstance(period, int) else float("inf"),
+        canonical_json(period_day)
+    )
+
+
+# classes / courses 多为处理函数共用的同一个元组（见 agent.extract_class_data），按对象身份缓存它们的规范形式
+class CanonicalCache:
+    def __init__(self):
+        self.values = {}
+
+    def __call__(self, value):
+        if not isinstance(value, tuple):
+            return canonical_json(value)
+        cached = self.values.get(id(value))
+        if cached is not None and cached[0] is value:
+            return cached[1]
+        text = canonical_json(value)
+        self.values[id(value)] = (value, text)
+        return text
+
+    def hash(self, value):
+        return hashlib.sha256(self(value).encode('utf-8')).hexdigest()
+
+    def key(self, constraint, exclude=()):
+        if not isinstance(constraint, dict):
+            return self(constraint)
+        return tuple((key, self(value)) for key, value in sorted(constraint.items()) if key not in exclude)
+
+
+def merge_constraints(constraints, canonical=None):
+    canonical = canonical or CanonicalCache()
+    merged = []
+    groups = {}
+    for constraint in constraints:
+        if not isinstance(constraint, dict) or not isinstance(constraint.get("periodDays"), list):
+            merged.append(constraint)
+            continue
+        key = canonical.key(constraint, ("periodDays",))
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = (dict(constraint), {})
+            merged.append(group[0])
+        for period_day in constraint["periodDays"]:
+            group[1].setdefault(period_day_key(period_day), period_day)
+    for constraint, period_days in groups.values():
+        constraint["periodDays"] = [period_days[key] for key in sorted(period_days)]
+    return merged
+
+def drop_duplicates(constraints, canonical=None):
+    canonical = canonical or CanonicalCache()
+    seen = set()
+    unique = []
+    for constraint in constraints:
+        key = canonical.key(constraint)
+        if key in seen:
+            continue
+        seen.add(key)
+        unique.append(constraint)
+    return unique
+
+# 一个处理函数的输出：可合并的类型把 periodDays 合并，其他类型只去掉完全相同的约束。返回新的 dict，不修改原输出
+def coalesce_output(output, canonical=None):
+    if not isinstance(output, dict) or not isinstance(output.get("constraintJsons"), list):
+        return output
+    canonical = canonical or CanonicalCache()
+    constraints = output["constraintJsons"]
+    if output.get("type") in mergeable_types:
+        coalesced = merge_constraints(constraints, canonical)
+    else:
+        coalesced = drop_duplicates(constraints, canonical)
+    return dict(output, constraintJsons=coalesced)
+
+
+# 整个输出文件：去掉完全相同的输出，并把头部（projectId、type 等）相同的可合并输出合成一个
+def coalesce_outputs(outputs):
+    canonical = CanonicalCache()
+    merged = []
+    groups = {}
+    seen = set()
+    for output in outputs:
+        digest = canonical.hash(output)
+        if digest in seen:
+            continue
+        seen.add(digest)
+        if isinstance(output, dict) and output.get("type") in mergeable_types and isinstance(output.get("constraintJsons"), list):
+            header = canonical.key(output, ("constraintJsons",))
+            group = groups.get(header)
+            if group is None:
+                group = groups[header] = dict(output, constraintJsons=list(output["constraintJsons"]))
+                merged.append(group)
+            else:
+                group["constraintJsons"].extend(output["constraintJsons"])
+            continue
+        merged.append(coalesce_output(output, canonical))
+    for group in groups.values():
+        group["constraintJsons"] = merge_constraints(group["constraintJsons"], canonical)
+    return merged
+
+
+def constraint_count(output):
+    if isinstance(output, dict) and isinstance(output.get("constraintJsons"), list):
+        return len(output["constraintJsons"])
+    return 1
+
+
+# 记录已经写出的输出的哈希，重复运行同一条输入时不再追加相同的输出
+class OutputIndex:
+    def __init__(self, outputs=()):
+        self.hashes = set()
+        self.canonical = CanonicalCache()
+        for output in outputs:
+            self.add(output)
+
+    def add(self, output):
+        digest = self.canonical.hash(output)
+        if digest in self.hashes:
+            return False
+        self.hashes.add(digest)
+        return True
+
+
+# python coalesce.py output_data.json [output]：合并已有的输出文件
+def main():
+    from output_sink import load_output_array, write_json_atomic
+
+    input_path = sys.argv[1] if len(sys.argv) > 1 else "output_data.json"
+    output_path = sys.argv[2] if len(sys.argv) > 2 else input_path
+    outputs = load_output_array(input_path)
+    coalesced = coalesce_outputs(outputs)
+    write_json_atomic(output_path, coalesced)
+    before = sum(constraint_count(output) for output in outputs)
+    after = sum(constraint_count(output) for output in coalesced)
+    print(f"Coalesced {len(outputs)} outputs ({before} constraints) into {len(coalesced)} outputs ({after} constraints).")
+
+
+if __name__ == "__main__":
+    main()
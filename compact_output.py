@@ -0,0 +1,103 @@
+import argparse
+import json
+from collections.abc import Mapping
+
+from records import plain
+
+
+# 紧凑输出格式：classes / courses / teachers 数组在 tables 中只保存一次，items 中用 {"$ref": 表名, "id": 序号} 引用。
+#   {"format": "compact-constraints", "version": 1, "tables": {"classes": [...], ...}, "items": [...]}
+# expand_document 可以把它还原成原来的数组格式，交给下游排课系统。
+compact_format = "compact-constraints"
+compact_version = 1
+shared_keys = ("classes", "courses", "teachers")
+
+
+def is_reference(value):
+    return isinstance(value, dict) and len(value) == 2 and "$ref" in value and "id" in value
+
+
+class CompactEncoder:
+    def __init__(self):
+        self.tables = {key: [] for key in shared_keys}
+        self.index = {}
+
+    # 输出在 agent.handle_segment 中已经转成普通的 dict / list，按内容去重
+    def reference(self, key, value):
+        value = plain(value)
+        content = json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        ref_id = self.index.get((key, content))
+        if ref_id is None:
+            ref_id = len(self.tables[key])
+            self.tables[key].append(value)
+            self.index[(key, content)] = ref_id
+        return {"$ref": key, "id": ref_id}
+
+    def encode(self, value):
+        if isinstance(value, Mapping):
+            return {key: self.encode_field(key, item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self.encode(item) for item in value]
+        return value
+
+    def encode_field(self, key, value):
+        if key in shared_keys and isinstance(value, (list, tuple)) and value:
+            return self.reference(key, value)
+        return self.encode(value)
+
+    def document(self, items):
+        encoded = [self.encode(item) for item in items]
+        return {
+            "format": compact_format,
+            "version": compact_version,
+            "tables": {key: table for key, table in self.tables.items() if table},
+            "items": encoded
+        }
+
+def compact_items(items):
+    return CompactEncoder().document(items)
+
+def is_compact_document(data):
+    return isinstance(data, dict) and data.get("format") == compact_format
+
+# 还原后的各条记录共用 tables 中的同一个列表对象，只读使用；需要修改时先 copy.deepcopy
+def expand_document(document):
+    if not is_compact_document(document):
+        return document
+    if document.get("version") != compact_version:
+        raise ValueError(f"Unsupported compact output version {document.get('version')}.")
+    tables = document.get("tables", {})
+
+    def expand(value):
+        if is_reference(value):
+            try:
+                return tables[value["$ref"]][value["id"]]
+            except (KeyError, IndexError, TypeError):
+                raise ValueError(f"Dangling reference {value!r} in compact output.")
+        if isinstance(value, dict):
+            return {key: expand(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [expand(item) for item in value]
+        return value
+
+    return [expand(item) for item in document.get("items", [])]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert constraint output between the expanded array format and the compact format.")
+    parser.add_argument("command", choices=["expand", "compact"])
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--indent", type=int, default=4)
+    args = parser.parse_args()
+
+    from output_sink import load_output_array, write_json_atomic
+
+    items = load_output_array(args.input)
+    data = items if args.command == "expand" else compact_items(items)
+    write_json_atomic(args.output, data, indent=args.indent)
+    print(f"Wrote {len(items)} items to {args.output} ({args.command}ed).")
+
+
+if __name__ == "__main__":
+    main()
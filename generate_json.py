@@ -1,14 +1,28 @@
-import json
-import openai
-from openai import OpenAI
-client = OpenAI(api_key = '')
+from llm_cache import LLMCache, make_cache_key
+from llm_transport import chat_json, model_identity
+from metrics import classification_labels, record_cache, traced
+from output_schema import check_classification_json, check_document, check_segment_json, parse_json, record_validation
+from prompt_compiler import PromptCompiler
 
+model_name = "gpt-4o"
+# 每次调用（含重试）的总时限，单位秒
+request_deadline = 120.0
+# 修改 classify_input / generate_json 的 prompt 或 prompt_templates 后需要更新，旧的缓存会随之失效
+prompt_version = "3"
+llm_cache = LLMCache()
+# True：使用 prompt_compiler 生成的紧凑 prompt（固定前缀 + 按相似度挑选的例子）；False：发送原来的整段 prompt
+compile_prompts = True
 
-def classify_input(user_input):
-    classification_prompt = f"""
-    基于用户输入，返回一个JSON对象，包含一个数组，其中包含用户输入的情境类型。可能的情况包含：
 
-    1. 课程课时条件：在一周内某天的的某一课时排某堂课或不排课 例：初一 语文 周一第九节;周二第九节不排 
+# 缓存 key 中的模型部分是实际使用的后端和模型（LLM_BACKEND / LLM_MODEL），prompt 部分包含 prompt 的形式（compile_prompts），
+# 切换后不会命中其他配置下缓存的结果
+def cache_model():
+    return model_identity(model_name)
+
+def cache_prompt_version():
+    return f"{prompt_version}/{'compiled' if compile_prompts else 'full'}"
+
+classification_descriptions = """1. 课程课时条件：在一周内某天的的某一课时排某堂课或不排课 例：初一 语文 周一第九节;周二第九节不排 
     2. 课程各天条件：在一段时间内进行排课限制 例：初一 语文 周一到周五每天最少排一节 
     3. 课程时段条件：在一周内每天的某一课时排某堂课 例：初一 数学 整个周第1节必排一节 
     4. 课程连堂条件：在一周内某天的某一时间段进行连堂 例：初一 语文 周三下午连堂一次 
@@ -22,7 +36,26 @@ def classify_input(user_input):
     12. 教师时段条件: 教师在一周内每天的某一课时的排课限制 例：所有老师 整个周第5节 最多排3节
     13. 教师不排同时上课条件: 某两名教师不排在同一节 例：钟敏 张慧 不排同一节
     14. 教师多班连上条件: 教师连续上课的情况 例：初二数学老师 不同班级的数学课连着上
-    15. 为了照顾刚生完孩子的张老师,周五下午张老师没空
+    15. 为了照顾刚生完孩子的张老师,周五下午张老师没空"""
+
+parameter_descriptions = """grade：年级，包含“初一”到“初三”
+    class：班级，通常以“x班”形式出现，json内需转换为阿拉伯数字表示
+    day：一周内的某一天，json内需转换为阿拉伯数字表示。如果包含多天，如“周一到周三”，需分别包括周一、周二、周三三天:[1,2,3]。一整周为周一到周五，周末不上课。
+    period：一天内的某一节课，json内需转换为阿拉伯数字表示。如包含多天，需一一对应，如“周一、周二第九节”应该包含9, 9两个数字
+    subject：课程名称，如“语文”、“数学”。如包含多个课时，需一一对应
+    teacher：教师名称，一般为人名
+    time_period：某一个时间段，如“上午”、“下午”
+    min_classes: 最少排x节课，“必排”的情况下为1
+    max_classes: 最多排x节课，“不排”的情况下为0
+    记住：需要返回阿拉伯数字的项目，必须为int，不能为string"""
+
+
+# 原始的整段分类 prompt；compile_prompts 为 True 时由 prompt_compiler 拆成固定前缀和输入两部分
+def classify_prompt(user_input):
+    return f"""
+    基于用户输入，返回一个JSON对象，包含一个数组，其中包含用户输入的情境类型。可能的情况包含：
+
+    {classification_descriptions}
 
     当用户同时输入多种情境时，将其分别列出。
     当用户输入的某部分不能归类为以上任意情境时，不将其包含在内。
@@ -56,12 +89,23 @@ def classify_input(user_input):
     User input: "{user_input}"
     """
 
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[{"role": "user", "content": classification_prompt}],
-        response_format={"type": "json_object"},
-    )
-    return response.choices[0].message.content
+# 返回结果先按 check_classification_json 校验，只有合格（或在本地修好）的结果才写入缓存
+@traced("classify_input")
+def classify_input(user_input):
+    cache_key = make_cache_key(cache_model(), cache_prompt_version(), "classify", user_input)
+    cached = llm_cache.get(cache_key)
+    record_cache(cached is not None)
+    if cached is not None:
+        return cached
+
+    if compile_prompts:
+        messages = prompt_compiler.classify_messages(user_input)
+    else:
+        messages = [{"role": "user", "content": classify_prompt(user_input)}]
+    status, text, _ = check_classification_json(chat_json(messages, model_name, deadline=request_deadline))
+    if status != "invalid":
+        llm_cache.set(cache_key, text)
+    return text
 
 prompt_templates = {
     "课程课时条件": """
@@ -72,7 +116,7 @@ prompt_templates = {
                 {{
                     "grade": ["初一"],
                     "day": ["周一", "周二"],
-                    "period": ["9". "9"],
+                    "period": [9, 9],
                     "subject": ["体活", "不排"]
                 }}
             ]
@@ -83,8 +127,8 @@ prompt_templates = {
             "details": [
                 {{
                     "grade": ["初一"],
-                    "day": ["周一", "周二"],
-                    "period": ["5". "6"],
+                    "day": ["周三", "周三"],
+                    "period": [5, 6],
                     "subject": ["英语", "综合实践1","不排"]
                 }}
             ]
@@ -97,7 +141,7 @@ prompt_templates = {
             "details": [
                 {{
                     "grade": ["初一"],
-                    "day": ["周一". "周二", "周三", "周四", "周五"],
+                    "day": ["周一", "周二", "周三", "周四", "周五"],
                     "subject": ["语文"],
                     "max_classes": 1
                 }}
@@ -111,8 +155,8 @@ prompt_templates = {
             "details": [
                 {{
                     "grade": ["初一"],
-                    "day": ["周一","周二", "周三", "周四", "周五"]
-                    "period": ["1"],
+                    "day": ["周一","周二", "周三", "周四", "周五"],
+                    "period": [1, 1, 1, 1, 1],
                     "subject": ["数学"],
                     "min_classes": 1
                 }}
@@ -124,8 +168,8 @@ prompt_templates = {
             "details": [
                 {{
                     "grade": ["初一", "初二"],
-                    "day": ["周五"]
-                    "period": ["1"],
+                    "day": ["周五"],
+                    "period": [1],
                     "subject": ["数学"],
                     "min_classes": 1
                 }}
@@ -137,8 +181,8 @@ prompt_templates = {
             "details": [
                 {{
                     "grade": ["初一"],
-                    "day": ["周五"]
-                    "period": ["1","2","3","4"],
+                    "day": ["周五", "周五", "周五", "周五"],
+                    "period": [1, 2, 3, 4],
                     "subject": ["语文","数学","英语"],
                     "min_classes": 4
                 }}
@@ -204,7 +248,7 @@ prompt_templates = {
             "details": [
                 {{
                     "grade": ["初一","初一"],
-                    "class": ["6", "7"],
+                    "class": [6, 7],
                     "subject": ["体育"],
                     "teacher": ["张佳辉"]
                 }}
@@ -218,7 +262,7 @@ prompt_templates = {
             "details": [
                 {{
                     "grade": ["初一","初一"],
-                    "class": ["1", "3"],
+                    "class": [1, 3],
                     "subject": ["生物", "地理"]
                 }}
             ]
@@ -245,7 +289,7 @@ prompt_templates = {
                     "grade": ["初一"],
                     "teacher": ["语文老师"],
                     "day": ["周一"],
-                    "period": ["6"],
+                    "period": [6],
                     "max_classes": 1
                 }}
             ]
@@ -273,8 +317,8 @@ prompt_templates = {
             "details": [
                 {{
                     "teacher": ["所有老师"],
-                    "day": ["周一". "周二", "周三", "周四", "周五"],
-                    "period": ["5", "5", "5", "5", "5"],
+                    "day": ["周一", "周二", "周三", "周四", "周五"],
+                    "period": [5, 5, 5, 5, 5],
                     "max_classes": 3
                 }}
             ]
@@ -286,7 +330,7 @@ prompt_templates = {
                 {{
                     "teacher": ["张老师"],
                     "day": ["周五"],
-                    "period": ["下午"],
+                    "time_period": ["下午"],
                     "max_classes": 0
                 }}
             ]
@@ -297,8 +341,8 @@ prompt_templates = {
             "details": [
                 {{
                     "teacher": ["钟敏"],
-                    "day": ["周三"],
-                    "period": ["5","6"],
+                    "day": ["周三", "周三"],
+                    "period": [5, 6],
                     "max_classes": 1
                 }}
             ]
@@ -310,7 +354,7 @@ prompt_templates = {
                 {{
                     "teacher": ["所有老师"],
                     "day": ["周四"],
-                    "period": ["8"],
+                    "period": [8],
                     "max_classes": 0
                 }}
             ]
@@ -350,22 +394,16 @@ prompt_templates = {
         }} 
     """
 }
+# 指标标签只使用这些情境名；classify / combined 是 pipeline_llm_json_total 中分类请求和合并请求的结果
+classification_labels.update(prompt_templates)
+classification_labels.update(("classify", "combined"))
 
-def generate_json(user_input,classification):
-    prompt = f"""
+def generate_prompt(user_input, classification):
+    return f"""
     基于用户输入的情况，提炼出其中的信息并且输出到一个JSON物体。
 
     可能包含的参数：
-    grade：年级，包含“初一”到“初三”
-    class：班级，通常以“x班”形式出现，json内需转换为阿拉伯数字表示
-    day：一周内的某一天，json内需转换为阿拉伯数字表示。如果包含多天，如“周一到周三”，需分别包括周一、周二、周三三天:[1,2,3]。一整周为周一到周五，周末不上课。
-    period：一天内的某一节课，json内需转换为阿拉伯数字表示。如包含多天，需一一对应，如“周一、周二第九节”应该包含"9", "9"两个数字
-    subject：课程名称，如“语文”、“数学”。如包含多个课时，需一一对应
-    teacher：教师名称，一般为人名
-    time_period：某一个时间段，如“上午”、“下午”
-    min_classes: 最少排x节课，“必排”的情况下为1
-    max_classes: 最多排x节课，“不排”的情况下为0
-    记住：需要返回阿拉伯数字的项目，必须为int，不能为string
+    {parameter_descriptions}
 
     例：
     {prompt_templates.get(classification,'Unknown classification. Please return an empty JSON object.')}
@@ -376,16 +414,117 @@ def generate_json(user_input,classification):
     JSON输出：
     """
 
+prompt_compiler = PromptCompiler(classification_descriptions, parameter_descriptions, prompt_templates, classify_prompt, model_name)
 
-    response = client.chat.completions.create(
-        model="gpt-4o",  
-        messages=[{"role": "user", "content": prompt}],
-        response_format={"type": "json_object"},
-    )
+# 返回 check_segment_json 的结果 (status, text, errors)；只有合格（或在本地修好）的结果才写入缓存，
+# 缓存中存的是修复后的文本。refresh 为 True 时不读缓存，重新请求并覆盖缓存中的结果
+@traced("generate_json", label=lambda user_input, classification, refresh=False: classification)
+def generate_json(user_input,classification, refresh=False):
+    cache_key = make_cache_key(cache_model(), cache_prompt_version(), "generate", classification, user_input)
+    cached = None if refresh else llm_cache.get(cache_key)
+    record_cache(cached is not None)
+    if cached is not None:
+        return check_segment_json(cached, classification)
+
+    if compile_prompts:
+        messages = prompt_compiler.generate_messages(user_input, classification)
+    else:
+        messages = [{"role": "user", "content": generate_prompt(user_input, classification)}]
+    checked = check_segment_json(chat_json(messages, model_name, deadline=request_deadline), classification)
+    if checked[0] != "invalid":
+        llm_cache.set(cache_key, checked[1])
+    return checked
+
+# generate_json 的结果能在本地修复的直接修复；修复不了时才绕过缓存重新请求一次，
+# 仍然不合格时返回修复到一半的结果，由处理函数报错
+def generate_checked_json(user_input, classification):
+    status, text, errors = generate_json(user_input, classification)
+    if status != "invalid":
+        return text
+    print(f"Extraction for '{user_input}' is invalid ({'; '.join(errors)}), asking again.")
+    status, text, errors = generate_json(user_input, classification, refresh=True)
+    if status == "invalid":
+        print(f"Extraction for '{user_input}' is still invalid: {'; '.join(errors)}")
+    return text
+
+
+# 分类和提取合并为一次请求：不变的说明和全部例子放在 system 消息中作为固定前缀（可被 prompt 前缀缓存复用），
+# 只有最后的用户消息随输入变化
+combined_prompt_prefix = f"""
+    基于用户输入，找出其中包含的所有排课情境，对每个情境提炼出其中的信息，输出到一个JSON对象。
+
+    可能的情境类型包含：
+    {classification_descriptions}
+
+    当用户同时输入多种情境时，将其分别列出。
+    当用户输入的某部分不能归类为以上任意情境时，不将其包含在内。
+
+    可能包含的参数：
+    {parameter_descriptions}
 
+    各情境的例子：
+    {"".join(f"情境：{name}{template}" for name, template in prompt_templates.items())}
+
+    输出格式：
+    {{
+        "results": [
+            {{
+                "segment":"该场景的具体部分",
+                "classification":"该场景的分类",
+                "details": ["按照对应情境例子中 details 的格式"]
+            }}
+        ]
+    }}
+    """
+
+# 返回校验、修复后的 results（见 validate_combined_output），不合格时返回 None；只有合格的返回结果才写入缓存，
+# 不合格的结果不会在之后的调用中被反复读出
+@traced("classify_and_generate")
+def classify_and_generate(user_input):
+    cache_key = make_cache_key(cache_model(), prompt_version, "combined", user_input)
+    cached = llm_cache.get(cache_key)
+    record_cache(cached is not None)
+    if cached is not None:
+        return validate_combined_output(cached)
+
+    content = chat_json(
+        [
+            {"role": "system", "content": combined_prompt_prefix},
+            {"role": "user", "content": f'用户输入："{user_input}"\nJSON输出：'}
+        ],
+        model_name,
+        deadline=request_deadline
+    )
+    results = validate_combined_output(content)
+    if results is not None:
+        llm_cache.set(cache_key, content)
+    return results
 
-    return response.choices[0].message.content
+# 检查 classify_and_generate 的返回结果，各情境的 details 按 output_schema 校验并在本地修复，
+# 格式不正确又修复不了时返回 None
+def validate_combined_output(content):
+    try:
+        scenario, repaired = parse_json(content)
+    except ValueError:
+        record_validation("combined", "invalid")
+        return None
+    results = scenario.get("results") if isinstance(scenario, dict) else None
+    if not isinstance(results, list):
+        record_validation("combined", "invalid")
+        return None
+    checked = []
+    for result in results:
+        classification = result.get("classification") if isinstance(result, dict) else None
+        if classification not in prompt_templates or not isinstance(result.get("segment"), str):
+            record_validation("combined", "invalid")
+            return None
+        status, document, _ = check_document({"classification": classification, "details": result.get("details")}, classification, repaired)
+        record_validation(classification, status)
+        if status == "invalid":
+            return None
+        checked.append(dict(result, details=document["details"]))
+    return checked
 
 #     other：记载额外信息，包含：scenario 2的限制条件，scenario 6最多排课的数量，scenario 10-13对教师的具体排课限制
 # 以上参数在json内均为数组
-# 不一定要包含所有参数。如果某个参数为空，不包含即可。
\ No newline at end of file
+# 不一定要包含所有参数。如果某个参数为空，不包含即可。
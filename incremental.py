@@ -0,0 +1,79 @@
+import hashlib
+import json
+import os
+
+from llm_cache import normalize_input
+from output_sink import write_json_atomic
+from records import json_default
+
+
+manifest_version = 1
+
+
+# roster 的版本：从快照加载或编译快照时记录了源文件的 sha256（roster.derived["sources"]），
+# 否则按内容计算；结果缓存在 roster.derived 中
+def roster_version(roster):
+    version = roster.derived.get("version")
+    if version is None:
+        sources = roster.derived.get("sources")
+        if sources:
+            payload = "\n".join(source["sha256"] for source in sources)
+        else:
+            payload = json.dumps(dict(roster), ensure_ascii=False, sort_keys=True, default=json_default)
+        version = roster.derived["version"] = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    return version
+
+# 分段的 key：规范化后的分段文本 + 影响结果的上下文（roster 版本、提取方式、模型和 prompt 版本）
+def segment_key(segment, context):
+    payload = json.dumps([normalize_input(segment), context], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# 上一次运行中每个分段的分类和输出。本次输入中没有变化的分段直接复用，
+# 只有新的或修改过的分段重新分类、提取；本次没有出现的分段在 save 时被丢弃，对应的输出也随之撤回。
+#   {"version": 1, "entries": {key: {"segment": ..., "results": [{"classification": ..., "output": ...}]}}}
+class RunManifest:
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.current = {}
+        self.reused = 0
+        self.processed = 0
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as file:
+                    data = json.load(file)
+            except (OSError, json.JSONDecodeError) as error:
+                print(f"Ignoring unreadable run manifest {path}: {error}")
+                data = {}
+            if data.get("version") == manifest_version:
+                self.entries = data.get("entries", {})
+
+    def lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.current[key] = entry
+            self.reused += 1
+        return entry
+
+    def record(self, key, segment, results):
+        self.current[key] = {"segment": segment, "results": results}
+        self.processed += 1
+
+    def retracted(self):
+        return [entry for key, entry in self.entries.items() if key not in self.current]
+
+    # 上一次运行写入输出文件的全部输出
+    def previous_outputs(self):
+        return [
+            item["output"]
+            for entry in self.entries.values()
+            for item in entry["results"]
+            if item["output"] is not None
+        ]
+
+    def save(self):
+        write_json_atomic(self.path, {"version": manifest_version, "entries": self.current}, indent=None)
+
+    def stats(self):
+        return {"reused": self.reused, "processed": self.processed, "retracted": len(self.retracted())}
@@ -0,0 +1,252 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+
+def request_key(messages):
+    payload = json.dumps(messages, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def make_response(content, model, usage=None):
+    usage = usage or {}
+    return SimpleNamespace(
+        model=model,
+        choices=[SimpleNamespace(index=0, finish_reason="stop", message=SimpleNamespace(role="assistant", content=content))],
+        usage=SimpleNamespace(
+            prompt_tokens=usage.get("prompt_tokens", 0),
+            completion_tokens=usage.get("completion_tokens", 0),
+            total_tokens=usage.get("total_tokens", 0)
+        )
+    )
+
+def usage_to_dict(usage):
+    if usage is None:
+        return {}
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+        "total_tokens": getattr(usage, "total_tokens", 0) or 0
+    }
+
+
+# OpenAI 官方接口。openai/httpx 只在使用该后端时才导入，离线回放不依赖它们。
+class OpenAIBackend:
+    name = "openai"
+
+    def __init__(self, api_key='', base_url=None, timeout=60.0, connect_timeout=5.0,
+                 max_connections=20, max_keepalive_connections=10, keepalive_expiry=30.0):
+        import httpx
+        import openai
+        self.httpx = httpx
+        self.openai = openai
+        self.connect_timeout = connect_timeout
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.client = openai.OpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=self.http_timeout(timeout),
+            max_retries=0,
+            http_client=httpx.Client(limits=limits, timeout=self.http_timeout(timeout))
+        )
+        self._async_client = None
+        self._async_loop = None
+        self._async_args = (api_key, base_url, limits, timeout)
+
+    def http_timeout(self, timeout):
+        return self.httpx.Timeout(timeout, connect=self.connect_timeout)
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            api_key, base_url, limits, timeout = self._async_args
+            self._async_client = self.openai.AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                timeout=self.http_timeout(timeout),
+                max_retries=0,
+                http_client=self.httpx.AsyncClient(limits=limits, timeout=self.http_timeout(timeout))
+            )
+            self._async_loop = asyncio.get_running_loop()
+        return self._async_client
+
+    def complete(self, messages, model, timeout, **kwargs):
+        return self.client.chat.completions.create(
+            model=model, messages=messages, timeout=self.http_timeout(timeout), **kwargs
+        )
+
+    async def acomplete(self, messages, model, timeout, **kwargs):
+        return await self.async_client.chat.completions.create(
+            model=model, messages=messages, timeout=self.http_timeout(timeout), **kwargs
+        )
+
+    def is_retryable(self, error):
+        openai = self.openai
+        if isinstance(error, (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError)):
+            return True
+        return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+    # 限流（429）：服务本身正常，不计入熔断
+    def is_rate_limited(self, error):
+        return isinstance(error, self.openai.RateLimitError)
+
+    # 异步客户端的连接属于创建它的事件循环，要在该循环中关闭；该循环已经关闭时连接也无法再使用，直接丢弃
+    def close(self):
+        self.client.close()
+        client, loop = self._async_client, self._async_loop
+        self._async_client = self._async_loop = None
+        if client is None or loop.is_closed():
+            return
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(client.close(), loop)
+        else:
+            loop.run_until_complete(client.close())
+
+    async def aclose(self):
+        self.client.close()
+        client = self._async_client
+        self._async_client = self._async_loop = None
+        if client is not None:
+            await client.close()
+
+
+# 兼容 OpenAI 接口的本地服务（vLLM、llama.cpp server、Ollama、llm_stub_server 等）。
+# model 不为空时忽略调用方给出的模型名，统一使用该模型。
+class OpenAICompatibleBackend(OpenAIBackend):
+    name = "openai_compatible"
+
+    def __init__(self, base_url, api_key='local', model=None, **kwargs):
+        super().__init__(api_key=api_key, base_url=base_url, **kwargs)
+        self.model = model
+
+    def complete(self, messages, model, timeout, **kwargs):
+        return super().complete(messages, self.model or model, timeout, **kwargs)
+
+    async def acomplete(self, messages, model, timeout, **kwargs):
+        return await super().acomplete(messages, self.model or model, timeout, **kwargs)
+
+
+class ReplayMissError(KeyError):
+    pass
+
+
+# 回放录制好的请求/响应，结果只由 messages 决定（与模型名无关），可在无网络的环境下运行。
+# 录制文件为 JSON Lines，每行 {"key", "content", "usage", "latency"}。
+# latency 为 None 时不等待；为 "recorded" 时按录制时的耗时等待；为数字时固定等待该秒数。
+class ReplayBackend:
+    name = "replay"
+
+    def __init__(self, path, latency=None, default_content=None):
+        self.path = path
+        self.latency = latency
+        self.default_content = default_content
+        self.recordings = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    line = line.strip()
+                    if line:
+                        record = json.loads(line)
+                        self.recordings[record["key"]] = record
+        except FileNotFoundError:
+            pass
+
+    def lookup(self, messages):
+        record = self.recordings.get(request_key(messages))
+        with self._lock:
+            if record is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if record is None:
+            if self.default_content is None:
+                raise ReplayMissError(f"No recorded response for request {request_key(messages)}.")
+            record = {"content": self.default_content}
+        return record
+
+    def delay(self, record):
+        if self.latency == "recorded":
+            return record.get("latency") or 0.0
+        return self.latency or 0.0
+
+    def complete(self, messages, model, timeout, **kwargs):
+        record = self.lookup(messages)
+        delay = self.delay(record)
+        if delay:
+            time.sleep(delay)
+        return make_response(record["content"], model, record.get("usage"))
+
+    async def acomplete(self, messages, model, timeout, **kwargs):
+        record = self.lookup(messages)
+        delay = self.delay(record)
+        if delay:
+            await asyncio.sleep(delay)
+        return make_response(record["content"], model, record.get("usage"))
+
+    def is_retryable(self, error):
+        return False
+
+    def is_rate_limited(self, error):
+        return False
+
+    def close(self):
+        pass
+
+    async def aclose(self):
+        pass
+
+
+# 包装另一个后端，把每次成功的请求和响应追加到录制文件，供 ReplayBackend 使用
+class RecordingBackend:
+    def __init__(self, backend, path):
+        self.backend = backend
+        self.path = path
+        self.name = f"recording:{backend.name}"
+        self._lock = threading.Lock()
+
+    def record(self, messages, response, latency):
+        record = {
+            "key": request_key(messages),
+            "model": getattr(response, "model", None),
+            "content": response.choices[0].message.content,
+            "usage": usage_to_dict(getattr(response, "usage", None)),
+            "latency": round(latency, 4)
+        }
+        with self._lock, open(self.path, 'a', encoding='utf-8') as file:
+            file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def complete(self, messages, model, timeout, **kwargs):
+        start = time.perf_counter()
+        response = self.backend.complete(messages, model, timeout, **kwargs)
+        self.record(messages, response, time.perf_counter() - start)
+        return response
+
+    async def acomplete(self, messages, model, timeout, **kwargs):
+        start = time.perf_counter()
+        response = await self.backend.acomplete(messages, model, timeout, **kwargs)
+        self.record(messages, response, time.perf_counter() - start)
+        return response
+
+    def is_retryable(self, error):
+        return self.backend.is_retryable(error)
+
+    def is_rate_limited(self, error):
+        return self.backend.is_rate_limited(error)
+
+    def close(self):
+        self.backend.close()
+
+    async def aclose(self):
+        await self.backend.aclose()
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import unicodedata
+
+
+cache_filename = 'llm_cache.sqlite3'
+# 命中时只在内存中记下访问时间，攒够这么多条（或写入新条目、关闭时）再一次写回数据库
+access_flush_size = 256
+
+
+def normalize_input(text):
+    # 全角/半角统一，连续空白压缩成一个空格
+    text = unicodedata.normalize("NFKC", str(text))
+    return " ".join(text.split())
+
+def make_cache_key(model, prompt_version, *inputs):
+    payload = json.dumps(
+        [model, prompt_version] + [normalize_input(item) for item in inputs],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# 以 SQLite 保存 LLM 的返回结果：按 key 命中，过期(ttl 秒)即失效，
+# 条目数超过 max_entries 时按最近访问时间淘汰最旧的条目。
+# 数据库使用 WAL + synchronous=NORMAL；条目数在连接时统计一次，之后随写入/删除增减（多个进程共用同一个文件时只是估计值）
+class LLMCache:
+    def __init__(self, path=cache_filename, ttl=7 * 24 * 3600, max_entries=10000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._conn = None
+        self._lock = threading.Lock()
+        self._count = 0
+        self._accessed = {}
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            self._conn.commit()
+            self._count = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return self._conn
+
+    # 把内存中记下的访问时间写回数据库（不单独提交，由调用方提交）
+    def _flush_accessed(self, conn):
+        if self._accessed:
+            conn.executemany("UPDATE entries SET accessed = ? WHERE key = ?", [(accessed, key) for key, accessed in self._accessed.items()])
+            self._accessed.clear()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value, created = row
+            if self.ttl is not None and now - created > self.ttl:
+                self._count -= conn.execute("DELETE FROM entries WHERE key = ?", (key,)).rowcount
+                self._accessed.pop(key, None)
+                conn.commit()
+                self.misses += 1
+                return None
+            self._accessed[key] = now
+            if len(self._accessed) >= access_flush_size:
+                self._flush_accessed(conn)
+                conn.commit()
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            self._accessed.pop(key, None)
+            inserted = conn.execute(
+                "INSERT OR IGNORE INTO entries (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            ).rowcount
+            if inserted:
+                self._count += 1
+            else:
+                conn.execute("UPDATE entries SET value = ?, created = ?, accessed = ? WHERE key = ?", (value, now, now, key))
+            self._flush_accessed(conn)
+            self._evict(conn)
+            conn.commit()
+
+    def _evict(self, conn):
+        overflow = self._count - self.max_entries
+        if overflow > 0:
+            deleted = conn.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY accessed LIMIT ?)",
+                (overflow,)
+            ).rowcount
+            self._count -= deleted
+            self.evictions += deleted
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM entries")
+            conn.commit()
+            self._count = 0
+            self._accessed.clear()
+
+    def stats(self):
+        with self._lock:
+            self._connect()
+            size = self._count
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": size
+        }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._flush_accessed(self._conn)
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,117 @@
+import argparse
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llm_backends import ReplayBackend, ReplayMissError
+
+
+# 兼容 OpenAI 接口的本地回放服务：POST /v1/chat/completions 返回录制文件中对应请求的响应。
+# 配合 LLM_BACKEND=openai_compatible LLM_BASE_URL=http://127.0.0.1:8765/v1 可以离线地端到端运行 agent.py。
+class StubRequestHandler(BaseHTTPRequestHandler):
+    backend = None
+    request_ids = itertools.count(1)
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/') in ("/v1/models", "/models"):
+            self.send_json(200, {"object": "list", "data": [{"id": "replay", "object": "model", "owned_by": "local"}]})
+        elif self.path == "/healthz":
+            self.send_json(200, {"status": "ok", "recordings": len(self.backend.recordings)})
+        else:
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "not_found"}})
+
+    def do_POST(self):
+        if self.path.rstrip('/') not in ("/v1/chat/completions", "/chat/completions"):
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "not_found"}})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self.send_json(400, {"error": {"message": "Request body is not valid JSON.", "type": "invalid_request_error"}})
+            return
+
+        model = request.get("model", "replay")
+        try:
+            record = self.backend.lookup(request.get("messages", []))
+        except ReplayMissError as error:
+            self.send_json(404, {"error": {"message": str(error), "type": "replay_miss"}})
+            return
+
+        delay = self.backend.delay(record)
+        if delay:
+            time.sleep(delay)
+
+        usage = record.get("usage") or {}
+        self.send_json(200, {
+            "id": f"chatcmpl-replay-{next(self.request_ids)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": record["content"]},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": usage.get("prompt_tokens", 0),
+                "completion_tokens": usage.get("completion_tokens", 0),
+                "total_tokens": usage.get("total_tokens", 0)
+            }
+        })
+
+    def log_message(self, format, *args):
+        pass
+
+
+def create_server(recordings, host="127.0.0.1", port=8765, latency=None, default_content=None):
+    handler = type("BoundStubRequestHandler", (StubRequestHandler,), {
+        "backend": ReplayBackend(recordings, latency=latency, default_content=default_content)
+    })
+    return ThreadingHTTPServer((host, port), handler)
+
+# 在后台线程中启动服务，返回 server，调用 server.shutdown() 停止
+def start_server(recordings, host="127.0.0.1", port=0, latency=None, default_content=None):
+    server = create_server(recordings, host, port, latency, default_content)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def parse_latency(value):
+    return value if value == "recorded" else float(value)
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible replay server for offline runs and benchmarks.")
+    parser.add_argument("--recordings", default="llm_recordings.jsonl")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=parse_latency, default=None,
+                        help="seconds to wait per request, or 'recorded' to replay the recorded latency")
+    parser.add_argument("--default-content", default=None,
+                        help="response for requests that were never recorded (default: HTTP 404)")
+    args = parser.parse_args()
+
+    server = create_server(args.recordings, args.host, args.port, args.latency, args.default_content)
+    print(f"Serving {len(server.RequestHandlerClass.backend.recordings)} recorded responses on "
+          f"http://{args.host}:{server.server_port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+import asyncio
+import atexit
+import os
+import random
+import threading
+import time
+
+from llm_backends import OpenAIBackend, OpenAICompatibleBackend, RecordingBackend, ReplayBackend
+from metrics import record_usage
+
+
+# LLM 后端：'openai'、'openai_compatible'（需要 LLM_BASE_URL）或 'replay'（回放 LLM_REPLAY_FILE 中录制的响应）。
+# 设置 LLM_RECORD_FILE 时，真实后端的响应会被追加录制到该文件。
+backend_name = os.environ.get('LLM_BACKEND', 'openai')
+api_key = os.environ.get('LLM_API_KEY', '')
+base_url = os.environ.get('LLM_BASE_URL')
+backend_model = os.environ.get('LLM_MODEL')
+replay_filename = os.environ.get('LLM_REPLAY_FILE', 'llm_recordings.jsonl')
+record_filename = os.environ.get('LLM_RECORD_FILE')
+
+# 单次调用的总时限（秒）以及建立连接的时限
+request_timeout = 60.0
+connect_timeout = 5.0
+
+# 连接池：所有调用共用一个 HTTP 客户端，保持长连接
+max_connections = 20
+max_keepalive_connections = 10
+keepalive_expiry = 30.0
+
+# 429/5xx/超时/连接错误时的重试：指数退避 + 随机抖动
+max_retries = 4
+retry_base_delay = 0.5
+retry_max_delay = 8.0
+
+# 连续 breaker_failure_threshold 次调用（含重试）最终失败后熔断，breaker_reset_timeout 秒后放行一次试探请求
+breaker_failure_threshold = 5
+breaker_reset_timeout = 30.0
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=breaker_failure_threshold, reset_timeout=breaker_reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def _state(self, now):
+        if self.opened_at is None:
+            return "closed"
+        if now - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            now = time.monotonic()
+            state = self._state(now)
+            if state == "open":
+                return False
+            if state == "half_open":
+                # 只放行一次试探请求，它的结果决定关闭还是重新熔断；没有结果（如被取消）时 reset_timeout 秒后再放行一次
+                self.opened_at = now
+                self.probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+    # 不计入熔断的失败（请求本身的错误、限流）：服务有响应，试探请求按成功处理，其他情况下不改变状态
+    def record_ignored(self):
+        with self._lock:
+            if self.probing:
+                self.failures = 0
+                self.opened_at = None
+                self.probing = False
+
+
+breaker = CircuitBreaker()
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def create_backend(name=None):
+    name = name or backend_name
+    pool_options = {
+        "timeout": request_timeout,
+        "connect_timeout": connect_timeout,
+        "max_connections": max_connections,
+        "max_keepalive_connections": max_keepalive_connections,
+        "keepalive_expiry": keepalive_expiry
+    }
+    if name == 'openai':
+        backend = OpenAIBackend(api_key=api_key, base_url=base_url, **pool_options)
+    elif name == 'openai_compatible':
+        if not base_url:
+            raise ValueError("LLM_BASE_URL must be set for the 'openai_compatible' backend.")
+        backend = OpenAICompatibleBackend(base_url, api_key=api_key or 'local', model=backend_model, **pool_options)
+    elif name == 'replay':
+        return ReplayBackend(replay_filename)
+    else:
+        raise ValueError(f"Unknown LLM backend '{name}'.")
+    if record_filename:
+        backend = RecordingBackend(backend, record_filename)
+    return backend
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_backend()
+        return _backend
+
+def set_backend(backend):
+    global _backend
+    with _backend_lock:
+        previous, _backend = _backend, backend
+    if previous is not None and previous is not backend:
+        previous.close()
+    breaker.record_success()
+
+def close_backend():
+    set_backend(None)
+
+# 在使用过 achat_completion 的事件循环结束前调用，关闭异步连接池
+async def aclose_backend():
+    global _backend
+    with _backend_lock:
+        previous, _backend = _backend, None
+    if previous is not None:
+        await previous.aclose()
+    breaker.record_success()
+
+atexit.register(close_backend)
+
+# 实际响应请求的后端和模型（"openai_compatible:qwen2.5" 这样的形式），用于 LLM 缓存的 key。
+# 还没有创建后端时按配置推算，不为此创建客户端；录制后端按被录制的后端计算
+def model_identity(model):
+    with _backend_lock:
+        backend = _backend
+    if backend is None:
+        return f"{backend_name}:{(backend_model if backend_name == 'openai_compatible' else None) or model}"
+    backend = getattr(backend, "backend", backend)
+    return f"{backend.name}:{getattr(backend, 'model', None) or model}"
+
+
+def retry_delay(attempt, error=None):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    retry_after = headers.get("retry-after") if headers is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), retry_max_delay)
+        except ValueError:
+            pass
+    delay = min(retry_max_delay, retry_base_delay * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def remaining_time(deadline):
+    return None if deadline is None else deadline - time.monotonic()
+
+# 每次调用（不是每次重试）检查一次熔断，熔断半开时放行的试探请求可以正常重试
+def check_breaker():
+    if not breaker.allow():
+        raise CircuitOpenError("LLM circuit breaker is open, refusing to send request.")
+
+def before_attempt(deadline):
+    remaining = remaining_time(deadline)
+    if remaining is not None and remaining <= 0:
+        raise TimeoutError("LLM call deadline exceeded.")
+    return min(remaining, request_timeout) if remaining is not None else request_timeout
+
+# 返回需要等待的秒数，不应再重试时返回 None
+def after_failure(backend, error, attempt, deadline):
+    if not backend.is_retryable(error):
+        return None
+    if attempt >= max_retries:
+        return None
+    delay = retry_delay(attempt, error)
+    remaining = remaining_time(deadline)
+    if remaining is not None and delay >= remaining:
+        return None
+    return delay
+
+# 整个调用（含重试）最终失败时才计一次熔断失败；限流和请求本身的错误（如 400）不说明服务异常，不计入
+def record_call_failure(backend, error):
+    if backend.is_retryable(error) and not backend.is_rate_limited(error):
+        breaker.record_failure()
+    else:
+        breaker.record_ignored()
+
+
+# deadline 为整个调用（含重试）的时限，单位秒
+def chat_completion(messages, model, deadline=None, **kwargs):
+    backend = get_backend()
+    deadline = time.monotonic() + deadline if deadline is not None else None
+    check_breaker()
+    attempt = 0
+    while True:
+        try:
+            timeout = before_attempt(deadline)
+            response = backend.complete(messages, model, timeout, **kwargs)
+        except Exception as error:
+            delay = after_failure(backend, error, attempt, deadline)
+            if delay is None:
+                record_call_failure(backend, error)
+                raise
+            print(f"LLM call failed ({type(error).__name__}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+            continue
+        breaker.record_success()
+        record_usage(getattr(response, "usage", None))
+        return response
+
+async def achat_completion(messages, model, deadline=None, **kwargs):
+    backend = get_backend()
+    deadline = time.monotonic() + deadline if deadline is not None else None
+    check_breaker()
+    attempt = 0
+    while True:
+        try:
+            timeout = before_attempt(deadline)
+            response = await backend.acomplete(messages, model, timeout, **kwargs)
+        except Exception as error:
+            delay = after_failure(backend, error, attempt, deadline)
+            if delay is None:
+                record_call_failure(backend, error)
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        breaker.record_success()
+        record_usage(getattr(response, "usage", None))
+        return response
+
+def chat_json(messages, model, deadline=None):
+    response = chat_completion(messages, model, deadline=deadline, response_format={"type": "json_object"})
+    return response.choices[0].message.content
+
+async def achat_json(messages, model, deadline=None):
+    response = await achat_completion(messages, model, deadline=deadline, response_format={"type": "json_object"})
+    return response.choices[0].message.content
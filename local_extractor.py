@@ -0,0 +1,143 @@
+import re
+from collections import deque
+
+from metrics import traced
+
+
+# Aho–Corasick 自动机：一次扫描找出文本中所有词典词的出现位置
+class VocabularyMatcher:
+    def __init__(self, vocabulary):
+        # vocabulary: {词: 类别}
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for word, kind in vocabulary.items():
+            if word:
+                self._add(word, kind)
+        self._build_failure_links()
+
+    def _add(self, word, kind):
+        state = 0
+        for char in word:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = next_state
+        self.output[state].append((word, kind))
+
+    def _build_failure_links(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                if self.fail[next_state] == next_state:
+                    self.fail[next_state] = 0
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def find_all(self, text):
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for word, kind in self.output[state]:
+                yield end - len(word), end, word, kind
+
+    # 从左到右取不重叠的匹配，位置相同时取最长的词
+    def longest_matches(self, text):
+        matches = sorted(self.find_all(text), key=lambda match: (match[0], -(match[1] - match[0])))
+        selected = []
+        last_end = 0
+        for start, end, word, kind in matches:
+            if start >= last_end:
+                selected.append((start, end, word, kind))
+                last_end = end
+        return selected
+
+
+def build_vocabulary(roster):
+    vocabulary = {}
+    for teacher_name in roster.teachers_by_name:
+        vocabulary[teacher_name] = "teacher"
+    for subject in roster["course_info"]:
+        vocabulary[subject] = "subject"
+    for grade_name in roster.classes_by_grade:
+        vocabulary[grade_name] = "grade"
+    return vocabulary
+
+def get_matcher(roster):
+    matcher = roster.derived.get("vocabulary_matcher")
+    if matcher is None:
+        matcher = VocabularyMatcher(build_vocabulary(roster))
+        roster.derived["vocabulary_matcher"] = matcher
+    return matcher
+
+
+chinese_numbers = {"一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9, "十": 10}
+max_classes_pattern = re.compile(r"最多\s*([0-9]+|[一二两三四五六七八九十])\s*个?班")
+even_week_pattern = r"\s*[(（]\s*双"
+
+
+def tokenize(segment, roster):
+    found = {"grade": [], "subject": [], "teacher": []}
+    for _, _, word, kind in get_matcher(roster).longest_matches(segment):
+        if word not in found[kind]:
+            found[kind].append(word)
+    return found
+
+def parse_number(text):
+    return int(text) if text.isdigit() else chinese_numbers.get(text)
+
+def extract_course_not_same_day(segment, found):
+    if not found["grade"] or len(found["subject"]) != 2:
+        return None
+    return {"grade": found["grade"], "subject": found["subject"]}
+
+def extract_course_max_same_time(segment, found):
+    match = max_classes_pattern.search(segment)
+    if not found["grade"] or not found["subject"] or not match:
+        return None
+    return {"grade": found["grade"], "subject": found["subject"], "max_classes": parse_number(match.group(1))}
+
+def extract_teacher_mutex(segment, found):
+    if len(found["teacher"]) != 2:
+        return None
+    return {"teacher": found["teacher"]}
+
+def extract_even_odd(segment, found):
+    if not found["grade"] or len(found["subject"]) != 2:
+        return None
+    subjects = list(found["subject"])
+    # 单周的课程放在前面
+    if re.search(re.escape(subjects[0]) + even_week_pattern, segment):
+        subjects.reverse()
+    return {"grade": found["grade"], "subject": subjects}
+
+
+local_extractors = {
+    "课程不排同一天条件": extract_course_not_same_day,
+    "课程同一节课最多条件": extract_course_max_same_time,
+    "教师不排同时上课条件": extract_teacher_mutex,
+    "课程单双周条件": extract_even_odd,
+}
+
+
+# 返回与 generate_json 解析后相同结构的 dict；无法确定时返回 None，由调用方交给 LLM
+@traced("extract_locally", label=lambda segment, classification, roster=None: classification)
+def extract_locally(segment, classification, roster):
+    extractor = local_extractors.get(classification)
+    if extractor is None or roster is None:
+        return None
+    detail = extractor(segment, tokenize(segment, roster))
+    if detail is None:
+        return None
+    return {"classification": classification, "details": [detail]}
@@ -0,0 +1,303 @@
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llm_backends import usage_to_dict
+
+
+# 设置后每个 span 结束时以 OTLP JSON（与 OpenTelemetry Collector 的 otlpjsonfile 接收器格式相同）追加一行
+span_log_path = os.environ.get("PIPELINE_SPAN_LOG")
+service_name = "scheduling-assistant"
+duration_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+size_buckets = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+metric_help = {
+    "pipeline_stage_duration_seconds": ("histogram", "Wall time of each pipeline stage."),
+    "pipeline_stage_errors_total": ("counter", "Pipeline stages that raised an exception."),
+    "pipeline_payload_bytes": ("histogram", "Size of the text going into and out of each stage."),
+    "pipeline_llm_tokens_total": ("counter", "Tokens reported in the LLM response usage."),
+    "pipeline_llm_cache_requests_total": ("counter", "LLM response cache lookups by result."),
+    "pipeline_llm_json_total": ("counter", "LLM extraction responses by validation result (valid, repaired locally, invalid)."),
+    "pipeline_roster_requests_total": ("counter", "Project roster lookups in the registry by result."),
+    "pipeline_roster_evictions_total": ("counter", "Project rosters evicted from the registry to stay under the memory limit."),
+    "pipeline_roster_resident_bytes": ("gauge", "Estimated memory held by the project rosters currently loaded."),
+    "pipeline_roster_resident_count": ("gauge", "Project rosters currently loaded."),
+}
+
+# 可以作为 classification 标签取值的情境名（generate_json 按 prompt_templates 登记）。
+# 情境名来自 LLM 的返回结果，其他取值一律记为 "unknown"，避免标签基数无限增长
+classification_labels = set()
+
+
+def classification_label(classification):
+    if classification == "":
+        return ""
+    if isinstance(classification, str) and classification in classification_labels:
+        return classification
+    return "unknown"
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in pairs) + "}"
+
+def format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.gauges[key] = value
+
+    def observe(self, name, labels, value, buckets=duration_buckets):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    # Prometheus 文本格式（text/plain; version=0.0.4）
+    def render(self):
+        with self._lock:
+            counters = dict(self.counters)
+            counters.update(self.gauges)
+            histograms = {key: (histogram.buckets, list(histogram.counts), histogram.sum, histogram.count)
+                          for key, histogram in self.histograms.items()}
+        lines = []
+        for name, (metric_type, description) in metric_help.items():
+            series = sorted((key for key in counters if key[0] == name), key=lambda key: key[1])
+            series += sorted((key for key in histograms if key[0] == name), key=lambda key: key[1])
+            if not series:
+                continue
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for key in series:
+                labels = key[1]
+                if key in counters:
+                    lines.append(f"{name}{format_labels(labels)} {format_number(counters[key])}")
+                    continue
+                buckets, counts, total, count = histograms[key]
+                for bound, bucket_count in zip(buckets, counts):
+                    lines.append(f"{name}_bucket{format_labels(labels, [('le', format_number(bound))])} {bucket_count}")
+                lines.append(f"{name}_bucket{format_labels(labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{name}_sum{format_labels(labels)} {format_number(total)}")
+                lines.append(f"{name}_count{format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    # 按阶段汇总，供 /healthz 或批处理的统计使用
+    def summary(self):
+        with self._lock:
+            stages = {}
+            for (name, labels), histogram in self.histograms.items():
+                if name != "pipeline_stage_duration_seconds":
+                    continue
+                stage = stages.setdefault(dict(labels)["stage"], {"calls": 0, "total_s": 0.0})
+                stage["calls"] += histogram.count
+                stage["total_s"] = round(stage["total_s"] + histogram.sum, 6)
+            tokens = {}
+            cache = {}
+            llm_json = {}
+            for (name, labels), value in self.counters.items():
+                labels = dict(labels)
+                if name == "pipeline_llm_tokens_total":
+                    tokens[labels["type"]] = tokens.get(labels["type"], 0) + value
+                elif name == "pipeline_llm_cache_requests_total":
+                    cache[labels["result"]] = cache.get(labels["result"], 0) + value
+                elif name == "pipeline_llm_json_total":
+                    llm_json[labels["result"]] = llm_json.get(labels["result"], 0) + value
+        return {"stages": stages, "llm_tokens": tokens, "llm_cache": cache, "llm_json": llm_json}
+
+registry = MetricsRegistry()
+
+
+current_span = contextvars.ContextVar("current_span", default=None)
+_span_log_lock = threading.Lock()
+
+class Span:
+    def __init__(self, name, attributes, parent):
+        self.name = name
+        self.attributes = dict(attributes)
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent is not None else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def add(self, key, amount):
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    # 指标只按阶段和情境分类打标签，其他属性只写入 span 日志，避免标签基数过大
+    def labels(self):
+        return {"stage": self.name, "classification": classification_label(self.attributes.get("classification", ""))}
+
+def otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def otlp_span(span):
+    record = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": 1,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [{"key": key, "value": otlp_value(value)} for key, value in span.attributes.items()],
+        "status": {"code": 2, "message": f"{type(span.error).__name__}: {span.error}"} if span.error is not None else {"code": 1}
+    }
+    if span.parent is not None:
+        record["parentSpanId"] = span.parent.span_id
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+            "scopeSpans": [{"scope": {"name": "pipeline"}, "spans": [record]}]
+        }]
+    }
+
+def export_span(span):
+    if not span_log_path:
+        return
+    line = json.dumps(otlp_span(span), ensure_ascii=False) + "\n"
+    with _span_log_lock, open(span_log_path, 'a', encoding='utf-8') as file:
+        file.write(line)
+
+# with span("generate_json", classification=...) as s: ... 记录耗时、异常，并写入 span 日志。
+# 不要让 span 跨越生成器的 yield，否则 current_span 会泄漏到调用方。
+@contextlib.contextmanager
+def span(name, **attributes):
+    current = Span(name, attributes, current_span.get())
+    token = current_span.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException as error:
+        current.error = error
+        raise
+    finally:
+        current_span.reset(token)
+        current.end_ns = time.time_ns()
+        labels = current.labels()
+        registry.observe("pipeline_stage_duration_seconds", labels, time.perf_counter() - start)
+        if current.error is not None:
+            registry.inc("pipeline_stage_errors_total", labels)
+        export_span(current)
+
+# 装饰器版本：第一个参数和返回值是字符串时记录其大小，label 从参数中取出情境名
+def traced(name, label=None):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            attributes = {"classification": label(*args, **kwargs)} if label else {}
+            with span(name, **attributes):
+                if args and isinstance(args[0], str):
+                    record_payload("in", args[0])
+                result = function(*args, **kwargs)
+                if isinstance(result, str):
+                    record_payload("out", result)
+                return result
+        return wrapper
+    return decorator
+
+def record_payload(direction, text):
+    current = current_span.get()
+    if current is None or text is None:
+        return
+    size = len(text.encode('utf-8')) if isinstance(text, str) else len(text)
+    current.add(f"payload.{direction}_bytes", size)
+    registry.observe("pipeline_payload_bytes", dict(current.labels(), direction=direction), size, size_buckets)
+
+def record_cache(hit):
+    current = current_span.get()
+    if current is None:
+        return
+    current.set("llm.cache_hit", hit)
+    registry.inc("pipeline_llm_cache_requests_total", dict(current.labels(), result="hit" if hit else "miss"))
+
+def record_usage(usage):
+    current = current_span.get()
+    if current is None:
+        return
+    usage = usage_to_dict(usage)
+    for kind in ("prompt", "completion"):
+        tokens = usage.get(f"{kind}_tokens", 0)
+        current.add(f"llm.{kind}_tokens", tokens)
+        if tokens:
+            registry.inc("pipeline_llm_tokens_total", dict(current.labels(), type=kind), tokens)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+# 没有 HTTP 服务的进程（如 batch.py）在后台线程中单独提供 /metrics，返回 server，调用 server.shutdown() 停止
+def start_metrics_server(host="127.0.0.1", port=9464):
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,286 @@
+import json
+import sys
+
+
+# 一周 7 天 × 每天 12 节，第 d 天第 p 节对应第 (d-1)*periods_per_day + (p-1) 位；dayOfWeek / period 为 -1 表示所有天 / 所有节
+days_per_week = 7
+periods_per_day = 12
+day_names = "一二三四五六日"
+# 这些输出类型中具体到某天某节的 MUST_ASSIGN 是固定排课；其他类型的 periodDays 是课时数的范围
+fixed_types = ("COURSETIME", "COURSEPERIODLIMIT", "TEACHERTIME")
+# COURSEDAYLIMIT 的每个 periodDays 各自是一个范围（每天最少/最多几节），教师的限制是整个 periodDays 合起来的范围
+per_entry_range_types = ("COURSEDAYLIMIT",)
+range_types = ("COURSEDAYLIMIT", "TEACHERDAYLIMIT", "TEACHERPERIODLIMIT")
+# 课程名为“不排”的 MUST_AVOID 表示这个时间班级不排任何课
+blocked_course = "不排"
+
+day_masks = [0] * (days_per_week + 1)
+period_masks = [0] * (periods_per_day + 1)
+for _day in range(1, days_per_week + 1):
+    for _period in range(1, periods_per_day + 1):
+        _bit = 1 << ((_day - 1) * periods_per_day + _period - 1)
+        day_masks[_day] |= _bit
+        period_masks[_period] |= _bit
+week_mask = (1 << (days_per_week * periods_per_day)) - 1
+
+
+def slot_mask(day, period):
+    try:
+        day, period = int(day), int(period)
+    except (TypeError, ValueError):
+        return 0
+    days = week_mask if day == -1 else day_masks[day] if 1 <= day <= days_per_week else 0
+    periods = week_mask if period == -1 else period_masks[period] if 1 <= period <= periods_per_day else 0
+    return days & periods
+
+def period_days_mask(period_days):
+    mask = 0
+    for period_day in period_days or ():
+        mask |= slot_mask(period_day.get("dayOfWeek"), period_day.get("period"))
+    return mask
+
+def is_single_slot(period_day):
+    return period_day.get("dayOfWeek") != -1 and period_day.get("period") != -1
+
+def mask_slots(mask):
+    slots = []
+    while mask:
+        low = mask & -mask
+        bit = low.bit_length() - 1
+        slots.append({"dayOfWeek": bit // periods_per_day + 1, "period": bit % periods_per_day + 1})
+        mask ^= low
+    return slots
+
+def describe_slots(mask):
+    return "、".join(f"周{day_names[slot['dayOfWeek'] - 1]}第{slot['period']}节" for slot in mask_slots(mask))
+
+
+# 一个班级或教师的占用情况。course 为 None 的条目对整个班级/教师生效
+class Resource:
+    __slots__ = ("name", "assigned", "assigned_by", "avoided", "ranges", "entries")
+
+    def __init__(self, name):
+        self.name = name
+        self.assigned = 0
+        self.assigned_by = {}
+        self.avoided = {}
+        self.ranges = []
+        self.entries = []
+
+    def avoided_for(self, course):
+        mask = self.avoided.get(None, 0)
+        if course is not None:
+            mask |= self.avoided.get(course, 0)
+        return mask
+
+    def assigned_for(self, course):
+        return self.assigned if course is None else self.assigned_by.get(course, 0)
+
+    # 找出与 mask 重叠的最早一条约束的来源，用于冲突提示
+    def source_of(self, kinds, mask, courses=None):
+        for kind, course, entry_mask, source in self.entries:
+            if kind in kinds and entry_mask & mask and (courses is None or course in courses):
+                return source
+        return None
+
+
+# 把生成的约束逐条折叠进每个班级、教师的 day×period 位图，加入时立即返回与已有约束矛盾的地方。
+#   model = OccupancyModel()
+#   for conflict in model.add_output(output, source=segment): print(format_conflict(conflict))
+class OccupancyModel:
+    def __init__(self):
+        self.resources = {}
+        self.course_names = {}
+        self.constraints = 0
+
+    def resource(self, kind, uid, name):
+        key = (kind, uid)
+        resource = self.resources.get(key)
+        if resource is None:
+            resource = self.resources[key] = Resource(name)
+        return resource
+
+    def add_outputs(self, outputs, source=None):
+        conflicts = []
+        for index, output in enumerate(outputs):
+            conflicts.extend(self.add_output(output, source if source is not None else f"#{index}"))
+        return conflicts
+
+    def add_output(self, output, source=None):
+        if not isinstance(output, dict):
+            return []
+        output_type = output.get("type")
+        if output_type not in fixed_types and output_type not in range_types:
+            return []
+        constraints = output.get("constraintJsons")
+        if constraints is None:
+            constraints = output.get("constraintJson")
+        if isinstance(constraints, dict):
+            constraints = [constraints]
+        conflicts = []
+        for constraint in constraints or ():
+            conflicts.extend(self.add_constraint(output_type, constraint, source))
+        return conflicts
+
+    def add_constraint(self, output_type, constraint, source=None):
+        self.constraints += 1
+        targets = []
+        for clazz in constraint.get("classes") or ():
+            resource = self.resource("class", clazz.get("uid"), clazz.get("name"))
+            for course in constraint.get("courses") or ():
+                name = course.get("name")
+                if constraint.get("constraintType") == "MUST_AVOID" and name == blocked_course:
+                    targets.append((resource, None))
+                    continue
+                key = course.get("uid") or name
+                self.course_names[key] = name
+                targets.append((resource, key))
+        for teacher in constraint.get("teachers") or ():
+            targets.append((self.resource("teacher", teacher.get("uid"), teacher.get("name")), None))
+
+        period_days = constraint.get("periodDays") or []
+        constraint_type = constraint.get("constraintType")
+        conflicts = []
+        for resource, course in targets:
+            if constraint_type == "MUST_AVOID":
+                conflicts.extend(self.avoid(resource, course, period_days_mask(period_days), source))
+            elif output_type in fixed_types and constraint_type == "MUST_ASSIGN":
+                fixed = period_days_mask([period_day for period_day in period_days if is_single_slot(period_day)])
+                conflicts.extend(self.assign(resource, course, fixed, source))
+                # 整周某一节之类的通配时间：至少要有一节可排
+                for period_day in period_days:
+                    if not is_single_slot(period_day):
+                        conflicts.extend(self.limit(resource, course, slot_mask(period_day["dayOfWeek"], period_day["period"]), 1, -1, source))
+            elif output_type in range_types:
+                minimum = int(constraint.get("limits", -1))
+                maximum = int(constraint.get("maxlimits", -1))
+                groups = [[period_day] for period_day in period_days] if output_type in per_entry_range_types else [period_days]
+                for group in groups:
+                    conflicts.extend(self.limit(resource, course, period_days_mask(group), minimum, maximum, source))
+        return conflicts
+
+    def label(self, resource, course):
+        return resource.name if course is None else f"{resource.name} {self.course_names.get(course, course)}"
+
+    def conflict(self, kind, resource, course, mask, source, previous, message):
+        return {
+            "kind": kind,
+            "resource": resource.name,
+            "course": self.course_names.get(course, course),
+            "slots": mask_slots(mask),
+            "source": source,
+            "previous": previous,
+            "message": message
+        }
+
+    def assign(self, resource, course, mask, source):
+        if not mask:
+            return []
+        conflicts = []
+        label = self.label(resource, course)
+
+        overlap = mask & resource.avoided_for(course)
+        if overlap:
+            previous = resource.source_of(("avoid",), overlap, (None, course))
+            conflicts.append(self.conflict("assign_avoid", resource, course, overlap, source, previous,
+                                           f"{label}: {describe_slots(overlap)} is both 必排 and 不排."))
+
+        if course is not None:
+            overlap = mask & resource.assigned & ~resource.assigned_by.get(course, 0)
+            if overlap:
+                previous = resource.source_of(("assign",), overlap)
+                conflicts.append(self.conflict("double_booked", resource, course, overlap, source, previous,
+                                               f"{resource.name}: {describe_slots(overlap)} is already 必排 for another course."))
+
+        resource.assigned |= mask
+        if course is not None:
+            resource.assigned_by[course] = resource.assigned_by.get(course, 0) | mask
+        resource.entries.append(("assign", course, mask, source))
+        conflicts.extend(self.check_ranges(resource, course, mask, source))
+        return conflicts
+
+    def avoid(self, resource, course, mask, source):
+        if not mask:
+            return []
+        conflicts = []
+        overlap = mask & resource.assigned_for(course)
+        if overlap:
+            label = self.label(resource, course)
+            previous = resource.source_of(("assign",), overlap, None if course is None else (course,))
+            conflicts.append(self.conflict("assign_avoid", resource, course, overlap, source, previous,
+                                           f"{label}: {describe_slots(overlap)} is both 必排 and 不排."))
+
+        resource.avoided[course] = resource.avoided.get(course, 0) | mask
+        resource.entries.append(("avoid", course, mask, source))
+        conflicts.extend(self.check_ranges(resource, course, mask, source))
+        return conflicts
+
+    def limit(self, resource, course, mask, minimum, maximum, source):
+        if not mask:
+            return []
+        if 0 <= maximum < minimum:
+            return [self.conflict("range_invalid", resource, course, mask, source, None,
+                                  f"{self.label(resource, course)}: minimum {minimum} is greater than maximum {maximum}.")]
+        entry = (course, mask, minimum, maximum, source)
+        resource.ranges.append(entry)
+        resource.entries.append(("limit", course, mask, source))
+        conflict = self.check_range(resource, entry, source, None)
+        return [conflict] if conflict else []
+
+    # 新的固定排课或不排只影响同一课程（或整个班级/教师）的、与它重叠的范围
+    def check_ranges(self, resource, course, mask, source):
+        conflicts = []
+        for entry in resource.ranges:
+            if entry[1] & mask and (course is None or entry[0] is None or entry[0] == course):
+                conflict = self.check_range(resource, entry, source, entry[4])
+                if conflict:
+                    conflicts.append(conflict)
+        return conflicts
+
+    # previous 为 None 时检查的是刚加入的范围，矛盾的来源从已有的不排 / 必排中找
+    def check_range(self, resource, entry, source, previous):
+        course, mask, minimum, maximum, _ = entry
+        label = self.label(resource, course)
+        if minimum > 0:
+            free = mask & ~resource.avoided_for(course)
+            if free.bit_count() < minimum:
+                return self.conflict("range_unsatisfiable", resource, course, mask & ~free, source,
+                                     previous or resource.source_of(("avoid",), mask),
+                                     f"{label}: needs at least {minimum} in {describe_slots(mask)} but only {free.bit_count()} slot(s) are not 不排.")
+        if maximum >= 0:
+            taken = mask & resource.assigned_for(course)
+            if taken.bit_count() > maximum:
+                return self.conflict("range_exceeded", resource, course, taken, source,
+                                     previous or resource.source_of(("assign",), mask),
+                                     f"{label}: at most {maximum} in {describe_slots(mask)} but {taken.bit_count()} are 必排.")
+        return None
+
+    def stats(self):
+        return {
+            "constraints": self.constraints,
+            "classes": sum(1 for kind, _ in self.resources if kind == "class"),
+            "teachers": sum(1 for kind, _ in self.resources if kind == "teacher")
+        }
+
+
+def format_conflict(conflict):
+    source = f" (input: {conflict['source']})" if conflict.get("source") else ""
+    previous = f" Conflicts with: {conflict['previous']}" if conflict.get("previous") else ""
+    return f"Constraint conflict{source}: {conflict['message']}{previous}"
+
+
+# python occupancy.py output_data.json：检查已有输出文件中的约束是否互相矛盾
+def main():
+    from output_sink import load_output_array
+
+    path = sys.argv[1] if len(sys.argv) > 1 else "output_data.json"
+    model = OccupancyModel()
+    conflicts = model.add_outputs(load_output_array(path))
+    for conflict in conflicts:
+        print(format_conflict(conflict))
+    print(json.dumps(dict(model.stats(), conflicts=len(conflicts)), ensure_ascii=False))
+    sys.exit(1 if conflicts else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+import json
+import re
+import sys
+
+from metrics import classification_label, registry as metrics_registry
+
+
+# details 中各字段的类型：
+#   names  字符串数组（年级、课程、教师）
+#   days   星期数组，元素为 "周一" 等名称或 1-7，由 agent.preprocess_input 统一转换成数字
+#   ints   整数数组（节次、班级）
+#   times  时间段数组（"上午"、"下午" 等），由 agent.preprocess_input 转换成节次
+#   count  单个整数（max_classes / min_classes）
+field_kinds = {
+    "grade": "names",
+    "subject": "names",
+    "teacher": "names",
+    "class": "ints",
+    "day": "days",
+    "period": "ints",
+    "time_period": "times",
+    "max_classes": "count",
+    "min_classes": "count",
+}
+
+# 与 agent.get_day_of_week / agent.get_period_of_time 能识别的写法一致
+day_numbers = {
+    "周一": 1, "星期一": 1, "一": 1,
+    "周二": 2, "星期二": 2, "二": 2,
+    "周三": 3, "星期三": 3, "三": 3,
+    "周四": 4, "星期四": 4, "四": 4,
+    "周五": 5, "星期五": 5, "五": 5,
+    "周六": 6, "星期六": 6, "六": 6,
+    "周日": 7, "星期日": 7, "日": 7, "天": 7
+}
+whole_week = ("整周", "整个周", "一整周", "每天", "全周")
+time_words = ("上午", "早上", "下午", "晚上", "全天", "整天", "一整天")
+chinese_numbers = {"一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9, "十": 10, "十一": 11, "十二": 12}
+
+# 每种情境 details 必须有的字段（元组表示几个字段有一个即可）和可能有的字段；
+# aligned 是处理函数中按位置一一对应（zip）的字段，只有一个元素的按对应字段的长度重复，
+# broadcast 中的字段只在只有一个元素时按 aligned 的长度重复，其他长度保持原样；
+# defaults 是缺少时修复可以补上的值（没有写星期的 "第1节必排" 指一整周，即周一到周五）
+schema_specs = {
+    "课程课时条件": {"required": ("grade", "subject", "day", "period"), "aligned": ("day", "period"), "broadcast": ("subject",)},
+    "课程各天条件": {"required": ("grade", "subject", "day"), "optional": ("max_classes", "min_classes")},
+    "课程时段条件": {"required": ("grade", "subject", "period", "day"), "optional": ("max_classes", "min_classes"), "aligned": ("period", "day"), "defaults": {"day": [1, 2, 3, 4, 5]}},
+    "课程连堂条件": {"required": ("grade", "subject", ("period", "time_period")), "optional": ("day",)},
+    "课程不排同一天条件": {"required": ("grade", "subject")},
+    "课程同一节课最多条件": {"required": ("grade", "subject", "max_classes")},
+    "课程合班条件": {"required": ("grade", "class", "subject", "teacher")},
+    "课程走班关联条件": {"required": ("grade", "class", "subject"), "aligned": ("grade", "class", "subject")},
+    "课程单双周条件": {"required": ("grade", "subject")},
+    "教师课时条件": {"required": ("grade", "teacher", "day", "period"), "optional": ("max_classes", "min_classes")},
+    "教师各天条件": {"required": ("grade", "teacher", "day", ("period", "time_period"), "min_classes")},
+    "教师时段条件": {"required": ("teacher", ("period", "time_period"), "max_classes"), "optional": ("grade", "day"), "aligned": ("day", "period")},
+    "教师不排同时上课条件": {"required": ("teacher",)},
+    "教师多班连上条件": {"required": ("teacher",), "optional": ("grade",)},
+}
+
+
+def is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def is_day(value):
+    return 1 <= value <= 7 if is_int(value) else isinstance(value, str) and value in day_numbers
+
+def check_list(value, element):
+    return isinstance(value, list) and bool(value) and all(element(item) for item in value)
+
+# 校验只判断类型，不复制、不修改
+kind_checks = {
+    "names": lambda value: check_list(value, lambda item: isinstance(item, str) and bool(item)),
+    "days": lambda value: check_list(value, is_day),
+    "ints": lambda value: check_list(value, is_int),
+    "times": lambda value: check_list(value, lambda item: item in time_words),
+    "count": lambda value: is_int(value) and value >= 0,
+}
+
+
+def as_list(value):
+    if isinstance(value, list):
+        return value
+    if isinstance(value, tuple):
+        return list(value)
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [item for item in re.split(r"[、，,；;]+", value) if item.strip()]
+    return [value]
+
+# "9"、"09"、"第9节"、"九" 之类的写法转换为整数
+def parse_int(value):
+    if is_int(value):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    text = str(value).strip()
+    match = re.fullmatch(r"\D*?(\d+)\D*", text)
+    if match:
+        return int(match.group(1))
+    text = text.removeprefix("第").removesuffix("节").removesuffix("班").removesuffix("个")
+    if text in chinese_numbers:
+        return chinese_numbers[text]
+    raise ValueError(f"'{value}' is not a number")
+
+def repair_names(value):
+    names = [str(item).strip() for item in as_list(value) if item is not None and str(item).strip()]
+    if not names:
+        raise ValueError("empty")
+    return names
+
+def repair_ints(value):
+    numbers = [parse_int(item) for item in as_list(value)]
+    if not numbers:
+        raise ValueError("empty")
+    return numbers
+
+# 星期保持原来的写法（名称或数字），只把数字字符串转成整数，并展开 "周一到周五"、"整个周" 这样的范围
+def repair_days(value):
+    days = []
+    for item in as_list(value):
+        if is_day(item):
+            days.append(item)
+            continue
+        text = str(item).strip()
+        if text in day_numbers:
+            days.append(text)
+        elif text in whole_week:
+            days.extend(range(1, 6))
+        elif text.isdigit() and 1 <= int(text) <= 7:
+            days.append(int(text))
+        else:
+            match = re.fullmatch(r"(.+?)\s*(?:到|至|-|~|—)\s*(.+)", text)
+            first, last = (day_numbers.get(part) for part in match.groups()) if match else (None, None)
+            if first is None or last is None or first > last:
+                raise ValueError(f"'{item}' is not a day")
+            days.extend(range(first, last + 1))
+    if not days:
+        raise ValueError("empty")
+    return days
+
+def repair_times(value):
+    times = [str(item).strip() for item in as_list(value)]
+    if not times:
+        raise ValueError("empty")
+    for item in times:
+        if item not in time_words:
+            raise ValueError(f"'{item}' is not a time of day")
+    return times
+
+def repair_count(value):
+    if isinstance(value, list) and len(value) == 1:
+        value = value[0]
+    count = parse_int(value)
+    if count < 0:
+        raise ValueError(f"'{value}' is negative")
+    return count
+
+kind_repairs = {
+    "names": repair_names,
+    "days": repair_days,
+    "ints": repair_ints,
+    "times": repair_times,
+    "count": repair_count,
+}
+
+
+# 一种情境的 details 的校验和修复，在模块加载时按 schema_specs 编译好：每个字段的校验、修复函数都已经取出来
+class Schema:
+    def __init__(self, classification, required=(), optional=(), aligned=(), broadcast=(), defaults=None):
+        self.classification = classification
+        self.required = tuple(group if isinstance(group, tuple) else (group,) for group in required)
+        names = [field for group in self.required for field in group] + list(optional)
+        self.fields = tuple((field, kind_checks[field_kinds[field]], kind_repairs[field_kinds[field]]) for field in names)
+        self.aligned = tuple(aligned)
+        self.broadcast = tuple(broadcast)
+        self.defaults = defaults or {}
+
+    def check(self, detail):
+        errors = []
+        for group in self.required:
+            if not any(field in detail for field in group):
+                errors.append(f"missing {'/'.join(group)}")
+        for field, check, _ in self.fields:
+            if field in detail and not check(detail[field]):
+                errors.append(f"invalid {field}: {json.dumps(detail[field], ensure_ascii=False)}")
+        if self.aligned and not errors:
+            errors.extend(self.check_lengths(detail))
+        return errors
+
+    def check_lengths(self, detail):
+        lengths = {field: len(detail[field]) for field in self.aligned if field in detail}
+        if len(set(lengths.values())) > 1:
+            return [f"length mismatch: {', '.join(f'{field}={length}' for field, length in lengths.items())}"]
+        length = max(lengths.values(), default=0)
+        return [f"{field} not repeated for {length} items" for field in self.broadcast if field in detail and len(detail[field]) == 1 < length]
+
+    # 返回 (修复后的新 dict, 仍然存在的错误)
+    def repair(self, detail):
+        repaired = dict(detail)
+        # 节次里写的是 "下午" 这样的时间段时，移到 time_period 中
+        period = repaired.get("period")
+        if "time_period" not in repaired and period and all(item in time_words for item in as_list(period)):
+            repaired["time_period"] = as_list(repaired.pop("period"))
+        for field, value in self.defaults.items():
+            if field not in repaired:
+                repaired[field] = list(value)
+        errors = []
+        for field, check, repair in self.fields:
+            if field not in repaired or check(repaired[field]):
+                continue
+            try:
+                repaired[field] = repair(repaired[field])
+            except (TypeError, ValueError) as error:
+                errors.append(f"invalid {field}: {error}")
+        if errors:
+            return repaired, errors
+        self.align(repaired)
+        return repaired, self.check(repaired)
+
+    def align(self, detail):
+        present = [field for field in self.aligned if field in detail]
+        if not present:
+            return
+        length = max(len(detail[field]) for field in present)
+        for field in present + [field for field in self.broadcast if field in detail]:
+            if len(detail[field]) == 1 and length > 1:
+                detail[field] = detail[field] * length
+
+
+schemas = {classification: Schema(classification, **spec) for classification, spec in schema_specs.items()}
+
+
+# LLM 返回的文本不是合法 JSON 时逐个 token 重新拼接：去掉多余的逗号，把字符串之间的 "." 当作逗号，
+# 补上缺少的逗号和末尾缺少的括号，忽略顶层对象之后的多余内容
+token_pattern = re.compile(r'''
+    (?P<space>\s+)
+  | (?P<string>"(?:[^"\\]|\\.)*")
+  | (?P<number>-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)
+  | (?P<word>[A-Za-z_]+)
+  | (?P<open>[{\[])
+  | (?P<close>[}\]])
+  | (?P<colon>[:：])
+  | (?P<separator>[,.，、;；])
+  | (?P<other>.)
+''', re.VERBOSE | re.DOTALL)
+literals = {"true": "true", "false": "false", "null": "null", "True": "true", "False": "false", "None": "null"}
+closers = {"{": "}", "[": "]"}
+
+def repair_text(text):
+    fence = re.search(r"```(?:json)?\s*(.*?)(?:```|$)", text, re.DOTALL)
+    if fence:
+        text = fence.group(1)
+    start = min((index for index in (text.find("{"), text.find("[")) if index >= 0), default=-1)
+    if start < 0:
+        raise ValueError("no JSON object found")
+
+    tokens = []
+    stack = []
+    for match in token_pattern.finditer(text, start):
+        kind, value = match.lastgroup, match.group()
+        if kind in ("space", "separator"):
+            continue
+        if kind == "other":
+            raise ValueError(f"unexpected character {value!r} at {match.start()}")
+        if kind == "word":
+            if value not in literals:
+                raise ValueError(f"unexpected word {value!r} at {match.start()}")
+            kind, value = "number", literals[value]
+        if kind == "colon":
+            tokens.append(":")
+            continue
+        if kind == "close":
+            if not stack:
+                break
+            tokens.append(closers[stack.pop()])
+            if not stack:
+                break
+            continue
+        # 新的值（或键）紧跟在上一个值之后时补一个逗号
+        if tokens and tokens[-1] not in ("{", "[", ":", ","):
+            tokens.append(",")
+        tokens.append(value)
+        if kind == "open":
+            stack.append(value)
+    if tokens and tokens[-1] == ":":
+        tokens.append("null")
+    while stack:
+        tokens.append(closers[stack.pop()])
+    return "".join(tokens)
+
+# 返回 (解析结果, 是否经过修复)
+def parse_json(content):
+    if not isinstance(content, str):
+        raise ValueError("content is not text")
+    try:
+        return json.loads(content), False
+    except json.JSONDecodeError:
+        pass
+    return json.loads(repair_text(content)), True
+
+
+# 单独提取时返回的整个对象：{"classification": ..., "details": [...]}。
+# 返回 (status, document, errors)，status 为 valid（原样可用）、repaired（修复后可用）或 invalid
+def check_document(document, classification, repaired=False):
+    if not isinstance(document, dict):
+        return "invalid", document, ["not a JSON object"]
+    schema = schemas.get(classification)
+    details = document.get("details")
+    # 字段直接写在顶层、没有 details 数组时，把它们放进 details
+    if details is None and any(field in document for field in field_kinds):
+        details = [{key: value for key, value in document.items() if key != "classification"}]
+        document = {}
+    elif isinstance(details, dict):
+        details = [details]
+    if not isinstance(details, list) or not details or not all(isinstance(detail, dict) for detail in details):
+        return "invalid", document, ["details is not a list of objects"]
+    if details is not document.get("details") or document.get("classification") != classification:
+        document = dict(document, classification=classification, details=details)
+        repaired = True
+    if schema is None:
+        return ("repaired" if repaired else "valid"), document, []
+
+    checked = []
+    errors = []
+    for detail in details:
+        if schema.check(detail):
+            detail, detail_errors = schema.repair(detail)
+            errors.extend(detail_errors)
+            repaired = True
+        checked.append(detail)
+    if repaired:
+        document = dict(document, details=checked)
+    if errors:
+        return "invalid", document, errors
+    return ("repaired" if repaired else "valid"), document, []
+
+def record_validation(classification, status):
+    metrics_registry.inc("pipeline_llm_json_total", {"classification": classification_label(classification), "result": status})
+
+# generate_json 返回的文本：原样可用时返回原文本，修复后可用时返回修复后的 JSON 文本。返回 (status, text, errors)
+def check_segment_json(content, classification):
+    try:
+        document, repaired = parse_json(content)
+    except ValueError as error:
+        record_validation(classification, "invalid")
+        return "invalid", content, [f"invalid JSON: {error}"]
+    status, document, errors = check_document(document, classification, repaired)
+    record_validation(classification, status)
+    if status == "valid":
+        return status, content, errors
+    return status, json.dumps(document, ensure_ascii=False), errors
+
+# classify_input 返回的文本：{"results": [{"segment": ..., "classification": ...}, ...]}，返回值与 check_segment_json 相同
+def check_classification_json(content):
+    try:
+        document, repaired = parse_json(content)
+    except ValueError as error:
+        record_validation("classify", "invalid")
+        return "invalid", content, [f"invalid JSON: {error}"]
+    results = document.get("results") if isinstance(document, dict) else None
+    if not isinstance(results, list) or not all(
+        isinstance(result, dict) and isinstance(result.get("segment"), str) and isinstance(result.get("classification"), str)
+        for result in results
+    ):
+        record_validation("classify", "invalid")
+        return "invalid", content, ["results must be a list of {segment, classification}"]
+    status = "repaired" if repaired else "valid"
+    record_validation("classify", status)
+    return status, json.dumps(document, ensure_ascii=False) if repaired else content, []
+
+
+# 修复率：需要处理的返回结果中在本地修好、不必重新请求的比例
+def repair_stats(summary=None):
+    counts = (summary or metrics_registry.summary()).get("llm_json", {})
+    valid, repaired, invalid = (counts.get(status, 0) for status in ("valid", "repaired", "invalid"))
+    return {
+        "responses": valid + repaired + invalid,
+        "valid": valid,
+        "repaired": repaired,
+        "invalid": invalid,
+        "repair_rate": round(repaired / (repaired + invalid), 4) if repaired + invalid else None
+    }
+
+
+# python output_schema.py 课程时段条件 < response.json：校验、修复一段 LLM 返回的文本并输出结果
+def main():
+    classification = sys.argv[1]
+    status, text, errors = check_segment_json(sys.stdin.read(), classification)
+    print(status)
+    for error in errors:
+        print(f"  {error}")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
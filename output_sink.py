@@ -0,0 +1,121 @@
+import json
+import os
+import tempfile
+
+from compact_output import compact_items, expand_document, is_compact_document
+from metrics import record_payload
+
+
+def load_output_array(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as file:
+        try:
+            data = json.load(file)
+        except json.JSONDecodeError:  # In case the file is empty
+            return []
+    if is_compact_document(data):
+        return expand_document(data)
+    return data if isinstance(data, list) else [data]
+
+def read_json_lines(path):
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+# 先写到同目录下的临时文件，再用 os.replace 原子地替换目标文件，中途失败不会留下写了一半的文件
+def write_json_atomic(path, data, indent=4):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            json.dump(data, file, ensure_ascii=False, indent=indent)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+# 把 JSON Lines 文件中的记录追加到数组格式的输出文件中（原子替换），成功后删除 JSON Lines 文件
+def finalize_json_lines(jsonl_path, array_path, indent=4):
+    data = load_output_array(array_path)
+    data.extend(read_json_lines(jsonl_path))
+    write_json_atomic(array_path, data, indent=indent)
+    if os.path.exists(jsonl_path):
+        os.remove(jsonl_path)
+    return data
+
+
+# 批量模式：打开时读取一次已有的输出，结果先缓存在内存中，close 时一次性原子写回数组格式。
+# indent=None 时不做缩进排版。
+class JsonArraySink:
+    def __init__(self, path, indent=4):
+        self.path = path
+        self.indent = indent
+        self.items = load_output_array(path)
+
+    def write(self, item):
+        self.items.append(item)
+
+    def close(self):
+        write_json_atomic(self.path, self.items, indent=self.indent)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+# 紧凑模式：与批量模式相同，但 close 时写成 compact_output 的引用格式，重复的 classes / courses / teachers 只保存一次
+class CompactArraySink(JsonArraySink):
+    def close(self):
+        write_json_atomic(self.path, compact_items(self.items), indent=self.indent)
+
+
+# 追加模式：每条结果作为一行 JSON 追加到 path，写入后立即 flush，进程中断也不会丢失已处理的结果。
+# 指定 array_path 时，close 会把这些记录合并进数组格式的输出文件。
+class JsonLinesSink:
+    def __init__(self, path, array_path=None, indent=4):
+        self.path = path
+        self.array_path = array_path
+        self.indent = indent
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def write(self, item):
+        line = json.dumps(item, ensure_ascii=False)
+        record_payload("out", line)
+        self.file.write(line)
+        self.file.write('\n')
+        self.file.flush()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.close()
+        if self.array_path:
+            finalize_json_lines(self.path, self.array_path, indent=self.indent)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def open_output_sink(path, mode='batch', indent=4):
+    if mode == 'batch':
+        return JsonArraySink(path, indent=indent)
+    if mode == 'compact':
+        return CompactArraySink(path, indent=indent)
+    if mode == 'jsonl':
+        return JsonLinesSink(os.path.splitext(path)[0] + '.jsonl', array_path=path, indent=indent)
+    if mode == 'jsonl-only':
+        return JsonLinesSink(path)
+    raise ValueError(f"Unknown output mode '{mode}'.")
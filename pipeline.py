@@ -0,0 +1,108 @@
+import contextvars
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from generate_json import generate_checked_json, classify_and_generate
+from local_extractor import extract_locally
+from rule_classifier import classify_input_fast
+
+
+# 同时进行的 generate_json 请求数上限；限流和超时的重试由 llm_transport 负责
+max_workers = 4
+
+
+# LLM 的结果经过 output_schema 校验、修复，见 generate_checked_json
+def extract_segment_json(segment, classification, roster=None):
+    local_json = extract_locally(segment, classification, roster)
+    if local_json is not None:
+        return json.dumps(local_json, ensure_ascii=False)
+    return generate_checked_json(segment, classification)
+
+# 所有分段的 generate_json 请求同时发出，结果按 results 原来的顺序逐个返回，
+# 调用方可以在前面的结果到达后立即处理，不必等全部请求完成。
+# 传入 roster 时，能在本地直接提取的分段不再调用 LLM。
+# 每个任务在提交时的 context 中运行，使工作线程中的 span 挂在调用方的 span 之下。
+# return_exceptions 为 True 时，提取失败的分段返回 (result, 异常)，不中断其他分段
+def iter_segment_json(results, workers=max_workers, roster=None, return_exceptions=False):
+    results = list(results)
+    if not results:
+        return
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(results)))) as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, extract_segment_json, result['segment'], result['classification'], roster)
+            for result in results
+        ]
+        try:
+            for result, future in zip(results, futures):
+                try:
+                    segment_json = future.result()
+                except Exception as error:
+                    if not return_exceptions:
+                        raise
+                    segment_json = error
+                yield result, segment_json
+        finally:
+            for future in futures:
+                future.cancel()
+
+# 分两步：先分类（规则优先），再逐段提取
+def iter_two_stage_json(user_input, workers=max_workers, roster=None):
+    scenario = json.loads(classify_input_fast(user_input))
+    yield from iter_segment_json(scenario.get("results", []), workers=workers, roster=roster)
+
+# 分类和提取合并为一次 LLM 请求；返回结果校验失败时退回两步处理
+def iter_combined_json(user_input, workers=max_workers, roster=None):
+    results = classify_and_generate(user_input)
+    if results is None:
+        print("Combined extraction returned invalid JSON, falling back to two-stage extraction.")
+        yield from iter_two_stage_json(user_input, workers=workers, roster=roster)
+        return
+    for result in results:
+        segment_json = {"classification": result["classification"], "details": result["details"]}
+        yield (
+            {"segment": result["segment"], "classification": result["classification"]},
+            json.dumps(segment_json, ensure_ascii=False)
+        )
+
+# 已经切分好的分段逐个分类、提取，返回 (原分段, result, segment_json)，一个分段可能对应多个 result。
+# 两步处理时所有分段先分类，再一起并发提取；合并处理时每个分段单独请求。
+# 传入 on_error 时，某个分段分类或提取失败只调用 on_error(分段, 异常)，其他分段照常返回
+def iter_each_segment_json(segments, mode="two_stage", workers=max_workers, roster=None, on_error=None):
+    if mode == "two_stage":
+        tagged = []
+        for segment in segments:
+            try:
+                results = json.loads(classify_input_fast(segment)).get("results", [])
+            except Exception as error:
+                if on_error is None:
+                    raise
+                on_error(segment, error)
+                continue
+            tagged.extend((segment, result) for result in results)
+        extracted = iter_segment_json([result for _, result in tagged], workers=workers, roster=roster, return_exceptions=on_error is not None)
+        for (segment, _), (result, segment_json) in zip(tagged, extracted):
+            if isinstance(segment_json, Exception):
+                on_error(segment, segment_json)
+                continue
+            yield segment, result, segment_json
+        return
+    for segment in segments:
+        try:
+            extracted = list(iter_input_json(segment, mode, workers=workers, roster=roster))
+        except Exception as error:
+            if on_error is None:
+                raise
+            on_error(segment, error)
+            continue
+        for result, segment_json in extracted:
+            yield segment, result, segment_json
+
+extraction_modes = {
+    "two_stage": iter_two_stage_json,
+    "combined": iter_combined_json,
+}
+
+def iter_input_json(user_input, mode="two_stage", workers=max_workers, roster=None):
+    if mode not in extraction_modes:
+        raise ValueError(f"Unknown extraction mode '{mode}'.")
+    return extraction_modes[mode](user_input, workers=workers, roster=roster)
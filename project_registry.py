@@ -0,0 +1,273 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future
+
+import agent
+from metrics import registry as metrics_registry, span
+
+
+# 同时常驻内存的 roster 的估算大小上限（字节，见 Roster.memory_bytes），超出时淘汰最久没有使用的 roster
+roster_memory_limit = 512 * 1024 * 1024
+# 距离上次检查超过这么多秒后，访问时检查源文件是否变化，变化了就重新加载；
+# 同时重新估算 roster 的大小（使用过程中建立的词典自动机、缓存等会让 roster 变大）
+reload_check_interval = 2.0
+
+
+# 一个项目（学校）的一组场景及其 roster 源文件
+class ProjectSource:
+    def __init__(self, project_id, course_scenario_id, teacher_scenario_id, class_path, teacher_path, name=None):
+        self.project_id = project_id
+        self.course_scenario_id = course_scenario_id
+        self.teacher_scenario_id = teacher_scenario_id
+        self.class_path = class_path
+        self.teacher_path = teacher_path
+        self.name = name
+
+    @property
+    def key(self):
+        return (self.project_id, self.course_scenario_id)
+
+    def signature(self):
+        signature = []
+        for path in (self.class_path, self.teacher_path):
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def status(self):
+        return {
+            "projectId": self.project_id,
+            "courseScenarioId": self.course_scenario_id,
+            "teacherScenarioId": self.teacher_scenario_id,
+            "name": self.name
+        }
+
+
+# projects.json：
+#   {"projects": [{"projectId": 458, "courseScenarioId": 984, "teacherScenarioId": 985,
+#                  "classInfo": "schools/458/class_info.json", "teacherInfo": "schools/458/teacher_info.json", "name": "..."}]}
+# 相对路径相对于 projects.json 所在的目录
+def load_projects(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        data = json.load(file)
+    base = os.path.dirname(os.path.abspath(path))
+    projects = []
+    for entry in data.get("projects", []):
+        projects.append(ProjectSource(
+            int(entry["projectId"]),
+            int(entry["courseScenarioId"]),
+            int(entry["teacherScenarioId"]),
+            os.path.join(base, entry["classInfo"]),
+            os.path.join(base, entry["teacherInfo"]),
+            entry.get("name")
+        ))
+    return projects
+
+
+class LoadedRoster:
+    __slots__ = ("roster", "size", "signature", "checked_at", "measured_at")
+
+    def __init__(self, roster, size, signature):
+        self.roster = roster
+        self.size = size
+        self.signature = signature
+        self.checked_at = time.monotonic()
+        self.measured_at = self.checked_at
+
+
+# 按项目和场景找到 roster：第一次访问时才加载，加载好的 roster 放在按估算内存限制大小的 LRU 中。
+# 同一个 roster 同时只加载一次，其他线程等待并共用结果。被淘汰的 roster 在正在使用它的请求结束后释放。
+class ProjectRegistry:
+    def __init__(self, projects, memory_limit=None, load=None):
+        self.sources = {}
+        self.by_project = defaultdict(list)
+        for source in projects:
+            self.register(source)
+        self.memory_limit = memory_limit if memory_limit is not None else roster_memory_limit
+        self.load = load or agent.load_roster
+        self.loaded = OrderedDict()
+        self.loading = {}
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reloads = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path, memory_limit=None):
+        return cls(load_projects(path), memory_limit)
+
+    def register(self, source):
+        if source.key in self.sources:
+            raise ValueError(f"Project {source.project_id} scenario {source.course_scenario_id} is registered twice.")
+        self.sources[source.key] = source
+        self.by_project[source.project_id].append(source)
+
+    # scenario_id 可以是课程场景或教师场景的 id；项目只有一组场景时可以省略
+    def resolve(self, project_id, scenario_id=None):
+        candidates = self.by_project.get(project_id, [])
+        if scenario_id is not None:
+            candidates = [source for source in candidates if scenario_id in (source.course_scenario_id, source.teacher_scenario_id)]
+        if not candidates:
+            scenario = f" scenario {scenario_id}" if scenario_id is not None else ""
+            raise KeyError(f"Unknown project {project_id}{scenario}.")
+        if len(candidates) > 1:
+            raise KeyError(f"Project {project_id} has several scenarios, specify the scenario id.")
+        return candidates[0]
+
+    def get(self, project_id, scenario_id=None):
+        source = self.resolve(project_id, scenario_id)
+        key = source.key
+        with self._lock:
+            entry = self.loaded.get(key)
+            hit = entry is not None and not self.changed(source, entry)
+            if hit:
+                self.loaded.move_to_end(key)
+                measure = self.measure_due(entry)
+                self.hits += 1
+                metrics_registry.inc("pipeline_roster_requests_total", {"result": "hit"})
+            else:
+                future = self.loading.get(key)
+                owner = future is None
+                if owner:
+                    future = self.loading[key] = Future()
+                    self.misses += 1
+                    if entry is not None:
+                        self.reloads += 1
+                    metrics_registry.inc("pipeline_roster_requests_total", {"result": "reload" if entry is not None else "miss"})
+        if hit:
+            if measure:
+                self.remeasure(key, entry)
+            return entry.roster
+        if not owner:
+            return future.result()
+
+        try:
+            roster = self.load_source(source)
+        except BaseException as error:
+            with self._lock:
+                del self.loading[key]
+            future.set_exception(error)
+            raise
+        future.set_result(roster)
+        return roster
+
+    # 在持有锁时调用；每隔 reload_check_interval 秒才需要重新估算一次，返回 True 的调用方负责估算
+    def measure_due(self, entry):
+        now = time.monotonic()
+        if now - entry.measured_at < reload_check_interval:
+            return False
+        entry.measured_at = now
+        return True
+
+    # 不持有锁时估算（遍历整个 roster，较慢），只在更新大小和淘汰时加锁；变大后按新的大小淘汰其他 roster
+    def remeasure(self, key, entry):
+        size = entry.roster.memory_bytes()
+        with self._lock:
+            # 估算期间 roster 可能已被淘汰或重新加载
+            if self.loaded.get(key) is not entry or size == entry.size:
+                return
+            self.resident_bytes += size - entry.size
+            entry.size = size
+            self.evict_over_limit()
+
+    # 在持有锁时调用；每隔 reload_check_interval 秒才真正检查一次文件
+    def changed(self, source, entry):
+        now = time.monotonic()
+        if now - entry.checked_at < reload_check_interval:
+            return False
+        entry.checked_at = now
+        try:
+            return source.signature() != entry.signature
+        except OSError:
+            return False
+
+    def load_source(self, source):
+        signature = source.signature()
+        with span("roster_load"):
+            roster = self.load(source.class_path, source.teacher_path)
+            roster.project_id = source.project_id
+            roster.course_scenario_id = source.course_scenario_id
+            roster.teacher_scenario_id = source.teacher_scenario_id
+            size = roster.memory_bytes()
+        with self._lock:
+            previous = self.loaded.pop(source.key, None)
+            if previous is not None:
+                self.resident_bytes -= previous.size
+            self.loaded[source.key] = LoadedRoster(roster, size, signature)
+            self.resident_bytes += size
+            del self.loading[source.key]
+            self.evict_over_limit()
+        return roster
+
+    # 在持有锁时调用；最近加载的 roster 即使单独超过上限也保留
+    def evict_over_limit(self):
+        while self.resident_bytes > self.memory_limit and len(self.loaded) > 1:
+            key, entry = self.loaded.popitem(last=False)
+            self.resident_bytes -= entry.size
+            self.evictions += 1
+            metrics_registry.inc("pipeline_roster_evictions_total", {})
+            print(f"Evicted roster for project {key[0]} scenario {key[1]} ({entry.size // 1024} KB).")
+        self.update_gauges()
+
+    def update_gauges(self):
+        metrics_registry.set("pipeline_roster_resident_bytes", {}, self.resident_bytes)
+        metrics_registry.set("pipeline_roster_resident_count", {}, len(self.loaded))
+
+    def evict(self, project_id, scenario_id=None):
+        key = self.resolve(project_id, scenario_id).key
+        with self._lock:
+            entry = self.loaded.pop(key, None)
+            if entry is not None:
+                self.resident_bytes -= entry.size
+            self.update_gauges()
+        return entry is not None
+
+    def clear(self):
+        with self._lock:
+            self.loaded.clear()
+            self.resident_bytes = 0
+            self.update_gauges()
+
+    def status(self):
+        with self._lock:
+            loaded = [
+                dict(self.sources[key].status(), bytes=entry.size)
+                for key, entry in self.loaded.items()
+            ]
+            return {
+                "projects": len(self.sources),
+                "loaded": loaded,
+                "resident_bytes": self.resident_bytes,
+                "memory_limit": self.memory_limit,
+                "hits": self.hits,
+                "misses": self.misses,
+                "reloads": self.reloads,
+                "evictions": self.evictions
+            }
+
+
+# python project_registry.py projects.json：逐个加载登记的项目，输出每个 roster 的估算内存，用于设置 roster_memory_limit
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else "projects.json"
+    registry = ProjectRegistry.from_file(path, memory_limit=0)
+    sizes = []
+    for source in registry.sources.values():
+        start = time.perf_counter()
+        registry.get(source.project_id, source.course_scenario_id)
+        sizes.append(dict(
+            source.status(),
+            bytes=registry.loaded[source.key].size,
+            load_s=round(time.perf_counter() - start, 3)
+        ))
+    total = sum(size["bytes"] for size in sizes)
+    print(json.dumps({"projects": sizes, "total_bytes": total}, ensure_ascii=False, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+import json
+import math
+import re
+import sys
+import textwrap
+from collections import Counter
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+# 每个情境最多保留的例子数和例子部分的 token 上限（至少保留一个例子）
+max_examples = 2
+example_token_budget = 320
+input_sentinel = "\u0000USER_INPUT\u0000"
+
+cjk_char = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+example_input = re.compile(r'User Input:\s*"([^"]*)"')
+blank_lines = re.compile(r'\n\s*\n+')
+
+_encoders = {}
+
+
+# 安装了 tiktoken 时用模型对应的编码计数，否则按中文字符约 1 token、其他字符约 4 个 1 token 估算
+def count_tokens(text, model="gpt-4o"):
+    if tiktoken is not None:
+        encoder = _encoders.get(model)
+        if encoder is None:
+            try:
+                encoder = tiktoken.encoding_for_model(model)
+            except KeyError:
+                encoder = tiktoken.get_encoding("o200k_base")
+            _encoders[model] = encoder
+        return len(encoder.encode(text))
+    cjk = len(cjk_char.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+def count_message_tokens(messages, model="gpt-4o"):
+    # 每条消息另有约 4 个 token 的格式开销
+    return sum(count_tokens(message["content"], model) + 4 for message in messages)
+
+
+def compact_prose(text):
+    return "\n".join(line.strip() for line in text.strip().splitlines() if line.strip())
+
+# 例子中的 JSON：去掉公共缩进并把缩进减半；prompt_templates 是按 f-string 转义写的，{{ }} 还原为 { }
+def compact_example(text):
+    lines = []
+    for line in textwrap.dedent(text).strip().splitlines():
+        stripped = line.lstrip(' ')
+        if stripped:
+            lines.append(' ' * ((len(line) - len(stripped)) // 2) + stripped.rstrip())
+    return "\n".join(lines).replace("{{", "{").replace("}}", "}")
+
+# [(参数名或 None, 说明行)]
+def parse_glossary(parameter_descriptions):
+    glossary = []
+    for line in compact_prose(parameter_descriptions).splitlines():
+        match = re.match(r'([A-Za-z_]+)\s*[：:]', line)
+        glossary.append((match.group(1) if match else None, line))
+    return glossary
+
+def split_examples(template):
+    blocks = re.split(r'(?=User Input:)', textwrap.dedent(template))
+    examples = []
+    seen = set()
+    for block in blocks:
+        if not block.strip():
+            continue
+        text = compact_example(block)
+        if text in seen:
+            continue
+        seen.add(text)
+        match = example_input.search(text)
+        examples.append({"input": match.group(1).strip() if match else "", "text": text})
+    return examples
+
+def bigrams(text):
+    text = re.sub(r'\s+', '', text)
+    return Counter(text[i:i + 2] for i in range(len(text) - 1)) or Counter(text)
+
+# 字符二元组的 Dice 相似度，适合中文短句
+def similarity(a, b):
+    grams_a, grams_b = bigrams(a), bigrams(b)
+    total = sum(grams_a.values()) + sum(grams_b.values())
+    if not total:
+        return 0.0
+    return 2 * sum((grams_a & grams_b).values()) / total
+
+
+class PromptCompiler:
+    def __init__(self, classification_descriptions, parameter_descriptions, prompt_templates, classify_prompt=None, model="gpt-4o"):
+        self.model = model
+        self.examples = {classification: split_examples(template) for classification, template in prompt_templates.items()}
+        for examples in self.examples.values():
+            for example in examples:
+                example["tokens"] = count_tokens(example["text"], model)
+
+        # system 消息：同一情境的请求完全相同，随输入变化的例子和用户输入放在最后一条用户消息中。
+        # 这部分只有 200~300 个 token，达不到服务端前缀缓存的最小长度，目的是减少 token 数而不是命中缓存。
+        # 参数说明只保留该情境的例子中出现过的参数，没有以参数名开头的说明行（如“记住：...”）总是保留
+        self.glossary = parse_glossary(parameter_descriptions)
+        self.generate_prefixes = {
+            classification: self.build_generate_prefix(examples)
+            for classification, examples in self.examples.items()
+        }
+        self.default_generate_prefix = self.build_generate_prefix(None)
+        if classify_prompt is not None:
+            self.classify_prefix = self.compile_prefix(classify_prompt)
+        else:
+            self.classify_prefix = (
+                "基于用户输入，返回一个JSON对象，包含一个数组，其中包含用户输入的情境类型。可能的情况包含：\n"
+                f"{compact_prose(classification_descriptions)}"
+            )
+
+    def build_generate_prefix(self, examples):
+        if examples is None:
+            lines = [line for _, line in self.glossary]
+        else:
+            text = "\n".join(example["text"] for example in examples)
+            lines = [line for name, line in self.glossary if name is None or f'"{name}"' in text]
+        return (
+            "基于用户输入的情况，提炼出其中的信息并且输出到一个JSON对象。\n\n"
+            "可能包含的参数：\n" + "\n".join(lines) + "\n\n"
+            "按照例子的格式输出。"
+        )
+
+    # 用占位符渲染原来的整段 prompt，取占位符所在行之前的部分作为固定前缀
+    def compile_prefix(self, render):
+        text = render(input_sentinel)
+        prefix = text[:text.index(input_sentinel)]
+        prefix = prefix[:prefix.rfind("\n") + 1] if "\n" in prefix else ""
+        return blank_lines.sub("\n\n", compact_example(prefix)).strip()
+
+    def select_examples(self, classification, user_input):
+        examples = self.examples.get(classification, [])
+        if len(examples) <= 1:
+            return examples
+        ranked = sorted(range(len(examples)), key=lambda index: -similarity(user_input, examples[index]["input"]))
+        selected = []
+        tokens = 0
+        for index in ranked:
+            if selected and (len(selected) >= max_examples or tokens + examples[index]["tokens"] > example_token_budget):
+                break
+            selected.append(index)
+            tokens += examples[index]["tokens"]
+        return [examples[index] for index in sorted(selected)]
+
+    def classify_messages(self, user_input):
+        return [
+            {"role": "system", "content": self.classify_prefix},
+            {"role": "user", "content": f'User input: "{user_input}"'}
+        ]
+
+    def generate_messages(self, user_input, classification):
+        examples = self.select_examples(classification, user_input)
+        if examples:
+            example_text = "\n".join(example["text"] for example in examples)
+        else:
+            example_text = "Unknown classification. Please return an empty JSON object."
+        return [
+            {"role": "system", "content": self.generate_prefixes.get(classification, self.default_generate_prefix)},
+            {"role": "user", "content": f'例：\n{example_text}\n\n用户输入："{user_input}"\nJSON输出：'}
+        ]
+
+    def template_stats(self):
+        return {
+            classification: {
+                "examples": len(examples),
+                "tokens": sum(example["tokens"] for example in examples)
+            }
+            for classification, examples in self.examples.items()
+        }
+
+    # 对每个样本比较原始 prompt 和编译后的 prompt 的 token 数
+    def report(self, samples, legacy_generate, legacy_classify=None):
+        categories = {}
+        for sample in samples:
+            classification = sample.get("classification")
+            if classification not in self.examples:
+                continue
+            segment = sample["segment"]
+            legacy = count_tokens(legacy_generate(segment, classification), self.model) + 4
+            compiled = count_message_tokens(self.generate_messages(segment, classification), self.model)
+
+            category = categories.setdefault(classification, {"samples": 0, "legacy_tokens": 0, "compiled_tokens": 0})
+            category["samples"] += 1
+            category["legacy_tokens"] += legacy
+            category["compiled_tokens"] += compiled
+
+        report = {"tokenizer": "tiktoken" if tiktoken is not None else "estimate", "generate_json": {}}
+        for classification, category in categories.items():
+            samples_count = category["samples"]
+            legacy = category["legacy_tokens"] / samples_count
+            compiled = category["compiled_tokens"] / samples_count
+            report["generate_json"][classification] = {
+                "samples": samples_count,
+                "legacy_tokens": round(legacy, 1),
+                "compiled_tokens": round(compiled, 1),
+                "tokens_saved_pct": round((1 - compiled / legacy) * 100, 1)
+            }
+
+        if legacy_classify is not None:
+            inputs = [sample["segment"] for sample in samples]
+            legacy = sum(count_tokens(legacy_classify(segment), self.model) + 4 for segment in inputs) / len(inputs)
+            compiled = sum(count_message_tokens(self.classify_messages(segment), self.model) for segment in inputs) / len(inputs)
+            report["classify_input"] = {
+                "samples": len(inputs),
+                "legacy_tokens": round(legacy, 1),
+                "compiled_tokens": round(compiled, 1),
+                "tokens_saved_pct": round((1 - compiled / legacy) * 100, 1)
+            }
+        report["templates"] = self.template_stats()
+        return report
+
+
+def main():
+    import generate_json
+
+    corpus_path = sys.argv[1] if len(sys.argv) > 1 else "classifier_corpus.jsonl"
+    with open(corpus_path, 'r', encoding='utf-8') as file:
+        samples = [json.loads(line) for line in file if line.strip()]
+    report = generate_json.prompt_compiler.report(samples, generate_json.generate_prompt, generate_json.classify_prompt)
+    print(json.dumps(report, ensure_ascii=False, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import sys
+from collections.abc import Mapping
+
+
+def interned(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+# roster 中的一行：用 __slots__ 存储，字符串字段 intern 后在各行之间共用。
+# 仍然可以像原来的 dict 一样用 row["teacherName"] / row.get(...) 读取，字段名与原来的 key 相同。
+class Record(Mapping):
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self)!r})"
+
+
+class Course(Record):
+    __slots__ = ("name", "uid", "courseDcode")
+
+    def __init__(self, name, uid, courseDcode):
+        self.name = interned(name)
+        self.uid = interned(uid)
+        self.courseDcode = interned(courseDcode)
+
+class Clazz(Record):
+    __slots__ = ("gradeName", "name", "uid", "type")
+
+    def __init__(self, gradeName, name, uid, type):
+        self.gradeName = interned(gradeName)
+        self.name = interned(name)
+        self.uid = interned(uid)
+        self.type = interned(type)
+
+class TeacherAssignment(Record):
+    __slots__ = ("teacherName", "teacherUid", "className", "classUid", "courseName", "courseUid", "courseDcode")
+
+    def __init__(self, teacherName, teacherUid, className, classUid, courseName, courseUid, courseDcode):
+        self.teacherName = interned(teacherName)
+        self.teacherUid = interned(teacherUid)
+        self.className = interned(className)
+        self.classUid = interned(classUid)
+        self.courseName = interned(courseName)
+        self.courseUid = interned(courseUid)
+        self.courseDcode = interned(courseDcode)
+
+class HeaderTeacher(Record):
+    __slots__ = ("teacherId", "teacherName", "gradeDcode", "classId")
+
+    def __init__(self, teacherId, teacherName, gradeDcode, classId):
+        self.teacherId = interned(teacherId)
+        self.teacherName = interned(teacherName)
+        self.gradeDcode = interned(gradeDcode)
+        self.classId = interned(classId)
+
+
+# 输出中的班级：直接引用 roster 中的 Clazz，到序列化时才生成 "初一01班" 这样的完整名称
+class ClassOutput(Mapping):
+    __slots__ = ("clazz",)
+    fields = ("gradeName", "name", "alias", "uid", "type")
+
+    def __init__(self, clazz):
+        self.clazz = clazz
+
+    def __getitem__(self, key):
+        if key == "name":
+            return f"{self.clazz['gradeName']}{self.clazz['name']}"
+        if key == "alias":
+            return ""
+        if key not in self.fields:
+            raise KeyError(key)
+        return self.clazz[key]
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self)!r})"
+
+class ClassRef(ClassOutput):
+    __slots__ = ()
+    fields = ("uid", "name")
+
+
+# 处理函数的输出在交给调用方之前转成普通的 dict / list（结构与原来的输出相同），之后按普通 JSON 处理
+def plain(value):
+    if isinstance(value, Mapping):
+        return {key: plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [plain(item) for item in value]
+    return value
+
+# json.dump(..., default=json_default)：roster 记录和尚未转换的输出视图按原来的 dict 结构输出
+def json_default(value):
+    if isinstance(value, Mapping):
+        return dict(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
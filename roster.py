@@ -0,0 +1,176 @@
+import sys
+from collections import defaultdict
+from operator import attrgetter, itemgetter
+
+from records import Record
+
+
+# Roster.memoize 中每类缓存的最大条目数
+memoize_limit = 4096
+# 没有在 project_registry 中登记的 roster（如 agent.py 默认的 class_info.json / teacher_info.json）使用的项目和场景
+default_project_id = 458
+default_course_scenario_id = 984
+default_teacher_scenario_id = 985
+
+
+# 按列取出每一行的若干字段；列式存储的行（如 roster 快照）可以不构造整行 dict
+def row_values(rows, fields):
+    if hasattr(rows, "iter_fields"):
+        return rows.iter_fields(fields)
+    if rows and isinstance(rows[0], Record):
+        return map(attrgetter(*fields), rows)
+    return map(itemgetter(*fields), rows)
+
+# 对象及其引用的 dict / list / 行对象 / 普通对象属性的大小之和，seen 中的对象（共享的字符串等）只计算一次。
+# 先复制一份再遍历，其他线程同时往缓存中添加条目时不会出错
+def deep_size(value, seen):
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in tuple(value.items()):
+            size += deep_size(key, seen) + deep_size(item, seen)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for item in tuple(value):
+            size += deep_size(item, seen)
+    elif isinstance(value, Record):
+        for item in value.values():
+            size += deep_size(item, seen)
+    elif hasattr(value, "__dict__") and not isinstance(value, type):
+        size += deep_size(vars(value), seen)
+    return size
+
+
+# all_info 的索引版本：仍然可以像原来的 dict 一样使用 all_info["teacher_info"] 等，
+# 同时额外维护按教师、班级、课程的哈希索引，索引中保存的是行号，查询结果保持原始顺序。
+class Roster(dict):
+    def __init__(self, course_info, class_info, teacher_info, header_teachers, class_grade_dcodes=None):
+        super().__init__(
+            course_info=course_info,
+            class_info=class_info,
+            teacher_info=teacher_info,
+            header_teachers=header_teachers,
+            class_grade_dcodes=class_grade_dcodes or {}
+        )
+        # 输出中的 projectId / projectScenarioId，由 project_registry 按项目设置
+        self.project_id = default_project_id
+        self.course_scenario_id = default_course_scenario_id
+        self.teacher_scenario_id = default_teacher_scenario_id
+        # 由 roster 派生出来的结构（如词典自动机），随 roster 一起丢弃
+        self.derived = {}
+        self.table_bytes = None
+        self.build_indexes()
+
+    def build_indexes(self):
+        class_info = self["class_info"]
+        teacher_info = self["teacher_info"]
+
+        self.class_by_uid = {}
+        self.class_grades = []
+        self.classes_by_grade = defaultdict(list)
+        self.classes_by_grade_name = defaultdict(list)
+        for pos, (grade_name, class_name, class_uid) in enumerate(row_values(class_info, ("gradeName", "name", "uid"))):
+            self.class_by_uid.setdefault(class_uid, pos)
+            self.class_grades.append(grade_name)
+            self.classes_by_grade[grade_name].append(pos)
+            self.classes_by_grade_name[(grade_name, class_name)].append(pos)
+
+        self.teachers_by_name = defaultdict(list)
+        self.teachers_by_uid = defaultdict(list)
+        self.teachers_by_course = defaultdict(list)
+        self.teachers_by_grade_course = defaultdict(list)
+        teacher_fields = ("teacherName", "teacherUid", "courseName", "classUid", "className")
+        for pos, (teacher_name, teacher_uid, course_name, class_uid, class_name) in enumerate(row_values(teacher_info, teacher_fields)):
+            self.teachers_by_name[teacher_name.strip()].append(pos)
+            self.teachers_by_uid[teacher_uid].append(pos)
+            self.teachers_by_course[course_name].append(pos)
+            grade_name = self.grade_of_class(class_uid, class_name)
+            self.teachers_by_grade_course[(grade_name, course_name)].append(pos)
+
+    # 估算 roster 占用的内存（字节）：各表、索引以及其中的行和字符串，加上 derived 中的结构。
+    # 表和索引加载后不再变化，只计算一次；derived 中的词典自动机、memoize 的缓存等在使用过程中才建立，每次重新计算
+    def memory_bytes(self):
+        if self.table_bytes is None:
+            seen = set()
+            total = 0
+            for table in self.values():
+                if not hasattr(table, "iter_fields"):
+                    total += deep_size(table, seen)
+            for name, value in vars(self).items():
+                if name not in ("derived", "table_bytes"):
+                    total += deep_size(value, seen)
+            self.table_bytes = total
+        return self.table_bytes + self.derived_bytes()
+
+    # 从快照加载时行不在内存中，改为计入映射的快照文件和已经解码的字符串
+    def derived_bytes(self):
+        seen = set()
+        total = 0
+        for name, value in tuple(self.derived.items()):
+            if name == "snapshot":
+                total += len(value.mm) + deep_size(value.strings, seen)
+            else:
+                total += deep_size(value, seen)
+        return total
+
+    # 在 self.derived[name] 中按 key 缓存 build() 的结果；key 可能来自 LLM 输出，条目过多时整体清空
+    def memoize(self, name, key, build):
+        cache = self.derived.setdefault(name, {})
+        value = cache.get(key)
+        if value is None:
+            if len(cache) >= memoize_limit:
+                cache.clear()
+            value = cache[key] = build()
+        return value
+
+    def grade_of_class(self, class_uid, class_name=""):
+        pos = self.class_by_uid.get(class_uid)
+        if pos is not None:
+            return self.class_grades[pos]
+        return class_name[:2]
+
+    def class_rows(self, positions):
+        class_info = self["class_info"]
+        return [class_info[pos] for pos in positions]
+
+    def teacher_rows(self, positions):
+        teacher_info = self["teacher_info"]
+        return [teacher_info[pos] for pos in positions]
+
+    def classes_in_grade(self, grade_name):
+        return self.class_rows(self.classes_by_grade.get(grade_name, []))
+
+    def find_classes(self, grades, class_names):
+        positions = set()
+        for grade_name in grades:
+            for class_name in class_names:
+                positions.update(self.classes_by_grade_name.get((grade_name, class_name), []))
+        return self.class_rows(sorted(positions))
+
+    def teachers_named(self, teacher_name):
+        return self.teacher_rows(self.teachers_by_name.get(teacher_name, []))
+
+    def teachers_with_uid(self, teacher_uid):
+        return self.teacher_rows(self.teachers_by_uid.get(teacher_uid, []))
+
+    # 与原来的 `grade_name in className and course_name in courseName` 语义一致：
+    # 课程名做子串匹配（遍历的是去重后的课程名），年级已知时直接走 (年级, 课程) 索引。
+    def find_teachers(self, grade_name, course_name):
+        positions = []
+        for name, course_positions in self.teachers_by_course.items():
+            if course_name not in name:
+                continue
+            if grade_name in self.classes_by_grade:
+                positions.extend(self.teachers_by_grade_course.get((grade_name, name), []))
+            else:
+                teacher_info = self["teacher_info"]
+                positions.extend(pos for pos in course_positions if grade_name in teacher_info[pos]["className"])
+        return self.teacher_rows(sorted(positions))
+
+    def teachers_for_grades_courses(self, grades, course_names):
+        positions = set()
+        for grade_name in grades:
+            for course_name in course_names:
+                positions.update(self.teachers_by_grade_course.get((grade_name, course_name), []))
+        return self.teacher_rows(sorted(positions))
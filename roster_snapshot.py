@@ -0,0 +1,302 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from collections.abc import Sequence
+
+from records import Clazz, Course, HeaderTeacher, TeacherAssignment
+from roster import Roster
+
+
+# 快照文件格式（小端）：
+#   "RSNP" | 版本 u32 | 头部长度 u32 | 头部 JSON | 对齐到 8 字节后的数据区
+# 数据区：字符串表（偏移数组 u32、类型数组 u8、UTF-8 数据）以及每张表每一列的 int32 字符串编号数组。
+# 加载时直接 mmap 文件，列数组通过 memoryview.cast 引用，不做复制；字符串在第一次访问时解码并 intern。
+snapshot_magic = b"RSNP"
+snapshot_version = 1
+preamble = struct.Struct("<4sII")
+
+tables = {
+    "course_info": ("name", "uid", "courseDcode"),
+    "class_info": ("gradeName", "name", "uid", "type"),
+    "teacher_info": ("teacherName", "teacherUid", "className", "classUid", "courseName", "courseUid", "courseDcode"),
+    "header_teachers": ("teacherId", "teacherName", "gradeDcode", "classId"),
+    "class_grade_dcodes": ("className", "gradeDcode"),
+}
+
+# 读出的行按表构造成对应的记录类型，字段顺序与 tables 中一致
+record_types = {
+    "course_info": Course,
+    "class_info": Clazz,
+    "teacher_info": TeacherAssignment,
+    "header_teachers": HeaderTeacher,
+}
+
+STRING_KIND = 0
+JSON_KIND = 1
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def source_fingerprint(path):
+    stat = os.stat(path)
+    return {
+        "path": os.path.abspath(path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": file_sha256(path)
+    }
+
+def default_snapshot_path(class_path):
+    return os.path.splitext(class_path)[0] + '.snapshot'
+
+
+def roster_table_rows(roster):
+    return {
+        "course_info": [
+            {"name": name, "uid": course["uid"], "courseDcode": course["courseDcode"]}
+            for name, course in roster["course_info"].items()
+        ],
+        "class_info": roster["class_info"],
+        "teacher_info": roster["teacher_info"],
+        "header_teachers": roster["header_teachers"],
+        "class_grade_dcodes": [
+            {"className": class_name, "gradeDcode": grade_dcode}
+            for class_name, grade_dcode in roster["class_grade_dcodes"].items()
+        ],
+    }
+
+def align(size, boundary=8):
+    return (size + boundary - 1) // boundary * boundary
+
+def compile_snapshot(roster, sources, snapshot_path):
+    string_ids = {}
+    encoded_strings = []
+    kinds = array('B')
+
+    def string_id(value):
+        if value is None:
+            return -1
+        key = (type(value).__name__, value) if not isinstance(value, str) else value
+        sid = string_ids.get(key)
+        if sid is None:
+            sid = len(encoded_strings)
+            string_ids[key] = sid
+            if isinstance(value, str):
+                encoded_strings.append(value.encode('utf-8'))
+                kinds.append(STRING_KIND)
+            else:
+                encoded_strings.append(json.dumps(value, ensure_ascii=False).encode('utf-8'))
+                kinds.append(JSON_KIND)
+        return sid
+
+    columns = {}
+    counts = {}
+    for table, rows in roster_table_rows(roster).items():
+        fields = tables[table]
+        table_columns = {field: array('i') for field in fields}
+        for row in rows:
+            for field in fields:
+                table_columns[field].append(string_id(row.get(field)))
+        columns[table] = table_columns
+        counts[table] = len(rows)
+
+    offsets = array('I', [0])
+    for encoded in encoded_strings:
+        offsets.append(offsets[-1] + len(encoded))
+    blob = b"".join(encoded_strings)
+
+    # 依次排列各个区段，记录相对数据区起点的偏移
+    sections = {}
+    chunks = []
+    position = 0
+
+    def add_section(name, payload):
+        nonlocal position
+        sections[name] = [position, len(payload)]
+        padding = align(len(payload)) - len(payload)
+        chunks.append(payload + b"\0" * padding)
+        position += len(payload) + padding
+
+    add_section("string_offsets", offsets.tobytes())
+    add_section("string_kinds", kinds.tobytes())
+    add_section("string_blob", blob)
+    for table, table_columns in columns.items():
+        for field, values in table_columns.items():
+            add_section(f"{table}.{field}", values.tobytes())
+
+    header = json.dumps({
+        "sources": sources,
+        "strings": len(encoded_strings),
+        "counts": counts,
+        "sections": sections
+    }, ensure_ascii=False).encode('utf-8')
+    head = preamble.pack(snapshot_magic, snapshot_version, len(header)) + header
+    head += b"\0" * (align(len(head)) - len(head))
+
+    directory = os.path.dirname(os.path.abspath(snapshot_path))
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(snapshot_path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(head)
+            for chunk in chunks:
+                file.write(chunk)
+        os.replace(tmp_path, snapshot_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return snapshot_path
+
+
+class SnapshotRows(Sequence):
+    def __init__(self, snapshot, table):
+        self.snapshot = snapshot
+        self.fields = tables[table]
+        self.record_type = record_types.get(table)
+        self.columns = [snapshot.column(table, field) for field in self.fields]
+        self.count = snapshot.header["counts"][table]
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[position] for position in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("snapshot row index out of range")
+        string = self.snapshot.string
+        if self.record_type is not None:
+            return self.record_type(*(string(column[index]) for column in self.columns))
+        return {field: string(column[index]) for field, column in zip(self.fields, self.columns)}
+
+    def iter_fields(self, fields):
+        string = self.snapshot.string
+        columns = [self.columns[self.fields.index(field)] for field in fields]
+        return zip(*(map(string, column) for column in columns))
+
+
+class RosterSnapshot:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self.mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.mm)
+        if len(view) < preamble.size:
+            raise ValueError(f"Roster snapshot {path} is truncated.")
+        magic, version, header_length = preamble.unpack_from(view, 0)
+        if magic != snapshot_magic or version != snapshot_version:
+            raise ValueError(f"Roster snapshot {path} has an unsupported format.")
+        self.header = json.loads(bytes(view[preamble.size:preamble.size + header_length]).decode('utf-8'))
+        self.data_start = align(preamble.size + header_length)
+        self.view = view
+
+        self.string_offsets = self.section("string_offsets").cast('I')
+        self.string_kinds = self.section("string_kinds")
+        self.string_blob = self.section("string_blob")
+        self.strings = [None] * self.header["strings"]
+
+    def section(self, name):
+        offset, length = self.header["sections"][name]
+        start = self.data_start + offset
+        if start + length > len(self.view):
+            raise ValueError(f"Roster snapshot {self.path} is truncated.")
+        return self.view[start:start + length]
+
+    def column(self, table, field):
+        return self.section(f"{table}.{field}").cast('i')
+
+    def string(self, sid):
+        if sid < 0:
+            return None
+        value = self.strings[sid]
+        if value is None:
+            raw = bytes(self.string_blob[self.string_offsets[sid]:self.string_offsets[sid + 1]]).decode('utf-8')
+            value = sys.intern(raw) if self.string_kinds[sid] == STRING_KIND else json.loads(raw)
+            self.strings[sid] = value
+        return value
+
+    # 源文件大小和 mtime 都没变时直接认为有效；mtime 变了但内容哈希相同也仍然有效
+    def matches(self, paths):
+        sources = self.header["sources"]
+        if len(sources) != len(paths):
+            return False
+        for source, path in zip(sources, paths):
+            if source["path"] != os.path.abspath(path):
+                return False
+            stat = os.stat(path)
+            if stat.st_size != source["size"]:
+                return False
+            if stat.st_mtime_ns != source["mtime_ns"] and file_sha256(path) != source["sha256"]:
+                return False
+        return True
+
+    def to_roster(self):
+        course_info = {course.name: course for course in SnapshotRows(self, "course_info")}
+        class_grade_dcodes = {row["className"]: row["gradeDcode"] for row in SnapshotRows(self, "class_grade_dcodes")}
+        roster = Roster(
+            course_info,
+            SnapshotRows(self, "class_info"),
+            SnapshotRows(self, "teacher_info"),
+            SnapshotRows(self, "header_teachers"),
+            class_grade_dcodes
+        )
+        roster.derived["snapshot"] = self
+        roster.derived["sources"] = self.header["sources"]
+        return roster
+
+
+# 快照存在且与源文件一致时直接从快照加载，否则用 build(class_path, teacher_path) 解析源文件并重新生成快照
+def load_or_compile(class_path, teacher_path, build, snapshot_path=None):
+    snapshot_path = snapshot_path or default_snapshot_path(class_path)
+    paths = [class_path, teacher_path]
+    if os.path.exists(snapshot_path):
+        try:
+            snapshot = RosterSnapshot(snapshot_path)
+            if snapshot.matches(paths):
+                return snapshot.to_roster()
+        except (OSError, ValueError, KeyError, struct.error) as error:
+            print(f"Ignoring unreadable roster snapshot {snapshot_path}: {error}")
+
+    sources = [source_fingerprint(path) for path in paths]
+    roster = build(class_path, teacher_path)
+    roster.derived["sources"] = sources
+    try:
+        compile_snapshot(roster, sources, snapshot_path)
+    except OSError as error:
+        print(f"Could not write roster snapshot {snapshot_path}: {error}")
+    return roster
+
+
+def main():
+    import agent
+
+    parser = argparse.ArgumentParser(description="Compile class_info.json / teacher_info.json into a binary roster snapshot.")
+    parser.add_argument("class_info", nargs="?", default=agent.class_info_filename)
+    parser.add_argument("teacher_info", nargs="?", default=agent.teacher_info_filename)
+    parser.add_argument("-o", "--output", default=None)
+    parser.add_argument("--info", action="store_true", help="print the header of an existing snapshot")
+    args = parser.parse_args()
+
+    snapshot_path = args.output or default_snapshot_path(args.class_info)
+    if not args.info:
+        sources = [source_fingerprint(args.class_info), source_fingerprint(args.teacher_info)]
+        compile_snapshot(agent.parse_roster(args.class_info, args.teacher_info), sources, snapshot_path)
+    header = RosterSnapshot(snapshot_path).header
+    print(json.dumps({key: header[key] for key in ("sources", "strings", "counts")}, ensure_ascii=False, indent=4))
+
+
+if __name__ == "__main__":
+    main()
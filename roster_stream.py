@@ -0,0 +1,178 @@
+import json
+import re
+
+
+# 每次从文件读取的字符数
+stream_chunk_size = 64 * 1024
+# 单条记录（一个课程、班级或教师任课信息）允许的最大字符数，超过时认为文件有误，避免缓冲区无限增长
+max_record_chars = 16 * 1024 * 1024
+
+non_whitespace = re.compile(r'\S')
+structural_chars = re.compile(r'["\[\]{}]')
+string_special_chars = re.compile(r'["\\]')
+decoder = json.JSONDecoder()
+
+
+# 增量读取 JSON：缓冲区中只保留尚未消费的部分，内存占用与单条记录的大小有关，与整个文件的大小无关。
+# iter_object / iter_array 每产出一项后，调用方必须用 read_value / skip_value / iter_* 消费掉对应的值。
+class JsonStream:
+    def __init__(self, file, chunk_size=None):
+        self.file = file
+        self.chunk_size = chunk_size or stream_chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        if self.eof:
+            return False
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def error(self, message):
+        return ValueError(f"{message} near {self.buffer[self.pos:self.pos + 40]!r}")
+
+    def peek(self):
+        while True:
+            match = non_whitespace.search(self.buffer, self.pos)
+            if match:
+                self.pos = match.start()
+                return self.buffer[self.pos]
+            self.pos = len(self.buffer)
+            if not self.fill():
+                return ""
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise self.error(f"Expected {char!r}")
+        self.pos += 1
+
+    def read_value(self):
+        if not self.peek():
+            raise self.error("Unexpected end of JSON input")
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if len(self.buffer) - self.pos > max_record_chars or not self.fill():
+                    raise
+                continue
+            # 数字可能刚好被块边界截断，读到更多内容后重新解析
+            if end == len(self.buffer) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+    def skip_value(self):
+        if self.peek() not in '{[':
+            self.read_value()
+            return
+        depth = 0
+        in_string = False
+        while True:
+            match = (string_special_chars if in_string else structural_chars).search(self.buffer, self.pos)
+            if match is None:
+                self.pos = len(self.buffer)
+                if not self.fill():
+                    raise self.error("Unexpected end of JSON input")
+                continue
+            char = match.group()
+            self.pos = match.end()
+            if in_string:
+                if char == '\\':
+                    if self.pos >= len(self.buffer) and not self.fill():
+                        raise self.error("Unexpected end of JSON input")
+                    self.pos += 1
+                else:
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char in '[{':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def iter_object(self):
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.read_value()
+            if not isinstance(key, str):
+                raise self.error("Expected an object key")
+            self.expect(':')
+            yield key
+            char = self.peek()
+            self.pos += 1
+            if char == '}':
+                return
+            if char != ',':
+                raise self.error("Expected ',' or '}'")
+
+    def iter_array(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield
+            char = self.peek()
+            self.pos += 1
+            if char == ']':
+                return
+            if char != ',':
+                raise self.error("Expected ',' or ']'")
+
+
+# class_info.json：逐条产出 ("course", 课程) 和 ("class", 班级)
+def iter_class_records(file):
+    stream = JsonStream(file)
+    for key in stream.iter_object():
+        if key != "data":
+            stream.skip_value()
+            continue
+        for _ in stream.iter_array():
+            for grade_key in stream.iter_object():
+                if grade_key == "courses":
+                    for _ in stream.iter_array():
+                        yield "course", stream.read_value()
+                elif grade_key == "classes":
+                    for _ in stream.iter_array():
+                        yield "class", stream.read_value()
+                else:
+                    stream.skip_value()
+
+# teacher_info.json：逐条产出 ("teacher_class", 任课信息) 和 ("header_teacher", 班主任)，
+# 每个年级结束时产出 ("grade", gradeDecode)，因为 gradeDecode 可能出现在 teacherClasses 之后
+def iter_teacher_records(file):
+    stream = JsonStream(file)
+    for key in stream.iter_object():
+        if key != "data":
+            stream.skip_value()
+            continue
+        for data_key in stream.iter_object():
+            if data_key != "gradeTeacherClassList":
+                stream.skip_value()
+                continue
+            for _ in stream.iter_array():
+                grade_decode = None
+                for grade_key in stream.iter_object():
+                    if grade_key == "teacherClasses":
+                        for _ in stream.iter_array():
+                            yield "teacher_class", stream.read_value()
+                    elif grade_key == "headerTeachers":
+                        for _ in stream.iter_array():
+                            yield "header_teacher", stream.read_value()
+                    elif grade_key == "gradeDecode":
+                        grade_decode = stream.read_value()
+                    else:
+                        stream.skip_value()
+                yield "grade", grade_decode
@@ -0,0 +1,183 @@
+import json
+import re
+import sys
+from collections import Counter
+
+from generate_json import classify_input
+from metrics import traced
+
+
+# 低于该置信度的分段交给 classify_input(LLM) 处理
+confidence_threshold = 0.8
+
+DAY = r"(?:周|星期)[一二三四五六日天1-7]"
+PERIOD = r"第\s*[0-9一二三四五六七八九十]+\s*节"
+TIME_PERIOD = r"(?:上午|早上|下午|晚上|全天|整天|一整天)"
+GRADE = r"(?:初[一二三]|高[一二三])"
+NUMBER = r"[0-9一二两三四五六七八九十]+"
+WHOLE_WEEK = r"(?:整个?周|每天|一周每天)"
+CLASS = GRADE + r"?\s*[0-9一二三四五六七八九十]+\s*班"
+
+# (情境类型, 正则, 置信度)，按从具体到宽泛的顺序排列，第一个匹配的规则决定分类；
+# 同一分段命中多个不同情境时，说明其中可能有多条约束，交给 LLM 处理
+rules = [
+    ("课程单双周条件", r"单双周", 0.98),
+    ("课程走班关联条件", r"走班", 0.97),
+    ("课程合班条件", r"合班", 0.97),
+    ("课程同一节课最多条件", r"同一节课?最多\s*" + NUMBER + r"\s*个?班", 0.97),
+    ("教师不排同时上课条件", r"不(?:排|在)同一节|不同时上课", 0.95),
+    ("课程不排同一天条件", r"不(?:排|在)同一天", 0.95),
+    ("课程连堂条件", r"连堂", 0.95),
+    ("教师多班连上条件", r"老师.*(?:连着上|连上|连续(?:教授|上课|上))", 0.95),
+    ("课程各天条件", GRADE + r".*每天(?:最少|至少|最多)", 0.9),
+    ("教师时段条件", r"所有老师|没空|教师大会", 0.9),
+    ("教师时段条件", r"老师.*" + WHOLE_WEEK + r"\s*" + PERIOD, 0.85),
+    ("课程时段条件", WHOLE_WEEK + r"\s*" + PERIOD + r".*必排", 0.9),
+    ("课程时段条件", r"^(?!.*老师)" + GRADE + r".*" + DAY + r"\s*必排\s*" + NUMBER + r"?\s*节", 0.85),
+    ("教师各天条件", GRADE + r".*老师.*" + DAY + r"\s*" + TIME_PERIOD + r".*(?:不排|必排)", 0.9),
+    ("教师课时条件", GRADE + r".*老师.*" + DAY + r".*" + PERIOD + r".*(?:不排|必排)", 0.9),
+    ("教师时段条件", r"^(?!.*" + GRADE + r")[一-龥]{2,4}\s*" + DAY + r".*" + PERIOD + r".*(?:必排|不排)", 0.8),
+    ("课程课时条件", r"^(?!.*老师)" + GRADE + r".*" + DAY + r".*" + PERIOD, 0.85),
+]
+compiled_rules = [(classification, re.compile(pattern), confidence) for classification, pattern, confidence in rules]
+
+# 以时间或“不排/必排”开头、且不含年级/教师的片段，视为上一个分段的延续；
+# 分号也用来分隔同一条约束中的班级列表（如 "初一06班;初一07班合班上课"），上一段以班级结尾、这一段以班级开头时同样合并
+continuation_pattern = re.compile(r"^(?:" + DAY + r"|" + PERIOD + r"|" + TIME_PERIOD + r"|每天|不排|必排)")
+anchor_pattern = re.compile(GRADE + r"|老师|所有")
+class_list_end = re.compile(CLASS + r"$")
+class_list_start = re.compile(CLASS)
+separator_pattern = re.compile(r"([，,。；;\n]+)")
+
+
+def split_segments(user_input):
+    parts = separator_pattern.split(str(user_input))
+    segments = []
+    separator = ""
+    for part in parts:
+        if separator_pattern.fullmatch(part):
+            separator = part
+            continue
+        part = part.strip()
+        if not part:
+            continue
+        if segments and (
+            (continuation_pattern.match(part) and not anchor_pattern.search(part))
+            or (class_list_end.search(segments[-1]) and class_list_start.match(part))
+        ):
+            segments[-1] = segments[-1] + (separator.strip()[:1] or "，") + part
+        else:
+            segments.append(part)
+    return segments
+
+def classify_segment(segment):
+    matched = []
+    for classification, pattern, confidence in compiled_rules:
+        if pattern.search(segment):
+            matched.append((classification, confidence))
+    if not matched or len({name for name, _ in matched}) > 1:
+        return None, 0.0
+    return matched[0]
+
+# LLM 返回的分段属于哪个待分类的分段：第一个包含它的分段，找不到时归到最后一个
+def owning_segment(result, pending):
+    text = str(result.get("segment", "")).strip()
+    return next((index for index, segment in enumerate(pending) if text and text in segment), len(pending) - 1)
+
+# 与 classify_input 返回相同格式的 JSON 字符串；规则无法分类的分段合在一起只调用一次 LLM，
+# 返回的结果按所属的分段放回原来的位置
+@traced("classify_input_fast")
+def classify_input_fast(user_input, threshold=confidence_threshold):
+    slots = []
+    pending = []
+    for segment in split_segments(user_input):
+        classification, confidence = classify_segment(segment)
+        if classification and confidence >= threshold:
+            slots.append({
+                "segment": segment,
+                "classification": classification,
+                "confidence": confidence,
+                "source": "rules"
+            })
+            continue
+        slots.append(len(pending))
+        pending.append(segment)
+
+    placed = [[] for _ in pending]
+    if pending:
+        scenario = json.loads(classify_input("\n".join(pending)))
+        for result in scenario.get("results", []):
+            result["source"] = "llm"
+            placed[owning_segment(result, pending)].append(result)
+
+    results = []
+    for slot in slots:
+        if isinstance(slot, int):
+            results.extend(placed[slot])
+        else:
+            results.append(slot)
+    return json.dumps({"results": results}, ensure_ascii=False)
+
+
+# 标注语料为 JSON Lines，每行 {"segment": ..., "classification": ...}，
+# classification 为 null 表示该分段不属于任何情境。
+# classifier_corpus.jsonl 取自 prompt 中的例子，规则按它调整过；classifier_heldout.jsonl 是调整规则时没有用过的写法
+def evaluate(corpus_path, threshold=confidence_threshold):
+    true_positives = Counter()
+    false_positives = Counter()
+    gold_counts = Counter()
+    total = 0
+    covered = 0
+    misclassified = []
+
+    with open(corpus_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            sample = json.loads(line)
+            total += 1
+            expected = sample.get("classification")
+            if expected:
+                gold_counts[expected] += 1
+
+            predicted, confidence = classify_segment(sample["segment"])
+            if not predicted or confidence < threshold:
+                continue
+            covered += 1
+            if predicted == expected:
+                true_positives[predicted] += 1
+            else:
+                false_positives[predicted] += 1
+                misclassified.append({
+                    "segment": sample["segment"],
+                    "expected": expected,
+                    "predicted": predicted,
+                    "confidence": confidence
+                })
+
+    categories = {}
+    for classification in sorted(set(gold_counts) | set(false_positives)):
+        tp = true_positives[classification]
+        predicted_count = tp + false_positives[classification]
+        categories[classification] = {
+            "precision": round(tp / predicted_count, 3) if predicted_count else None,
+            "recall": round(tp / gold_counts[classification], 3) if gold_counts[classification] else None,
+            "support": gold_counts[classification]
+        }
+
+    correct = sum(true_positives.values())
+    return {
+        "threshold": threshold,
+        "samples": total,
+        "coverage": round(covered / total, 3) if total else 0.0,
+        "precision": round(correct / covered, 3) if covered else None,
+        "recall": round(correct / sum(gold_counts.values()), 3) if gold_counts else None,
+        "categories": categories,
+        "misclassified": misclassified
+    }
+
+
+if __name__ == "__main__":
+    corpora = sys.argv[1:] or ['classifier_corpus.jsonl', 'classifier_heldout.jsonl']
+    print(json.dumps({corpus: evaluate(corpus) for corpus in corpora}, ensure_ascii=False, indent=4))
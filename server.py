@@ -0,0 +1,319 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+import agent
+import llm_transport
+import metrics
+from llm_backends import ReplayBackend
+from occupancy import OccupancyModel
+from output_schema import repair_stats
+from project_registry import ProjectRegistry
+from pipeline import iter_input_json
+from rule_classifier import classify_input_fast
+
+
+# 同时处理的请求数上限，超出的请求排队等待
+max_concurrency = 8
+# 检查 roster 文件是否变化的间隔（秒）
+watch_interval = 2.0
+max_body_bytes = 1024 * 1024
+metrics_content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# 服务自身的日志写到 stderr；处理函数的 print 输出默认被丢弃（见 main 的 --verbose）
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+# 常驻内存的 roster：文件的 mtime/大小变化后在后台重新加载，加载完成前继续使用旧的 roster
+class RosterWatcher:
+    def __init__(self, class_path, teacher_path):
+        self.class_path = class_path
+        self.teacher_path = teacher_path
+        self.roster = None
+        self.signature = None
+        self.loaded_at = None
+        self.reloads = 0
+        self._lock = threading.Lock()
+
+    def file_signature(self):
+        signature = []
+        for path in (self.class_path, self.teacher_path):
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def load(self):
+        with self._lock:
+            signature = self.file_signature()
+            roster = agent.load_roster(self.class_path, self.teacher_path)
+            self.roster = roster
+            self.signature = signature
+            self.loaded_at = time.time()
+            self.reloads += 1
+            return roster
+
+    def changed(self):
+        try:
+            return self.file_signature() != self.signature
+        except FileNotFoundError:
+            return False
+
+    # 任何加载错误都只记录下来并继续使用旧的 roster，不能让监视任务退出
+    async def watch(self, loop, interval=watch_interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if self.changed():
+                    await loop.run_in_executor(None, self.load)
+                    log(f"Roster reloaded from {self.class_path}, {self.teacher_path}")
+            except Exception as error:
+                log(f"Roster reload failed, keeping the previous roster: {type(error).__name__}: {error}")
+
+    def status(self):
+        roster = self.roster
+        return {
+            "class_info": self.class_path,
+            "teacher_info": self.teacher_path,
+            "loaded_at": self.loaded_at,
+            "reloads": self.reloads,
+            "classes": len(roster["class_info"]) if roster else 0,
+            "teacher_rows": len(roster["teacher_info"]) if roster else 0
+        }
+
+
+@metrics.traced("process_request")
+def process_request(user_input, roster, mode=None):
+    segments = []
+    # 同一请求中互相矛盾的约束在对应分段中返回 conflicts
+    occupancy = OccupancyModel()
+    for result, segment_json in iter_input_json(user_input, mode or agent.extraction_mode, roster=roster):
+        segment = {"segment": result["segment"], "classification": result["classification"]}
+        try:
+            segment["output"] = agent.handle_segment(result, segment_json, roster)
+            conflicts = occupancy.add_output(segment["output"], result["segment"])
+            if conflicts:
+                segment["conflicts"] = conflicts
+        except (ValueError, KeyError, TypeError, IndexError) as error:
+            segment["error"] = f"{type(error).__name__}: {error}"
+        segments.append(segment)
+    return {"segments": segments}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# watcher 是默认 roster（请求中没有 projectId 时使用），projects 是按 projectId 加载 roster 的 ProjectRegistry，都可以为 None
+class SchedulingServer:
+    def __init__(self, watcher, concurrency=max_concurrency, projects=None):
+        self.watcher = watcher
+        self.projects = projects
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.requests = 0
+        self.in_flight = 0
+
+    async def run_blocking(self, function, *args):
+        async with self.semaphore:
+            self.in_flight += 1
+            try:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self.executor, function, *args)
+            finally:
+                self.in_flight -= 1
+
+    async def route(self, method, path, body):
+        if method == "GET" and path == "/healthz":
+            return {
+                "status": "ok",
+                "roster": self.watcher.status() if self.watcher else None,
+                "projects": self.projects.status() if self.projects else None,
+                "requests": self.requests,
+                "in_flight": self.in_flight,
+                "llm_circuit": llm_transport.breaker.state,
+                "llm_json": repair_stats()
+            }
+        if method != "POST":
+            raise HttpError(HTTPStatus.NOT_FOUND, f"Unknown endpoint {method} {path}")
+
+        if path == "/v1/reload":
+            if self.projects:
+                self.projects.clear()
+            if self.watcher:
+                await self.run_blocking(self.watcher.load)
+            return {"status": "reloaded", "roster": self.watcher.status() if self.watcher else None}
+
+        request = parse_json_body(body)
+        user_input = request.get("input")
+        if not isinstance(user_input, str) or not user_input.strip():
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Request must contain a non-empty 'input' string.")
+
+        if path == "/v1/classify":
+            return json.loads(await self.run_blocking(classify_input_fast, user_input))
+        if path == "/v1/process":
+            mode = request.get("mode")
+            roster = await self.run_blocking(self.roster_for, request)
+            return await self.run_blocking(process_request, user_input, roster, mode)
+        raise HttpError(HTTPStatus.NOT_FOUND, f"Unknown endpoint {method} {path}")
+
+    # 请求中有 projectId（可选 scenarioId）时从 ProjectRegistry 取对应项目的 roster，可能需要先加载
+    def roster_for(self, request):
+        project_id = request.get("projectId")
+        if project_id is None:
+            if self.watcher is None:
+                raise HttpError(HTTPStatus.BAD_REQUEST, "Request must contain 'projectId'.")
+            return self.watcher.roster
+        if self.projects is None:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "This server has no project registry, start it with --projects.")
+        scenario_id = request.get("scenarioId")
+        try:
+            return self.projects.get(int(project_id), int(scenario_id) if scenario_id is not None else None)
+        except (TypeError, ValueError):
+            raise HttpError(HTTPStatus.BAD_REQUEST, "'projectId' and 'scenarioId' must be integers.")
+        except KeyError as error:
+            raise HttpError(HTTPStatus.NOT_FOUND, error.args[0])
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                self.requests += 1
+                keep_alive = headers.get("connection", "").lower() != "close"
+                if method == "GET" and path == "/metrics":
+                    await write_response(writer, HTTPStatus.OK, metrics.registry.render(), keep_alive, metrics_content_type)
+                    if not keep_alive:
+                        break
+                    continue
+                try:
+                    status, payload = HTTPStatus.OK, await self.route(method, path, body)
+                except HttpError as error:
+                    status, payload = error.status, {"error": str(error)}
+                except Exception as error:
+                    status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": f"{type(error).__name__}: {error}"}
+                await write_response(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except HttpError as error:
+            await write_response(writer, error.status, {"error": str(error)}, False)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def parse_json_body(body):
+    try:
+        request = json.loads(body or b"{}")
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        raise HttpError(HTTPStatus.BAD_REQUEST, "Request body is not valid JSON.")
+    if not isinstance(request, dict):
+        raise HttpError(HTTPStatus.BAD_REQUEST, "Request body must be a JSON object.")
+    return request
+
+async def read_request(reader):
+    request_line = await reader.readline()
+    if not request_line or not request_line.strip():
+        return None
+    try:
+        method, path, _ = request_line.decode('latin-1').split(None, 2)
+    except ValueError:
+        raise HttpError(HTTPStatus.BAD_REQUEST, "Malformed request line.")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode('latin-1').partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    length = headers.get("content-length") or "0"
+    if not (length.isascii() and length.isdigit()):
+        raise HttpError(HTTPStatus.BAD_REQUEST, "Content-Length must be a non-negative integer.")
+    length = int(length)
+    if length > max_body_bytes:
+        raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Request body too large.")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), path.split("?", 1)[0], headers, body
+
+# payload 为 str 时原样输出（如 /metrics 的文本格式），否则序列化为 JSON
+async def write_response(writer, status, payload, keep_alive=True, content_type="application/json; charset=utf-8"):
+    if isinstance(payload, str):
+        body = payload.encode('utf-8')
+    else:
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    head = (
+        f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    writer.write(head.encode('latin-1') + body)
+    await writer.drain()
+
+
+# 指定 projects_path 时按 projectId 服务多个项目；这时默认 roster 文件不存在也可以启动
+async def serve(host="127.0.0.1", port=8080, class_path=None, teacher_path=None, concurrency=max_concurrency,
+                projects_path=None, roster_memory_limit=None):
+    loop = asyncio.get_running_loop()
+    class_path = class_path or agent.class_info_filename
+    projects = ProjectRegistry.from_file(projects_path, roster_memory_limit) if projects_path else None
+    watcher = None
+    if projects is None or os.path.exists(class_path):
+        watcher = RosterWatcher(class_path, teacher_path or agent.teacher_info_filename)
+        await loop.run_in_executor(None, watcher.load)
+    app = SchedulingServer(watcher, concurrency, projects)
+    server = await asyncio.start_server(app.handle_connection, host, port)
+    watch_task = asyncio.create_task(watcher.watch(loop)) if watcher else None
+    log(f"Scheduling assistant listening on http://{host}:{server.sockets[0].getsockname()[1]}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if watch_task:
+            watch_task.cancel()
+        app.executor.shutdown(wait=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scheduling assistant HTTP/JSON server with a warm roster.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--class-info", default=agent.class_info_filename)
+    parser.add_argument("--teacher-info", default=agent.teacher_info_filename)
+    parser.add_argument("--concurrency", type=int, default=max_concurrency)
+    parser.add_argument("--replay", default=None, help="answer LLM calls from this recordings file instead of a live backend")
+    parser.add_argument("--projects", default=None, help="projects.json mapping projectId / scenario ids to roster files")
+    parser.add_argument("--roster-memory-mb", type=int, default=None, help="estimated memory limit for the loaded project rosters")
+    parser.add_argument("--verbose", action="store_true", help="keep the handlers' console output")
+    args = parser.parse_args()
+
+    if args.replay:
+        llm_transport.set_backend(ReplayBackend(args.replay))
+    memory_limit = args.roster_memory_mb * 1024 * 1024 if args.roster_memory_mb is not None else None
+    with contextlib.ExitStack() as stack:
+        if not args.verbose:
+            devnull = stack.enter_context(open(os.devnull, 'w', encoding='utf-8'))
+            stack.enter_context(contextlib.redirect_stdout(devnull))
+        try:
+            asyncio.run(serve(args.host, args.port, args.class_info, args.teacher_info, args.concurrency, args.projects, memory_limit))
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()